@@ -0,0 +1,64 @@
+# coding: utf-8
+"""
+    benchmarks.bench_batches
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares iterating over items one by one
+    (:class:`sickle.iterator.OAIItemIterator`) with iterating over page
+    batches (:class:`sickle.iterator.OAIBatchIterator`). Pages are parsed
+    beforehand so that only the iteration and mapping are measured.
+
+    Run with ``python benchmarks/bench_batches.py``.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sickle import Sickle  # noqa: E402
+from sickle.iterator import OAIItemIterator, OAIBatchIterator  # noqa: E402
+
+from pages import list_identifiers_page, list_records_page  # noqa: E402
+from pages import parsed_pages  # noqa: E402
+
+
+def run(iterator, verb, responses, **kwargs):
+    sickle = Sickle('http://localhost', iterator=iterator,
+                    token_expiry_margin=None)
+    pages = iter(responses)
+    sickle.harvest = lambda **params: next(pages)
+    params = {'verb': verb, 'metadataPrefix': 'oai_dc'}
+    if iterator is OAIBatchIterator:
+        return sum(len(batch.items) for batch in sickle.iterator(
+            sickle, params, **kwargs))
+    return sum(1 for _ in sickle.iterator(sickle, params, **kwargs))
+
+
+def main():
+    for verb, pages in (
+            ('ListIdentifiers', [list_identifiers_page(1000, seed=n)
+                                 for n in range(10)]),
+            ('ListRecords', [list_records_page(200, seed=n)
+                             for n in range(10)])):
+        responses = parsed_pages(pages)
+        for kwargs in ({}, {'ignore_deleted': True}):
+            timings = {}
+            for iterator in (OAIItemIterator, OAIBatchIterator):
+                items = run(iterator, verb, responses, **kwargs)
+                timings[iterator] = min(timeit.repeat(
+                    lambda: run(iterator, verb, responses, **kwargs),
+                    number=3, repeat=5)) / 3
+            print('%-15s %-22s %5d items  items %7.2f ms  batches %7.2f ms'
+                  '  (%+.0f%%)' % (
+                      verb, kwargs and 'ignore_deleted' or 'all', items,
+                      timings[OAIItemIterator] * 1000,
+                      timings[OAIBatchIterator] * 1000,
+                      (timings[OAIBatchIterator] /
+                       timings[OAIItemIterator] - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
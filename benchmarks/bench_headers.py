@@ -0,0 +1,53 @@
+# coding: utf-8
+"""
+    benchmarks.bench_headers
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the extraction of header fields via :class:`sickle.models.Header`
+    objects with :func:`sickle.columns.header_columns`.
+
+    Run with ``python benchmarks/bench_headers.py``.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree  # noqa: E402
+
+from sickle.columns import header_columns  # noqa: E402
+from sickle.models import Header  # noqa: E402
+
+from pages import list_identifiers_page  # noqa: E402
+
+NS = '{http://www.openarchives.org/OAI/2.0/}'
+
+
+def with_header_objects(tree):
+    headers = [Header(e) for e in tree.iterfind('.//' + NS + 'header')]
+    return {
+        'identifier': [h.identifier for h in headers],
+        'datestamp': [h.datestamp for h in headers],
+        'deleted': [h.deleted for h in headers],
+        'setSpecs': [h.setSpecs for h in headers],
+    }
+
+
+def main():
+    for size in (100, 1000, 10000):
+        tree = etree.XML(list_identifiers_page(size))
+        assert with_header_objects(tree) == header_columns(tree)
+        number = max(1, 20000 // size)
+        for name, func in (('Header objects', with_header_objects),
+                           ('header_columns', header_columns)):
+            seconds = min(timeit.repeat(lambda: func(tree), number=number,
+                                        repeat=3)) / number
+            print('%6d headers/page  %-15s %8.2f ms/page %10.0f headers/s' % (
+                size, name, seconds * 1000, size / seconds))
+
+
+if __name__ == '__main__':
+    main()
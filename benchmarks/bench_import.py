@@ -0,0 +1,49 @@
+# coding: utf-8
+"""
+    benchmarks.bench_import
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the time needed to import Sickle in a fresh interpreter.
+
+    Run with ``python benchmarks/bench_import.py``.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATEMENTS = (
+    'import sickle',
+    'from sickle import Sickle',
+    'from sickle import Sickle; Sickle("http://localhost")',
+    'import requests',
+    'import lxml.etree',
+)
+
+SCRIPT = """\
+import time
+start = time.time()
+%s
+print(time.time() - start)
+"""
+
+
+def measure(statement, repeat=10):
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', SCRIPT % statement], cwd=ROOT)
+        timings.append(float(output))
+    return min(timings)
+
+
+def main():
+    for statement in STATEMENTS:
+        print('%-60s %7.1f ms' % (statement, measure(statement) * 1000))
+
+
+if __name__ == '__main__':
+    main()
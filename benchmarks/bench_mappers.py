@@ -0,0 +1,52 @@
+# coding: utf-8
+"""
+    benchmarks.bench_mappers
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the generic :class:`sickle.models.Record` mapper with the
+    format-specific mappers in :mod:`sickle.formats`.
+
+    Run with ``python benchmarks/bench_mappers.py``.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree  # noqa: E402
+
+from sickle.formats import DublinCoreRecord, MARCXMLRecord  # noqa: E402
+from sickle.models import Record  # noqa: E402
+
+from pages import list_records_page  # noqa: E402
+
+NS = '{http://www.openarchives.org/OAI/2.0/}'
+
+
+def main():
+    for metadata, fast_class in (('oai_dc', DublinCoreRecord),
+                                 ('marc21', MARCXMLRecord)):
+        for size in (100, 500):
+            tree = etree.XML(list_records_page(size, metadata))
+            elements = tree.findall('.//' + NS + 'record')
+            number = max(1, 5000 // size)
+            for record_class in (Record, fast_class):
+                records = [record_class(e) for e in elements]
+                records = [r for r in records if not r.deleted]
+                mapping = min(timeit.repeat(
+                    lambda: [record_class(e) for e in elements],
+                    number=number, repeat=5)) / number
+                metadata_only = min(timeit.repeat(
+                    lambda: [r.get_metadata() for r in records],
+                    number=number, repeat=5)) / number
+                print('%-7s %4d records/page  %-16s  mapping %7.2f ms/page'
+                      '  get_metadata %7.2f ms/page' % (
+                          metadata, size, record_class.__name__,
+                          mapping * 1000, metadata_only * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+# coding: utf-8
+"""
+    benchmarks.bench_micro
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Micro-benchmarks of the hot CPU paths of harvesting: parsing a page
+    (:attr:`sickle.response.OAIResponse.xml`), mapping headers and records,
+    :func:`sickle.utils.xml_to_dict`, :func:`sickle.utils.get_namespace`
+    and :meth:`sickle.iterator.OAIItemIterator.next`, measured on generated
+    oai_dc, MARCXML and large headers-only pages.
+
+    Results are written as JSON and can be compared with the results of an
+    earlier commit; the script exits with status 1 if a benchmark is slower
+    than the baseline by more than the threshold::
+
+        python benchmarks/bench_micro.py --output baseline.json
+        git checkout my-branch
+        python benchmarks/bench_micro.py --compare baseline.json \\
+            --threshold 0.1
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree  # noqa: E402
+
+from sickle import Sickle  # noqa: E402
+from sickle.iterator import OAIItemIterator  # noqa: E402
+from sickle.models import Header, Record  # noqa: E402
+from sickle.response import OAIResponse  # noqa: E402
+from sickle.utils import get_namespace, xml_to_dict  # noqa: E402
+
+from pages import list_identifiers_page, list_records_page  # noqa: E402
+from pages import PageResponse, parsed_pages  # noqa: E402
+
+NS = '{http://www.openarchives.org/OAI/2.0/}'
+
+#: Format version of the result files
+RESULTS_VERSION = 1
+
+
+def _elements(page, tag):
+    return list(etree.XML(page).iter(NS + tag))
+
+
+def _metadata(page):
+    return [record.find(NS + 'metadata')[0]
+            for record in _elements(page, 'record')
+            if record.find(NS + 'metadata') is not None]
+
+
+def _iterate(verb, responses):
+    def run():
+        sickle = Sickle('http://localhost', token_expiry_margin=None)
+        pages = iter(responses)
+        sickle.harvest = lambda **params: next(pages)
+        for _ in OAIItemIterator(sickle, {'verb': verb,
+                                          'metadataPrefix': 'oai_dc'}):
+            pass
+    return run
+
+
+def cases():
+    """Return ``(name, function, items)`` tuples. Each call of `function`
+    processes `items` items."""
+    dc = list_records_page(200)
+    marc = list_records_page(200, 'marc21')
+    headers = list_identifiers_page(10000)
+    result = []
+
+    for name, page, items in (('oai_dc x200', dc, 200),
+                              ('marc21 x200', marc, 200),
+                              ('ListIdentifiers x10000', headers, 10000)):
+        result.append((
+            'OAIResponse.xml %s' % name,
+            lambda page=page: OAIResponse(PageResponse(page), {}).xml,
+            items))
+
+    # Default arguments bind the current values, the names are reused below
+    elements = _elements(headers, 'header')
+    result.append(('Header.__init__ x10000',
+                   lambda elements=elements: [Header(e) for e in elements],
+                   len(elements)))
+    for name, page in (('oai_dc', dc), ('marc21', marc)):
+        elements = _elements(page, 'record')
+        result.append(('Record.__init__ %s x200' % name,
+                       lambda elements=elements: [Record(e) for e in elements],
+                       len(elements)))
+        metadata = _metadata(page)
+        result.append(('xml_to_dict %s' % name,
+                       lambda metadata=metadata: [
+                           xml_to_dict(m, strip_ns=True) for m in metadata],
+                       len(metadata)))
+
+    elements = _elements(dc, 'record')
+    result.append(('get_namespace', lambda elements=elements: [
+        get_namespace(e) for e in elements], len(elements)))
+
+    result.append((
+        'OAIItemIterator.next ListIdentifiers 10x1000',
+        _iterate('ListIdentifiers', parsed_pages(
+            [list_identifiers_page(1000, seed=n) for n in range(10)])),
+        10000))
+    result.append((
+        'OAIItemIterator.next ListRecords oai_dc 10x200',
+        _iterate('ListRecords', parsed_pages(
+            [list_records_page(200, seed=n) for n in range(10)])),
+        2000))
+    return result
+
+
+def measure(function, min_seconds, repeat):
+    """Return the fastest time of one call in seconds."""
+    number = 1
+    while True:
+        seconds = timeit.timeit(function, number=number)
+        if seconds >= min_seconds:
+            break
+        number *= 2
+    return min(timeit.repeat(function, number=number,
+                             repeat=repeat)) / number
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(selection=None, min_seconds=0.2, repeat=5):
+    results = {}
+    for name, function, items in cases():
+        if selection and not any(s in name for s in selection):
+            continue
+        seconds = measure(function, min_seconds, repeat)
+        results[name] = {
+            'seconds': seconds,
+            'items': items,
+            'us_per_item': seconds / items * 1e6,
+        }
+        print('%-48s %10.3f ms %10.2f us/item' % (
+            name, seconds * 1000, results[name]['us_per_item']))
+    return {
+        'version': RESULTS_VERSION,
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'lxml': etree.__version__,
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print the change of each benchmark against `baseline` and return the
+    names of those that are slower by more than `threshold`."""
+    regressions = []
+    print('\nCompared with %s (threshold %+.0f%%):' % (
+        baseline.get('commit') or 'baseline', threshold * 100))
+    for name, result in sorted(results['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None:
+            print('%-48s %12s' % (name, 'new'))
+            continue
+        change = result['seconds'] / base['seconds'] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print('%-48s %+11.1f%%%s' % (name, change * 100,
+                                     '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the micro-benchmarks of sickle.')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare with the results in this file')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='allowed slowdown as a fraction '
+                             '(default: %(default)s)')
+    parser.add_argument('--min-seconds', type=float, default=0.2,
+                        help='minimum duration of a measurement '
+                             '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='measurements per benchmark, the fastest '
+                             'counts (default: %(default)s)')
+    parser.add_argument('benchmarks', nargs='*',
+                        help='run only benchmarks whose name contains one of '
+                             'these strings')
+    args = parser.parse_args(argv)
+
+    results = run(args.benchmarks, args.min_seconds, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        if baseline.get('version') != RESULTS_VERSION:
+            parser.error('unsupported result file version in %s' %
+                         args.compare)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
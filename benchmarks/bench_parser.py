@@ -0,0 +1,54 @@
+# coding: utf-8
+"""
+    benchmarks.bench_parser
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the parse speed of the parser configurations offered by
+    :mod:`sickle.response`.
+
+    Run with ``python benchmarks/bench_parser.py``.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree  # noqa: E402
+
+from sickle.response import XMLParser, parse_xml, RECOVER, STRICT, FAST  # noqa: E402
+
+from pages import list_identifiers_page, list_records_page  # noqa: E402
+
+CONFIGURATIONS = (
+    ('shared module parser', lambda c: etree.XML(c, parser=XMLParser)),
+    ('recover', lambda c: parse_xml(c, mode=RECOVER)),
+    ('strict', lambda c: parse_xml(c, mode=STRICT)),
+    ('fast', lambda c: parse_xml(c, mode=FAST)),
+    ('fast, huge_tree', lambda c: parse_xml(c, mode=FAST, huge_tree=True)),
+    ('fast, keep blank text',
+     lambda c: parse_xml(c, mode=FAST, remove_blank_text=False)),
+)
+
+
+def main():
+    pages = (
+        ('ListRecords oai_dc x100', list_records_page(100)),
+        ('ListRecords oai_dc x1000', list_records_page(1000)),
+        ('ListRecords marc21 x500', list_records_page(500, 'marc21')),
+        ('ListIdentifiers x10000', list_identifiers_page(10000)),
+    )
+    for page_name, content in pages:
+        print('%s (%d kB)' % (page_name, len(content) // 1024))
+        number = max(1, 2000000 // len(content))
+        for name, func in CONFIGURATIONS:
+            seconds = min(timeit.repeat(lambda: func(content), number=number,
+                                        repeat=5)) / number
+            print('    %-24s %8.3f ms/page %8.1f MB/s' % (
+                name, seconds * 1000, len(content) / seconds / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# coding: utf-8
+"""
+    benchmarks.bench_serialize
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares :mod:`sickle.serialize` with pickling the dictionary form of
+    records (header fields and metadata). Pickling the dictionary only
+    yields plain data; :func:`sickle.serialize.decode` returns record
+    objects.
+
+    Run with ``python benchmarks/bench_serialize.py``.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import pickle
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree  # noqa: E402
+
+from sickle import serialize  # noqa: E402
+from sickle.models import Record  # noqa: E402
+
+from pages import list_records_page  # noqa: E402
+
+
+def as_dict(record):
+    header = record.header
+    return {
+        'identifier': header.identifier,
+        'datestamp': header.datestamp,
+        'setSpecs': header.setSpecs,
+        'deleted': header.deleted,
+        'metadata': getattr(record, 'metadata', None),
+    }
+
+
+def measure(name, encode, decode, items):
+    encoded = [encode(item) for item in items]
+    size = sum(len(data) for data in encoded)
+    encode_time = min(timeit.repeat(
+        lambda: [encode(item) for item in items], number=1, repeat=5))
+    decode_time = min(timeit.repeat(
+        lambda: [decode(data) for data in encoded], number=1, repeat=5))
+    print('%-24s %6.0f bytes/item  encode %8.0f items/s  '
+          'decode %8.0f items/s' % (
+              name, float(size) / len(items), len(items) / encode_time,
+              len(items) / decode_time))
+
+
+def main():
+    tree = etree.XML(list_records_page(2000, seed=1))
+    records = [Record(element) for element in tree.iter(
+        '{http://www.openarchives.org/OAI/2.0/}record')]
+    dicts = [as_dict(record) for record in records]
+    print('msgpack package: %s' % (
+        'installed' if serialize.msgpack else 'not installed'))
+    measure('pickle (dict form)',
+            lambda item: pickle.dumps(item, pickle.HIGHEST_PROTOCOL),
+            pickle.loads, dicts)
+    measure('serialize', serialize.encode, serialize.decode, records)
+    measure('serialize (raw=True)',
+            lambda item: serialize.encode(item, raw=True),
+            serialize.decode, records)
+    if serialize.msgpack is not None:
+        msgpack, serialize.msgpack = serialize.msgpack, None
+        try:
+            measure('serialize (pure Python)', serialize.encode,
+                    serialize.decode, records)
+        finally:
+            serialize.msgpack = msgpack
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# coding: utf-8
+"""
+    benchmarks.bench_sink
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Compares writing records with :class:`sickle.sink.SQLiteSink` to
+    upserting and committing them one row at a time. Records are mapped
+    beforehand so that only the writing is measured.
+
+    Run with ``python benchmarks/bench_sink.py``.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree  # noqa: E402
+
+from sickle.models import Record  # noqa: E402
+from sickle.sink import SQLiteSink  # noqa: E402
+
+from pages import list_records_page  # noqa: E402
+
+
+def records(pages):
+    result = []
+    for page in pages:
+        tree = etree.XML(page)
+        result.extend(Record(element) for element in tree.iter(
+            '{http://www.openarchives.org/OAI/2.0/}record'))
+    return result
+
+
+def row_by_row(path, items):
+    connection = sqlite3.connect(path)
+    connection.execute(
+        'CREATE TABLE records (identifier TEXT PRIMARY KEY, datestamp TEXT, '
+        'deleted INTEGER NOT NULL, raw TEXT)')
+    for item in items:
+        if item.deleted:
+            connection.execute('DELETE FROM records WHERE identifier = ?',
+                               (item.header.identifier,))
+        else:
+            connection.execute(
+                'INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)',
+                (item.header.identifier, item.header.datestamp, 0, item.raw))
+        connection.commit()
+    connection.close()
+
+
+def sink(path, items):
+    sink = SQLiteSink(path, fields=['title', 'creator', 'date'])
+    stats = sink.consume(items)
+    sink.close()
+    return stats
+
+
+def main():
+    items = records([list_records_page(500, seed=n) for n in range(10)])
+    directory = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        row_by_row(os.path.join(directory, 'rows.db'), items)
+        seconds = time.time() - start
+        print('row by row  %6d rows  %9.1f rows/s' % (
+            len(items), len(items) / seconds))
+        stats = sink(os.path.join(directory, 'sink.db'), items)
+        print('SQLiteSink  %6d rows  %9.1f rows/s  (%d deleted)' % (
+            stats.rows, stats.rows_per_second, stats.deleted))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# coding: utf-8
+"""
+    benchmarks.bench_transform
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares transforming records with :class:`sickle.transform.XSLTStage`
+    (inline, in worker threads and in worker processes) with compiling the
+    stylesheet and re-parsing the serialized record for every record.
+
+    Run with ``python benchmarks/bench_transform.py``.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree  # noqa: E402
+
+from sickle.models import Record  # noqa: E402
+from sickle.transform import XSLTStage  # noqa: E402
+
+from pages import list_records_page  # noqa: E402
+
+# Produces a small document per record and does some string work per field
+STYLESHEET = b'''<xsl:stylesheet version="1.0"
+    xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
+    xmlns:oai="http://www.openarchives.org/OAI/2.0/"
+    xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <xsl:template match="/">
+    <item id="{//oai:header/oai:identifier}">
+      <xsl:for-each select="//dc:*">
+        <xsl:sort select="local-name()"/>
+        <field name="{local-name()}">
+          <xsl:value-of select="translate(normalize-space(.),
+            'abcdefghijklmnopqrstuvwxyz', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ')"/>
+        </field>
+      </xsl:for-each>
+    </item>
+  </xsl:template>
+</xsl:stylesheet>'''
+
+
+def naive(records):
+    for record in records:
+        transform = etree.XSLT(etree.XML(STYLESHEET))
+        yield transform(etree.XML(etree.tostring(record.xml)))
+
+
+def main():
+    records = []
+    for seed in range(10):
+        tree = etree.XML(list_records_page(500, seed=seed))
+        records.extend(Record(e) for e in tree.iter(
+            '{http://www.openarchives.org/OAI/2.0/}record'))
+    for name, run in (
+            ('compile per record', naive),
+            ('XSLTStage inline', XSLTStage(STYLESHEET)),
+            ('XSLTStage 4 threads', XSLTStage(STYLESHEET, workers=4)),
+            ('XSLTStage 4 processes', XSLTStage(STYLESHEET, workers=4,
+                                                processes=True))):
+        start = time.time()
+        count = sum(1 for _ in run(records))
+        seconds = time.time() - start
+        print('%-24s %6d records %8.0f records/s' % (
+            name, count, count / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# coding: utf-8
+"""
+    benchmarks.pages
+    ~~~~~~~~~~~~~~~~
+
+    Generators for synthetic OAI-PMH pages of realistic sizes and fixtures
+    shared by the benchmarks. The benchmarks put the repository on
+    ``sys.path`` before importing this module.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import random
+import re
+
+from sickle.response import OAIResponse
+
+OAI_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n'
+    '<responseDate>2020-05-17T10:00:00Z</responseDate>\n'
+    '<request verb="%(verb)s" metadataPrefix="%(prefix)s">'
+    'http://example.org/oai</request>\n<%(verb)s>\n')
+OAI_TAIL = (
+    '<resumptionToken completeListSize="%(size)d" cursor="0">'
+    'token-%(n)d</resumptionToken>\n</%(verb)s>\n</OAI-PMH>\n')
+
+HEADER = (
+    '<header%(status)s><identifier>oai:example.org:%(n)d</identifier>'
+    '<datestamp>2019-%(month)02d-%(day)02dT12:00:00Z</datestamp>'
+    '%(sets)s</header>\n')
+
+DC = (
+    '<metadata><oai_dc:dc '
+    'xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+    '<dc:title>Title of record %(n)d</dc:title>'
+    '<dc:creator>Doe, Jane</dc:creator><dc:creator>Roe, Richard</dc:creator>'
+    '<dc:subject>Physics</dc:subject><dc:subject>Mathematics</dc:subject>'
+    '<dc:description>%(text)s</dc:description>'
+    '<dc:date>2019</dc:date><dc:type>Text</dc:type>'
+    '<dc:identifier>http://example.org/record/%(n)d</dc:identifier>'
+    '<dc:language>en</dc:language>'
+    '</oai_dc:dc></metadata>\n')
+
+MARC = (
+    '<metadata><marc:record xmlns:marc="http://www.loc.gov/MARC21/slim">'
+    '<marc:leader>00000nam a2200000 a 4500</marc:leader>'
+    '<marc:controlfield tag="001">%(n)d</marc:controlfield>'
+    '<marc:controlfield tag="008">190101s2019    xx            000 0 eng d'
+    '</marc:controlfield>'
+    '<marc:datafield tag="100" ind1="1" ind2=" ">'
+    '<marc:subfield code="a">Doe, Jane</marc:subfield></marc:datafield>'
+    '<marc:datafield tag="245" ind1="1" ind2="0">'
+    '<marc:subfield code="a">Title of record %(n)d</marc:subfield>'
+    '<marc:subfield code="b">a subtitle</marc:subfield></marc:datafield>'
+    '<marc:datafield tag="520" ind1=" " ind2=" ">'
+    '<marc:subfield code="a">%(text)s</marc:subfield></marc:datafield>'
+    '<marc:datafield tag="650" ind1=" " ind2="0">'
+    '<marc:subfield code="a">Physics</marc:subfield>'
+    '<marc:subfield code="x">History</marc:subfield></marc:datafield>'
+    '<marc:datafield tag="650" ind1=" " ind2="0">'
+    '<marc:subfield code="a">Mathematics</marc:subfield></marc:datafield>'
+    '<marc:datafield tag="856" ind1="4" ind2="0">'
+    '<marc:subfield code="u">http://example.org/record/%(n)d</marc:subfield>'
+    '</marc:datafield>'
+    '</marc:record></metadata>\n')
+
+TEXT = ('Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do '
+        'eiusmod tempor incididunt ut labore et dolore magna aliqua. ') * 3
+
+
+def _header(n, rnd, deleted_ratio):
+    deleted = rnd.random() < deleted_ratio
+    sets = ''.join('<setSpec>set%d</setSpec>' % rnd.randint(0, 20)
+                   for _ in range(rnd.randint(0, 3)))
+    return HEADER % {
+        'status': ' status="deleted"' if deleted else '',
+        'n': n, 'month': rnd.randint(1, 12), 'day': rnd.randint(1, 28),
+        'sets': sets}, deleted
+
+
+def list_identifiers_page(size=1000, deleted_ratio=0.1, seed=0):
+    """Return a ListIdentifiers page with `size` headers as bytes."""
+    rnd = random.Random(seed)
+    parts = [OAI_HEAD % {'verb': 'ListIdentifiers', 'prefix': 'oai_dc'}]
+    for n in range(size):
+        parts.append(_header(n, rnd, deleted_ratio)[0])
+    parts.append(OAI_TAIL % {'verb': 'ListIdentifiers', 'size': size * 10,
+                             'n': seed})
+    return ''.join(parts).encode('utf-8')
+
+
+def list_records_page(size=100, metadata='oai_dc', deleted_ratio=0.1,
+                      seed=0):
+    """Return a ListRecords page with `size` records as bytes.
+
+    :param metadata: ``oai_dc`` or ``marc21``.
+    """
+    rnd = random.Random(seed)
+    template = DC if metadata == 'oai_dc' else MARC
+    parts = [OAI_HEAD % {'verb': 'ListRecords', 'prefix': metadata}]
+    for n in range(size):
+        header, deleted = _header(n, rnd, deleted_ratio)
+        parts.append('<record>')
+        parts.append(header)
+        if not deleted:
+            parts.append(template % {'n': n, 'text': TEXT})
+        parts.append('</record>\n')
+    parts.append(OAI_TAIL % {'verb': 'ListRecords', 'size': size * 10,
+                             'n': seed})
+    return ''.join(parts).encode('utf-8')
+
+
+class PageResponse(object):
+    """Mimics the HTTP response object for a generated page."""
+
+    def __init__(self, content):
+        self.content = content
+
+
+def parsed_pages(pages):
+    """Return the pages as parsed :class:`sickle.response.OAIResponse`
+    objects. The resumption token of the last page is removed, so that it
+    ends the list."""
+    responses = []
+    for number, page in enumerate(pages):
+        if number == len(pages) - 1:
+            page = re.sub(b'<resumptionToken[^>]*>[^<]*</resumptionToken>',
+                          b'', page)
+        response = OAIResponse(PageResponse(page), {})
+        response.xml
+        responses.append(response)
+    return responses
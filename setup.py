@@ -19,7 +19,11 @@ setup(
     ],
     install_requires=[
         'requests>=1.1.0',
-        'lxml>=3.2.3'],
+        'lxml>=3.2.3',
+        'futures>=3.0.0; python_version < "3"'],
+    extras_require={
+        'msgpack': ['msgpack>=0.6.0'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'License :: OSI Approved :: BSD License',
@@ -30,6 +34,10 @@ setup(
         'Programming Language :: Python :: 3.5',
         'Topic :: Text Processing :: Markup :: XML',
     ],
+    entry_points={
+        'console_scripts': ['sickle = sickle.cli:main',
+                            'sickle-proxy = sickle.proxy:main'],
+    },
     test_suite="sickle.tests",
     keywords="oai oai-pmh",
     zip_safe=False,
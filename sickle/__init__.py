@@ -8,7 +8,31 @@
     :copyright: Copyright 2015 Mathias Loesch
 """
 
+import sys
+
 __version__ = '0.7.0'
 
-from sickle.response import OAIResponse
-from .app import Sickle
+# Attributes of the package that are imported on first access only, which
+# keeps ``import sickle`` cheap for short-lived processes
+_LAZY_ATTRIBUTES = {
+    'Sickle': 'sickle.app',
+    'OAIResponse': 'sickle.response',
+}
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        try:
+            module_name = _LAZY_ATTRIBUTES[name]
+        except KeyError:
+            raise AttributeError(
+                "module 'sickle' has no attribute '%s'" % name)
+        module = __import__(module_name, fromlist=[name])
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
+else:  # pragma: no cover
+    from sickle.response import OAIResponse
+    from .app import Sickle
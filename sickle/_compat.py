@@ -9,9 +9,13 @@
 """
 
 import sys
+import time
 
 PY3 = sys.version_info >= (3, 0)
 
+#: Monotonic clock for measuring durations (wall clock on Python 2)
+monotonic = getattr(time, 'monotonic', time.time)
+
 if PY3:  # pragma: no cover
     string_types = str,
     text_type = str
@@ -7,17 +7,26 @@
 
     :copyright: Copyright 2015 Mathias Loesch
 """
+import copy
 import inspect
 import logging
+import threading
 import time
+import uuid
 
-import requests
-
+from sickle import oaiexceptions
+from sickle._compat import monotonic
+from sickle.hooks import dispatch_hook, REQUEST_START, RESPONSE_RECEIVED, \
+    PARSED, RETRIED, FAILED
 from sickle.iterator import BaseOAIIterator, OAIItemIterator
-from sickle.response import OAIResponse
+from sickle.response import OAIResponse, PARSER_MODES, RECOVER
+from sickle.utils import LazyModule
 from .models import (Set, Record, Header, MetadataFormat,
                      Identify)
 
+# requests is only imported when the first request is made
+requests = LazyModule('requests')
+
 logger = logging.getLogger(__name__)
 
 OAI_NAMESPACE = '{http://www.openarchives.org/OAI/%s/}'
@@ -33,6 +42,20 @@ DEFAULT_CLASS_MAP = {
     'Identify': Identify,
 }
 
+# Verbs whose responses rarely change and are revalidated with conditional
+# requests if a validator store is configured
+CONDITIONAL_VERBS = ('Identify', 'ListSets', 'ListMetadataFormats')
+
+
+def _pooled_session(maxsize):
+    """Create a session that keeps up to `maxsize` connections."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
 class Sickle(object):
     """Client for harvesting OAI interfaces.
@@ -44,6 +67,13 @@ class Sickle(object):
         >>> records.next()
         <Record oai:eprints.rclis.org:3780>
 
+    A Sickle object can be shared by several threads, each of them running
+    its own iterators. Parsers are kept per thread, the connection pool of
+    the session (see `pool_maxsize`) is shared and a ``Retry-After`` delay
+    announced by the server is respected by all threads. The object must not
+    be reconfigured while it is in use. It can be pickled, e.g. to pass it
+    to worker processes; the copy creates its own pooled session.
+
     :param endpoint: The endpoint of the OAI interface.
     :type endpoint: str
     :param http_method: Method used for requests (GET or POST, default: GET).
@@ -73,6 +103,59 @@ class Sickle(object):
                          information is missing, `requests` will fallback to
                          `'ISO-8859-1'`.
     :type encoding:      str
+    :param validator_store: Optional store for HTTP validators. If provided,
+                            Identify, ListSets and ListMetadataFormats requests
+                            are sent with `If-None-Match`/`If-Modified-Since`
+                            headers and responses with status 304 are served
+                            from the store (see :mod:`sickle.cache`).
+    :type validator_store: :class:`sickle.cache.ValidatorStore`
+    :param parser_mode: How responses are parsed: `'recover'` (default) tries
+                        hard to parse broken XML, `'strict'` raises on broken
+                        XML and `'fast'` parses strictly and falls back to
+                        recovering only if that fails
+                        (see :func:`sickle.response.parse_xml`).
+    :type parser_mode: str
+    :param huge_tree: Flag for whether to allow parsing very deep trees and
+                      very long text content.
+    :type huge_tree: bool
+    :param recover_expired_tokens: If set to :obj:`True`, item iterators
+                                   restart their query when the server
+                                   rejects an expired resumption token and
+                                   skip the items delivered already.
+    :type recover_expired_tokens: bool
+    :param token_expiry_margin: Number of seconds before the expiration of
+                                a resumption token (as announced by the
+                                server) from which on a warning is logged
+                                and the next page is requested early.
+                                :obj:`None` disables expiry tracking.
+    :type token_expiry_margin: int
+    :param prefetch: If set to :obj:`True`, iterators request the next page
+                     in a background thread as soon as a response has been
+                     received, while the current page is parsed and its
+                     items are consumed. The resumption token is taken from
+                     a quick scan of the end of the response. As the
+                     token is used before the page is consumed, do not
+                     combine this with harvests that are stopped early
+                     and resumed from a saved resumption token.
+                     Internal probes (see :mod:`sickle.estimate`) never
+                     prefetch.
+    :type prefetch: bool
+    :param salvager: Optional inspector for the pages of list requests
+                     that requests damaged pages again and salvages their
+                     well-formed items (see :mod:`sickle.salvage`).
+    :type salvager: :class:`sickle.salvage.PageSalvager`
+    :param event_hooks: A dictionary mapping event names to lists of
+                        callables that are called with timings and sizes of
+                        each request (see :mod:`sickle.hooks`).
+    :type event_hooks: dict
+    :param session: Optional session used for issuing HTTP requests. Passing
+                    a session enables reusing connections between requests.
+    :type session: :class:`requests.Session`
+    :param pool_maxsize: If given and no `session` is passed, requests are
+                         sent through a session created on first use whose
+                         connection pool keeps up to this many connections.
+                         Set it to the number of threads using this object.
+    :type pool_maxsize: int
     :param request_args: Arguments to be passed to requests when issuing HTTP
                          requests. Useful examples are `auth=('username', 'password')`
                          for basic auth-protected endpoints or `timeout=<int>`.
@@ -89,6 +172,16 @@ class Sickle(object):
                  default_retry_after=60,
                  class_mapping=None,
                  encoding=None,
+                 validator_store=None,
+                 parser_mode=RECOVER,
+                 huge_tree=False,
+                 recover_expired_tokens=False,
+                 token_expiry_margin=60,
+                 prefetch=False,
+                 salvager=None,
+                 event_hooks=None,
+                 session=None,
+                 pool_maxsize=None,
                  **request_args):
 
         self.endpoint = endpoint
@@ -98,6 +191,11 @@ class Sickle(object):
             raise ValueError(
                 "Invalid protocol version: %s! Must be 1.0 or 2.0.")
         self.http_method = http_method
+        if parser_mode not in PARSER_MODES:
+            raise ValueError("Invalid parser mode: %s! Must be one of %s."
+                             % (parser_mode, ', '.join(PARSER_MODES)))
+        self.parser_mode = parser_mode
+        self.huge_tree = huge_tree
         self.protocol_version = protocol_version
         if inspect.isclass(iterator) and issubclass(iterator, BaseOAIIterator):
             self.iterator = iterator
@@ -110,7 +208,37 @@ class Sickle(object):
         self.oai_namespace = OAI_NAMESPACE % self.protocol_version
         self.class_mapping = class_mapping or DEFAULT_CLASS_MAP
         self.encoding = encoding
+        self.validator_store = validator_store
+        self.recover_expired_tokens = recover_expired_tokens
+        self.token_expiry_margin = token_expiry_margin
+        self.prefetch = prefetch
+        self.salvager = salvager
+        self.event_hooks = event_hooks or {}
+        self.session = session
+        self.pool_maxsize = pool_maxsize
         self.request_args = request_args
+        self._lock = threading.Lock()
+        self._pooled_session = None
+        # Monotonic time until which no new requests should be sent
+        self._retry_until = 0.0
+
+    def __copy__(self):
+        # Copies share the lock and the pooled session
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        return clone
+
+    def __getstate__(self):
+        # Locks and sessions cannot be pickled, a copy creates its own
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_pooled_session'] = None
+        state['_retry_until'] = 0.0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
 
     def harvest(self, **kwargs):  # pragma: no cover
         """Make HTTP requests to the OAI server.
@@ -118,48 +246,189 @@ class Sickle(object):
         :param kwargs: OAI HTTP parameters.
         :rtype: :class:`sickle.OAIResponse`
         """
-        http_response = self._request(kwargs)
+        cache_key = None
+        headers = None
+        if self.validator_store is not None \
+                and kwargs.get('verb') in CONDITIONAL_VERBS:
+            cache_key = self.validator_store.make_key(self.endpoint, kwargs)
+            headers = self.validator_store.conditional_headers(cache_key)
+        attempt = 0
+        # Identifies the events of this call, which may be dispatched on
+        # different threads
+        request_id = uuid.uuid4().hex
+        self._wait_for_server()
+        http_response = self._timed_request(kwargs, headers, attempt,
+                                            request_id)
         for _ in range(self.max_retries):
             if self._is_error_code(http_response.status_code) \
                     and http_response.status_code in self.retry_status_codes:
                 retry_after = self.get_retry_after(http_response)
                 logger.warning(
                     "HTTP %d! Retrying after %d seconds..." % (http_response.status_code, retry_after))
+                if self.event_hooks:
+                    self._dispatch(RETRIED, kwargs, attempt,
+                                   request_id=request_id,
+                                   status_code=http_response.status_code,
+                                   retry_after=retry_after)
+                self._defer_requests(retry_after)
                 time.sleep(retry_after)
-                http_response = self._request(kwargs)
-        http_response.raise_for_status()
+                attempt += 1
+                http_response = self._timed_request(kwargs, headers, attempt,
+                                                    request_id)
+        self._raise_for_status(http_response, kwargs, attempt, request_id)
+        if cache_key is not None:
+            cached = None
+            if http_response.status_code == 304:
+                cached = self.validator_store.cached_response(cache_key)
+                if cached is None:
+                    # The entry has been evicted or cannot be read
+                    logger.warning(
+                        "Not modified, but no cached response for %s. "
+                        "Requesting it again..." % kwargs.get('verb'))
+                    attempt += 1
+                    http_response = self._timed_request(kwargs, None,
+                                                        attempt, request_id)
+                    self._raise_for_status(http_response, kwargs, attempt,
+                                           request_id)
+            if cached is None:
+                self.validator_store.store(cache_key, http_response)
+            else:
+                http_response = cached
         if self.encoding:
             http_response.encoding = self.encoding
-        return OAIResponse(http_response, params=kwargs)
+        on_parse = None
+        if self.event_hooks.get(PARSED):
+            def on_parse(oai_response, duration):
+                self._dispatch(PARSED, kwargs, attempt,
+                               request_id=request_id, duration=duration,
+                               response=oai_response)
+        return OAIResponse(http_response, params=kwargs,
+                           parser_mode=self.parser_mode,
+                           huge_tree=self.huge_tree, on_parse=on_parse)
+
+    def _raise_for_status(self, http_response, kwargs, attempt,
+                          request_id=None):
+        try:
+            http_response.raise_for_status()
+        except Exception as error:
+            if self.event_hooks:
+                self._dispatch(FAILED, kwargs, attempt,
+                               request_id=request_id, error=error)
+            raise
+
+    def _defer_requests(self, seconds):
+        """Make all threads wait `seconds` before sending new requests."""
+        with self._lock:
+            self._retry_until = max(self._retry_until, monotonic() + seconds)
+
+    def _wait_for_server(self):
+        delay = self._retry_until - monotonic()
+        if delay > 0:
+            time.sleep(delay)
 
-    def _request(self, kwargs):
+    def _dispatch(self, name, params, attempt, **data):
+        event = {
+            'event': name,
+            'endpoint': self.endpoint,
+            'verb': params.get('verb'),
+            'params': params,
+            'attempt': attempt,
+            'timestamp': time.time(),
+            'time': monotonic(),
+        }
+        event.update(data)
+        dispatch_hook(self.event_hooks, name, event)
+
+    def _timed_request(self, kwargs, headers, attempt, request_id=None):
+        if not self.event_hooks:
+            return self._request(kwargs, headers=headers)
+        self._dispatch(REQUEST_START, kwargs, attempt, request_id=request_id)
+        start = monotonic()
+        try:
+            http_response = self._request(kwargs, headers=headers)
+        except Exception as error:
+            self._dispatch(FAILED, kwargs, attempt, request_id=request_id,
+                           error=error)
+            raise
+        duration = monotonic() - start
+        elapsed = getattr(http_response, 'elapsed', None)
+        # requests measures the time until the response headers have been
+        # parsed, the remainder is spent on downloading the body
+        ttfb = elapsed.total_seconds() if elapsed is not None else None
+        self._dispatch(RESPONSE_RECEIVED, kwargs, attempt,
+                       request_id=request_id,
+                       status_code=http_response.status_code,
+                       bytes=len(http_response.content or b''),
+                       duration=duration, ttfb=ttfb,
+                       download=max(0.0, duration - ttfb)
+                       if ttfb is not None else None)
+        return http_response
+
+    def _request(self, kwargs, headers=None):
+        request_args = self.request_args
+        if headers:
+            request_args = dict(request_args)
+            request_args['headers'] = dict(
+                request_args.get('headers') or {}, **headers)
+        requester = self._requester()
         if self.http_method == 'GET':
-            return requests.get(self.endpoint, params=kwargs, **self.request_args)
-        return requests.post(self.endpoint, data=kwargs, **self.request_args)
+            return requester.get(self.endpoint, params=kwargs, **request_args)
+        return requester.post(self.endpoint, data=kwargs, **request_args)
+
+    def _requester(self):
+        if self.session is not None:
+            return self.session
+        if self.pool_maxsize is None:
+            return requests
+        if self._pooled_session is None:
+            with self._lock:
+                if self._pooled_session is None:
+                    self._pooled_session = _pooled_session(self.pool_maxsize)
+        return self._pooled_session
 
-    def ListRecords(self, ignore_deleted=False, **kwargs):
+    def close(self):
+        """Close the session created for `pool_maxsize`."""
+        with self._lock:
+            if self._pooled_session is not None:
+                self._pooled_session.close()
+                self._pooled_session = None
+
+    def ListRecords(self, ignore_deleted=False, item_filter=None, **kwargs):
         """Issue a ListRecords request.
 
         :param ignore_deleted: If set to :obj:`True`, the resulting
                               iterator will skip records flagged as deleted.
+        :param item_filter: Optional predicate on the XML element of each
+                            item; items for which it returns :obj:`False`
+                            are skipped before being mapped
+                            (see :mod:`sickle.filters`).
         :rtype: :class:`sickle.iterator.BaseOAIIterator`
         """
         params = kwargs
         params.update({'verb': 'ListRecords'})
-        # noinspection PyCallingNonCallable
-        return self.iterator(self, params, ignore_deleted=ignore_deleted)
+        return self._list_iterator(params, ignore_deleted, item_filter)
 
-    def ListIdentifiers(self, ignore_deleted=False, **kwargs):
+    def ListIdentifiers(self, ignore_deleted=False, item_filter=None, **kwargs):
         """Issue a ListIdentifiers request.
 
         :param ignore_deleted: If set to :obj:`True`, the resulting
                               iterator will skip records flagged as deleted.
+        :param item_filter: Optional predicate on the XML element of each
+                            item; items for which it returns :obj:`False`
+                            are skipped before being mapped
+                            (see :mod:`sickle.filters`).
         :rtype: :class:`sickle.iterator.BaseOAIIterator`
         """
         params = kwargs
         params.update({'verb': 'ListIdentifiers'})
-        return self.iterator(self,
-                             params, ignore_deleted=ignore_deleted)
+        return self._list_iterator(params, ignore_deleted, item_filter)
+
+    def _list_iterator(self, params, ignore_deleted, item_filter):
+        kwargs = {'ignore_deleted': ignore_deleted}
+        # Iterator classes written for older versions do not accept filters
+        if item_filter is not None:
+            kwargs['item_filter'] = item_filter
+        return self.iterator(self, params, **kwargs)
 
     def ListSets(self, **kwargs):
         """Issue a ListSets request.
@@ -185,6 +454,103 @@ class Sickle(object):
         record = self.iterator(self, params).next()
         return record
 
+    def GetRecords(self, identifiers, max_workers=4,
+                   list_records_threshold=None, **kwargs):
+        """Fetch many records concurrently by issuing GetRecord requests.
+
+        Results are yielded as ``(identifier, record)`` tuples in the order
+        in which the requests complete. For identifiers that are unknown to
+        the repository (:class:`sickle.oaiexceptions.IdDoesNotExist`),
+        ``record`` is :obj:`None`::
+
+            >>> for identifier, record in sickle.GetRecords(
+            ...         identifiers, metadataPrefix='oai_dc'):
+            ...     pass
+
+        Unless the Sickle object has been given a session, the requests are
+        issued over a pooled session with `max_workers` connections.
+
+        :param identifiers: The identifiers of the records to fetch.
+        :type identifiers: iterable
+        :param max_workers: The maximum number of concurrent requests.
+        :type max_workers: int
+        :param list_records_threshold: If the number of identifiers reaches
+                                       this value, the records are taken from
+                                       a ListRecords request with the given
+                                       arguments (e.g. `set` or `from`)
+                                       instead, which is cheaper if the
+                                       identifiers make up a large part of
+                                       the result list.
+        :type list_records_threshold: int
+        :param kwargs: OAI arguments added to each request
+                       (e.g. `metadataPrefix`).
+        """
+        if list_records_threshold is not None:
+            identifiers = list(identifiers)
+            if len(identifiers) >= list_records_threshold:
+                return self._get_records_from_list(identifiers, **kwargs)
+        return self._get_records_concurrently(identifiers, max_workers,
+                                              **kwargs)
+
+    def _get_records_concurrently(self, identifiers, max_workers, **kwargs):
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, \
+            wait
+
+        sickle = self
+        if self.session is None and self.pool_maxsize is None:
+            sickle = copy.copy(self)
+            sickle.session = _pooled_session(max_workers)
+
+        def get_record(identifier):
+            try:
+                return identifier, sickle.GetRecord(
+                    identifier=identifier, **kwargs)
+            except oaiexceptions.IdDoesNotExist:
+                logger.info("Record %s does not exist." % identifier)
+                return identifier, None
+
+        identifiers = iter(identifiers)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        pending = set()
+        try:
+            # Keep the number of queued requests bounded so that huge
+            # identifier lists are consumed lazily
+            for identifier in identifiers:
+                pending.add(executor.submit(get_record, identifier))
+                if len(pending) >= 2 * max_workers:
+                    break
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    for identifier in identifiers:
+                        pending.add(executor.submit(get_record, identifier))
+                        break
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            if sickle is not self:
+                sickle.session.close()
+
+    def _get_records_from_list(self, identifiers, **kwargs):
+        missing = set(identifiers)
+        params = dict(kwargs)
+        params.update({'verb': 'ListRecords'})
+        try:
+            for record in self.iterator(self, params):
+                identifier = record.header.identifier
+                if identifier in missing:
+                    missing.discard(identifier)
+                    yield identifier, record
+                if not missing:
+                    return
+        except oaiexceptions.NoRecordsMatch:
+            pass
+        for identifier in identifiers:
+            if identifier in missing:
+                yield identifier, None
+
     def ListMetadataFormats(self, **kwargs):
         """Issue a ListMetadataFormats request.
 
@@ -0,0 +1,163 @@
+# coding: utf-8
+"""
+    sickle.cache
+    ~~~~~~~~~~~~
+
+    Storage of HTTP validators (``ETag``/``Last-Modified``) for issuing
+    conditional requests.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+try:  # pragma: no cover
+    from urllib.parse import urlencode
+except ImportError:  # pragma: no cover
+    from urllib import urlencode
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class CachedResponse(object):
+    """Mimics the HTTP response object for responses served from a
+    validator store after the server answered with ``304 Not Modified``.
+
+    :param content: The cached response body.
+    :type content: bytes
+    :param encoding: The encoding of the original response.
+    :type encoding: str
+    :param headers: The validator headers of the original response.
+    :type headers: dict
+    """
+
+    status_code = 200
+
+    def __init__(self, content, encoding=None, headers=None):
+        self.content = content
+        self.encoding = encoding
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        """The cached response as unicode."""
+        return self.content.decode(self.encoding or 'utf-8', 'replace')
+
+    def raise_for_status(self):
+        pass
+
+
+class ValidatorStore(object):
+    """Keeps validators and bodies of responses in memory.
+
+    Use it like this::
+
+        >>> sickle = Sickle('http://...', validator_store=ValidatorStore())
+        >>> sickle.Identify()  # full download
+        >>> sickle.Identify()  # 304 Not Modified, served from the store
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    @staticmethod
+    def make_key(endpoint, params):
+        """Build the key identifying a request.
+
+        :param endpoint: The endpoint of the OAI interface.
+        :param params: The OAI arguments.
+        :type params: dict
+        """
+        return endpoint + '?' + urlencode(sorted(params.items()))
+
+    def get(self, key):
+        """Return the stored entry for `key` or :obj:`None`."""
+        return self._entries.get(key)
+
+    def set(self, key, entry):
+        """Store `entry` for `key`."""
+        self._entries[key] = entry
+
+    def conditional_headers(self, key):
+        """Return the headers for revalidating the response stored for `key`.
+
+        :rtype: dict
+        """
+        entry = self.get(key)
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, key, http_response):
+        """Remember `http_response` if the server sent any validators."""
+        etag = http_response.headers.get('ETag')
+        last_modified = http_response.headers.get('Last-Modified')
+        if not (etag or last_modified):
+            return
+        self.set(key, {
+            'etag': etag,
+            'last_modified': last_modified,
+            'encoding': http_response.encoding,
+            'content': http_response.content,
+        })
+
+    def cached_response(self, key):
+        """Return the stored response for `key` as
+        :class:`CachedResponse`."""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        headers = {}
+        if entry.get('etag'):
+            headers['ETag'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['Last-Modified'] = entry['last_modified']
+        return CachedResponse(entry['content'], encoding=entry['encoding'],
+                              headers=headers)
+
+
+class FileValidatorStore(ValidatorStore):
+    """Keeps validators and bodies of responses in a directory so that they
+    survive between harvesting runs.
+
+    :param directory: The directory the entries are written to.
+    :type directory: str
+    """
+
+    def __init__(self, directory):
+        super(FileValidatorStore, self).__init__()
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(
+            self.directory,
+            hashlib.sha1(key.encode('utf-8')).hexdigest() + '.entry')
+
+    def get(self, key):
+        # The first line holds the validators, the rest is the body
+        try:
+            with open(self._path(key), 'rb') as fp:
+                entry = json.loads(fp.readline().decode('utf-8'))
+                entry['content'] = fp.read()
+        except (IOError, OSError, ValueError):
+            return None
+        return entry
+
+    def set(self, key, entry):
+        meta = dict((k, v) for k, v in entry.items() if k != 'content')
+        # Validators and body are replaced together so that threads
+        # reading the entry never see a partially written or mixed entry
+        handle, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'wb') as fp:
+            fp.write(json.dumps(meta).encode('utf-8') + b'\n')
+            fp.write(entry['content'])
+        _replace(temporary, self._path(key))
@@ -0,0 +1,340 @@
+# coding: utf-8
+"""
+    sickle.cli
+    ~~~~~~~~~~
+
+    Command line interface for harvesting OAI interfaces to disk.
+
+    Each endpoint is harvested into its own directory. The harvest can be
+    split into partitions by date or by set; every page returned by the
+    server is written unchanged to a gzip-compressed file::
+
+        <output>/<endpoint>/<run>/<partition>/00001.xml.gz
+
+    The progress of each partition is recorded in ``<output>/<endpoint>/
+    state.json``, which allows resuming interrupted runs (``--resume``) and
+    harvesting only records changed since the last complete run
+    (``--incremental``).
+
+    With ``--partition auto``, the date windows and the number of windows
+    harvested in parallel are chosen by a :class:`sickle.planner.
+    HarvestPlanner`, which keeps what it learns about the endpoint in
+    ``<output>/<endpoint>/profile.json``.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import argparse
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import threading
+
+from sickle import oaiexceptions
+from sickle._compat import monotonic
+from sickle.app import Sickle
+from sickle.hooks import RateLimiter, merge_hooks, RESPONSE_RECEIVED
+from sickle.iterator import OAIResponseIterator
+from sickle.planner import EndpointProfile, HarvestPlanner
+from sickle.utils import date_windows
+
+logger = logging.getLogger(__name__)
+
+PARTITIONS = ('none', 'auto', 'year', 'month', 'day', 'set')
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='sickle',
+        description='Harvest OAI-PMH interfaces to compressed files.')
+    parser.add_argument('endpoints', nargs='+', metavar='ENDPOINT',
+                        help='base URL of an OAI interface')
+    parser.add_argument('-o', '--output', default='.',
+                        help='output directory (default: .)')
+    parser.add_argument('-m', '--metadata-prefix', default='oai_dc',
+                        help='metadata prefix (default: oai_dc)')
+    parser.add_argument('--verb', default='ListRecords',
+                        choices=('ListRecords', 'ListIdentifiers'))
+    parser.add_argument('-s', '--set', dest='set_spec',
+                        help='harvest only this set')
+    parser.add_argument('-f', '--from', dest='from_date',
+                        help='harvest records changed on or after this date')
+    parser.add_argument('-u', '--until', dest='until_date',
+                        help='harvest records changed on or before this date')
+    parser.add_argument('-p', '--partition', default='none',
+                        choices=PARTITIONS,
+                        help='split the harvest into date windows or sets, '
+                             '"auto" adapts windows and concurrency to the '
+                             'endpoint')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='harvest records changed since the last '
+                             'complete run')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='resume the last interrupted run')
+    parser.add_argument('-j', '--parallel', type=int, default=4,
+                        help='number of endpoints harvested in parallel '
+                             '(default: 4)')
+    parser.add_argument('--max-concurrency', type=int, default=8,
+                        help='maximum number of windows harvested in '
+                             'parallel with --partition auto (default: 8)')
+    parser.add_argument('--prefetch', action='store_true',
+                        help='request the next page while the current page '
+                             'is processed (not with --resume, as the saved '
+                             'resumption tokens have been used already)')
+    parser.add_argument('--rate', type=float,
+                        help='maximum requests per second per endpoint')
+    parser.add_argument('--max-retries', type=int, default=3,
+                        help='retries for failed requests (default: 3)')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='HTTP timeout in seconds (default: 120)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not display progress')
+    return parser
+
+
+def endpoint_directory(endpoint):
+    """Return a file system friendly name for `endpoint`."""
+    name = re.sub(r'^[a-z]+://', '', endpoint)
+    return re.sub(r'[^A-Za-z0-9.-]+', '_', name).strip('_')
+
+
+class Progress(object):
+    """Thread-safe counters for pages, items and bytes."""
+
+    def __init__(self):
+        self.pages = 0
+        self.items = 0
+        self.bytes = 0
+        self.start = monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, pages=0, items=0, bytes=0):
+        with self._lock:
+            self.pages += pages
+            self.items += items
+            self.bytes += bytes
+
+    def response_received(self, event):
+        self.add(bytes=event['bytes'])
+
+    def format(self):
+        elapsed = max(monotonic() - self.start, 1e-6)
+        return '%d pages, %d items, %.1f MB | %.1f items/s, %.2f MB/s' % (
+            self.pages, self.items, self.bytes / 1e6,
+            self.items / elapsed, self.bytes / 1e6 / elapsed)
+
+
+class EndpointHarvester(object):
+    """Harvests one endpoint according to the command line arguments.
+
+    :param endpoint: The endpoint of the OAI interface.
+    :param args: The parsed command line arguments.
+    :param progress: The progress counters.
+    :type progress: :class:`Progress`
+    """
+
+    def __init__(self, endpoint, args, progress):
+        self.endpoint = endpoint
+        self.args = args
+        self.progress = progress
+        self.directory = os.path.join(args.output,
+                                      endpoint_directory(endpoint))
+        self.state_path = os.path.join(self.directory, 'state.json')
+        hooks = {RESPONSE_RECEIVED: [progress.response_received]}
+        if args.rate:
+            hooks = merge_hooks(hooks, RateLimiter(args.rate).hooks())
+        self.planner = None
+        if args.partition == 'auto':
+            self.planner = HarvestPlanner(
+                EndpointProfile(os.path.join(self.directory, 'profile.json')),
+                max_concurrency=args.max_concurrency)
+            hooks = merge_hooks(hooks, self.planner.hooks())
+        self._state_lock = threading.Lock()
+        self.sickle = Sickle(endpoint, iterator=OAIResponseIterator,
+                             max_retries=args.max_retries,
+                             default_retry_after=10,
+                             retry_status_codes=(500, 502, 503, 504),
+                             event_hooks=hooks, prefetch=args.prefetch,
+                             timeout=args.timeout)
+        self._items_path = './/' + self.sickle.oai_namespace + (
+            'record' if args.verb == 'ListRecords' else 'header')
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_state(self, state):
+        path = self.state_path + '.tmp'
+        with self._state_lock:
+            with open(path, 'w') as fp:
+                json.dump(state, fp, indent=2, sort_keys=True)
+            _replace(path, self.state_path)
+
+    def base_params(self, state):
+        params = {'verb': self.args.verb,
+                  'metadataPrefix': self.args.metadata_prefix}
+        if self.args.set_spec:
+            params['set'] = self.args.set_spec
+        from_date = self.args.from_date
+        if self.args.incremental and state.get('last_complete'):
+            from_date = state['last_complete']
+        if from_date:
+            params['from'] = from_date
+        if self.args.until_date:
+            params['until'] = self.args.until_date
+        return params
+
+    def partitions(self, params):
+        """Return a list of ``(name, params)`` tuples."""
+        partition = self.args.partition
+        if partition == 'none':
+            return [('all', params)]
+        if partition == 'auto':
+            windows, _ = self.planner.plan(self.sickle, params)
+            if len(windows) == 1:
+                return [('all', windows[0])]
+            return [('%s_%s' % (w['from'], w['until']), w) for w in windows]
+        if partition == 'set':
+            return [('set-' + endpoint_directory(s.setSpec),
+                     dict(params, set=s.setSpec))
+                    for s in self._list_sets()]
+        start = params.get('from')
+        if not start:
+            start = self.sickle.Identify().earliestDatestamp
+        end = params.get('until') or datetime.date.today().isoformat()
+        return [('%s_%s' % window, dict(params, **{'from': window[0],
+                                                    'until': window[1]}))
+                for window in date_windows(start, end, partition)]
+
+    def _list_sets(self):
+        sickle = Sickle(self.endpoint, max_retries=self.args.max_retries,
+                        event_hooks=self.sickle.event_hooks,
+                        timeout=self.args.timeout)
+        return list(sickle.ListSets())
+
+    def run(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        state = self.load_state()
+        run = state.get('run')
+        if not (self.args.resume and run and not run.get('complete')):
+            started = datetime.datetime.utcnow()
+            params = self.base_params(state)
+            run = {
+                'id': started.strftime('%Y%m%dT%H%M%S'),
+                'started': started.date().isoformat(),
+                'partitions': [
+                    {'name': name, 'params': partition_params,
+                     'pages': 0, 'token': None, 'complete': False}
+                    for name, partition_params in self.partitions(params)],
+                'complete': False,
+            }
+            state['run'] = run
+            self.save_state(state)
+        pending = [p for p in run['partitions'] if not p['complete']]
+        concurrency = 1
+        if self.planner is not None:
+            concurrency = min(self.planner.profile.concurrency, len(pending))
+            self.planner.start()
+        if concurrency > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+            try:
+                futures = [executor.submit(self.harvest_partition,
+                                           state, run, partition)
+                           for partition in pending]
+                for future in futures:
+                    future.result()
+            finally:
+                executor.shutdown()
+        else:
+            for partition in pending:
+                self.harvest_partition(state, run, partition)
+        if self.planner is not None:
+            self.planner.finish()
+        run['complete'] = True
+        state['last_complete'] = run['started']
+        self.save_state(state)
+
+    def harvest_partition(self, state, run, partition):
+        directory = os.path.join(self.directory, run['id'], partition['name'])
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        params = dict(partition['params'])
+        if partition['token']:
+            params = {'verb': params['verb'],
+                      'resumptionToken': partition['token']}
+        try:
+            try:
+                responses = self.sickle.iterator(self.sickle, params)
+            except oaiexceptions.BadResumptionToken:
+                logger.warning('Resumption token of partition %s expired, '
+                               'restarting the partition.', partition['name'])
+                partition['pages'] = 0
+                partition['token'] = None
+                for filename in os.listdir(directory):
+                    os.remove(os.path.join(directory, filename))
+                responses = self.sickle.iterator(self.sickle,
+                                                 dict(partition['params']))
+            for response in responses:
+                partition['pages'] += 1
+                path = os.path.join(directory,
+                                    '%05d.xml.gz' % partition['pages'])
+                with gzip.open(path, 'wb') as fp:
+                    fp.write(response.http_response.content)
+                items = 0
+                if response.xml is not None:
+                    items = len(response.xml.findall(self._items_path))
+                token = responses.resumption_token
+                partition['token'] = token.token if token else None
+                self.progress.add(pages=1, items=items)
+                self.save_state(state)
+        except oaiexceptions.NoRecordsMatch:
+            pass
+        partition['complete'] = True
+        partition['token'] = None
+        self.save_state(state)
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.prefetch and args.resume:
+        parser.error('--prefetch cannot be combined with --resume')
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    from concurrent.futures import ThreadPoolExecutor, wait
+
+    progress = Progress()
+    harvesters = [EndpointHarvester(endpoint, args, progress)
+                  for endpoint in args.endpoints]
+    executor = ThreadPoolExecutor(max_workers=max(1, args.parallel))
+    futures = dict((executor.submit(h.run), h) for h in harvesters)
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, timeout=1)
+        if not args.quiet:
+            sys.stderr.write('\r' + progress.format())
+            sys.stderr.flush()
+    executor.shutdown()
+    if not args.quiet:
+        sys.stderr.write('\n')
+    failed = 0
+    for future, harvester in futures.items():
+        error = future.exception()
+        if error is not None:
+            failed += 1
+            logger.error('Harvesting %s failed: %s', harvester.endpoint, error)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# coding: utf-8
+"""
+    sickle.columns
+    ~~~~~~~~~~~~~~
+
+    Page-level extraction of header fields into columns.
+
+    Instead of creating a :class:`sickle.models.Header` object for each
+    item, the fields of all headers on a page are gathered with a few
+    compiled XPath expressions::
+
+        >>> sickle = Sickle('http://...', iterator=OAIResponseIterator)
+        >>> for response in sickle.ListIdentifiers(metadataPrefix='oai_dc'):
+        ...     columns = header_columns(response.xml)
+        ...     columns['identifier']
+        ['oai:example.org:1', 'oai:example.org:2', ...]
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+from lxml import etree
+
+from sickle.utils import get_namespace
+
+_XPATHS = {}
+
+
+def _compile(namespace):
+    try:
+        return _XPATHS[namespace]
+    except KeyError:
+        ns = {'oai': namespace[1:-1]}
+        xpaths = {
+            'headers': etree.XPath('//oai:header', namespaces=ns),
+            'identifier': etree.XPath('//oai:header/oai:identifier',
+                                      namespaces=ns),
+            'datestamp': etree.XPath('//oai:header/oai:datestamp',
+                                     namespaces=ns),
+            'setSpec': etree.XPath('//oai:header/oai:setSpec',
+                                   namespaces=ns),
+        }
+        _XPATHS[namespace] = xpaths
+        return xpaths
+
+
+def _column(xpaths, name, tree, headers, namespace):
+    elements = xpaths[name](tree)
+    # OAI-PMH requires exactly one identifier and datestamp per header, so
+    # the elements usually line up with the headers. Only if that is not
+    # the case, the values are looked up header by header.
+    if len(elements) == len(headers):
+        return [element.text for element in elements]
+    tag = namespace + name
+    return [header.findtext(tag) for header in headers]
+
+
+def header_columns(tree):
+    """Extract the header fields of all items in an OAI response.
+
+    Works on ListIdentifiers, ListRecords and GetRecord responses.
+
+    :param tree: The parsed XML of an OAI response
+                 (see :attr:`sickle.response.OAIResponse.xml`).
+    :type tree: :class:`lxml.etree._Element`
+    :returns: A dictionary mapping the field names ``identifier``,
+              ``datestamp``, ``deleted`` and ``setSpecs`` to lists of
+              equal length.
+    :rtype: dict
+    """
+    namespace = get_namespace(tree)
+    xpaths = _compile(namespace)
+    headers = xpaths['headers'](tree)
+    set_specs = [[] for _ in headers]
+    position = dict((header, i) for i, header in enumerate(headers))
+    for set_spec in xpaths['setSpec'](tree):
+        set_specs[position[set_spec.getparent()]].append(set_spec.text)
+    return {
+        'identifier': _column(xpaths, 'identifier', tree, headers, namespace),
+        'datestamp': _column(xpaths, 'datestamp', tree, headers, namespace),
+        'deleted': [header.get('status') == 'deleted' for header in headers],
+        'setSpecs': set_specs,
+    }
@@ -0,0 +1,197 @@
+# coding: utf-8
+"""
+    sickle.dedup
+    ~~~~~~~~~~~~
+
+    Skipping of records whose content has not changed since an earlier
+    harvest.
+
+    The canonical bytes of each record's metadata are hashed and compared
+    with the hash stored for the record's identifier. The comparison happens
+    on the XML element before the record is mapped, so unchanged records
+    cost only a serialization and a hash. New hashes are only stored once
+    the consumer confirms that it has processed the records, so records
+    are not lost if the consumer fails::
+
+        >>> index = HashIndex.for_endpoint('/var/cache/sickle', sickle.endpoint)
+        >>> deduplicator = Deduplicator(index)
+        >>> records = sickle.ListRecords(metadataPrefix='oai_dc',
+        ...                              item_filter=deduplicator)
+        >>> for record in records:
+        ...     store(record)
+        ...     deduplicator.ack(record.header.identifier)
+        >>> index.close()
+
+    Consumers that process records in batches call :meth:`Deduplicator.
+    commit` after each batch instead.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import hashlib
+import os
+import sqlite3
+
+from lxml import etree
+
+from sickle.filters import get_header, get_identifier
+
+
+def content_hash(element):
+    """Return the SHA-1 digest of the canonical form of a record's metadata.
+
+    For elements without metadata (e.g. headers), the canonical form of the
+    whole element is hashed.
+
+    :param element: A ``record`` or ``header`` element.
+    :type element: :class:`lxml.etree._Element`
+    :rtype: bytes
+    """
+    namespace = element.tag.rpartition('}')[0] + '}'
+    metadata = element.find(namespace + 'metadata')
+    if metadata is None:
+        metadata = element
+    return hashlib.sha1(
+        etree.tostring(metadata, method='c14n', exclusive=True)).digest()
+
+
+class HashIndex(object):
+    """A persistent mapping of OAI identifiers to content hashes, backed by
+    SQLite.
+
+    Writes are committed every `commit_interval` changes and on
+    :meth:`close`.
+
+    :param path: The path of the database file.
+    :type path: str
+    :param commit_interval: The number of changes after which they are
+                            committed.
+    :type commit_interval: int
+    """
+
+    def __init__(self, path, commit_interval=1000):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS hashes ('
+            'identifier TEXT PRIMARY KEY, digest BLOB NOT NULL) '
+            'WITHOUT ROWID')
+        self._changes = 0
+
+    @classmethod
+    def for_endpoint(cls, directory, endpoint, **kwargs):
+        """Open the index of `endpoint` in `directory`.
+
+        :param directory: The directory holding the indexes of all endpoints.
+        :type directory: str
+        :param endpoint: The endpoint of the OAI interface.
+        :type endpoint: str
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        name = hashlib.sha1(endpoint.encode('utf-8')).hexdigest() + '.db'
+        return cls(os.path.join(directory, name), **kwargs)
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM hashes').fetchone()[0]
+
+    def get(self, identifier):
+        """Return the stored digest for `identifier` or :obj:`None`."""
+        row = self.connection.execute(
+            'SELECT digest FROM hashes WHERE identifier = ?',
+            (identifier,)).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def set(self, identifier, digest):
+        """Store `digest` for `identifier`."""
+        self.connection.execute(
+            'INSERT OR REPLACE INTO hashes VALUES (?, ?)',
+            (identifier, sqlite3.Binary(digest)))
+        self._changed()
+
+    def delete(self, identifier):
+        """Remove the digest stored for `identifier`."""
+        self.connection.execute(
+            'DELETE FROM hashes WHERE identifier = ?', (identifier,))
+        self._changed()
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self._changes = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+class Deduplicator(object):
+    """Item filter that skips records whose metadata is unchanged since the
+    last time they were processed.
+
+    The hashes of the records that pass the filter are staged until the
+    consumer acknowledges the records with :meth:`ack` or :meth:`commit`;
+    only then are they written to the index. Records that were never
+    acknowledged are delivered again by the next harvest.
+
+    Deleted records are always kept and their hashes are removed from the
+    index on acknowledgement, so that the record is delivered again if it
+    reappears.
+
+    :param index: The index holding the known hashes.
+    :type index: :class:`HashIndex`
+    """
+
+    def __init__(self, index):
+        self.index = index
+        #: The number of records skipped as duplicates.
+        self.skipped = 0
+        # Digests of delivered records by identifier, None for deletions
+        self._staged = {}
+
+    def __call__(self, element):
+        identifier = get_identifier(element)
+        if identifier is None:
+            return True
+        header = get_header(element)
+        if header.get('status') == 'deleted':
+            self._staged[identifier] = None
+            return True
+        digest = content_hash(element)
+        if identifier in self._staged:
+            known = self._staged[identifier]
+        else:
+            known = self.index.get(identifier)
+        if known == digest:
+            self.skipped += 1
+            return False
+        self._staged[identifier] = digest
+        return True
+
+    def __len__(self):
+        """The number of staged records."""
+        return len(self._staged)
+
+    def _store(self, identifier, digest):
+        if digest is None:
+            self.index.delete(identifier)
+        else:
+            self.index.set(identifier, digest)
+
+    def ack(self, identifier):
+        """Store the hash of a record that has been processed."""
+        if identifier in self._staged:
+            self._store(identifier, self._staged.pop(identifier))
+
+    def commit(self):
+        """Store the hashes of all records delivered so far and commit the
+        index."""
+        staged, self._staged = self._staged, {}
+        for identifier, digest in staged.items():
+            self._store(identifier, digest)
+        self.index.commit()
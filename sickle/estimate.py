@@ -0,0 +1,272 @@
+# coding: utf-8
+"""
+    sickle.estimate
+    ~~~~~~~~~~~~~~~
+
+    Estimation of the size of a repository within a small request budget.
+
+    Each estimate is read from the first page of a ListIdentifiers request:
+    if its resumption token carries a ``completeListSize``, that is the
+    size of the list, otherwise the page is a lower bound. The
+    :class:`SizeEstimator` probes the whole range, a few date windows
+    between ``Identify.earliestDatestamp`` (or `from`) and `until` (or
+    today) and the sets of the repository until its budget is spent::
+
+        >>> estimator = SizeEstimator(sickle, max_requests=20)
+        >>> estimate = estimator.estimate(metadataPrefix='oai_dc')
+        >>> estimate.total
+        1204331
+        >>> estimate.windows[0]
+        ('1970-01-01', '1976-08-24', 0)
+
+    :meth:`SizeEstimator.sample` draws records from the windows in
+    proportion to their estimated size, for a quick look at a repository
+    without harvesting it.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import copy
+import datetime
+import itertools
+import math
+
+from sickle import oaiexceptions
+from sickle.iterator import OAIResponseIterator, OAIItemIterator
+from sickle.utils import date_windows, parse_date
+
+#: The OAI arguments a size probe passes on
+PROBE_ARGUMENTS = ('metadataPrefix', 'set', 'from', 'until')
+
+
+def _without_prefetch(sickle):
+    """Return `sickle` or a copy of it that does not prefetch pages.
+
+    Probes read only the first pages of a list, so a prefetched page would
+    be a wasted request that uses up its resumption token.
+    """
+    if not sickle.prefetch:
+        return sickle
+    probing = copy.copy(sickle)
+    probing.prefetch = False
+    return probing
+
+
+def probe_size(sickle, params):
+    """Return the number of items `params` select, read from the first
+    ListIdentifiers page.
+
+    :param sickle: The client for the endpoint.
+    :type sickle: :class:`sickle.app.Sickle`
+    :param params: The OAI arguments.
+    :type params: dict
+    :returns: The number of items and a flag for whether it is the size of
+              the list (:obj:`False` if it is only the number of items on
+              the first page).
+    """
+    probe = dict((k, v) for k, v in params.items()
+                 if k in PROBE_ARGUMENTS and v is not None)
+    probe['verb'] = 'ListIdentifiers'
+    try:
+        responses = OAIResponseIterator(_without_prefetch(sickle), probe)
+    except oaiexceptions.NoRecordsMatch:
+        return 0, True
+    token = responses.resumption_token
+    if token is not None and token.token and token.complete_list_size:
+        return int(token.complete_list_size), True
+    headers = len(responses.oai_response.xml.findall(
+        './/' + sickle.oai_namespace + 'header'))
+    return headers, token is None or not token.token
+
+
+class SizeEstimate(object):
+    """The estimated size of a repository.
+
+    :param total: The estimated number of items.
+    :param complete: Flag for whether all counts are sizes reported by the
+                     server rather than lower bounds or interpolations.
+    :param windows: A list of ``(from, until, count)`` tuples.
+    :param sets: A dictionary mapping setSpecs to counts (:obj:`None` for
+                 sets that were not probed).
+    :param requests: The number of requests made.
+    """
+
+    def __init__(self, total, complete, windows, sets, requests):
+        self.total = total
+        self.complete = complete
+        self.windows = windows
+        self.sets = sets
+        self.requests = requests
+
+    def __repr__(self):
+        return '<SizeEstimate total=%d%s windows=%d sets=%d requests=%d>' % (
+            self.total, '' if self.complete else '+', len(self.windows),
+            len(self.sets), self.requests)
+
+
+class SizeEstimator(object):
+    """Estimates the number of items per date window and set.
+
+    One request is used for the whole range, one for
+    ``Identify.earliestDatestamp`` if no `from` is given, one per window
+    and one per page of ListSets and per set. Sets are probed with the
+    requests left after the windows; the remaining ones are reported as
+    :obj:`None`.
+
+    :param sickle: The client for the endpoint.
+    :type sickle: :class:`sickle.app.Sickle`
+    :param max_requests: The request budget of an estimate.
+    :type max_requests: int
+    :param windows: The number of date windows to probe.
+    :type windows: int
+    """
+
+    def __init__(self, sickle, max_requests=20, windows=8):
+        self.sickle = sickle
+        self.max_requests = max_requests
+        self.windows = windows
+        self._requests = 0
+
+    def _probe(self, params):
+        self._requests += 1
+        return probe_size(self.sickle, params)
+
+    def _range(self, params):
+        start = params.get('from')
+        if not start:
+            self._requests += 1
+            start = self.sickle.Identify().earliestDatestamp
+        end = params.get('until') or datetime.date.today().isoformat()
+        return parse_date(start), parse_date(end)
+
+    def _window_counts(self, params, total, total_complete):
+        start, end = self._range(params)
+        days = (end - start).days + 1
+        budget = self.max_requests - self._requests
+        count = min(self.windows, days, budget)
+        if count < 1:
+            return [], True
+        length = int(math.ceil(days / float(count)))
+        windows = []
+        complete = True
+        for window in date_windows(start, end, length):
+            size, exact = self._probe(
+                dict(params, **{'from': window[0], 'until': window[1]}))
+            windows.append([window[0], window[1], size, exact])
+            complete = complete and exact
+        if not complete and total_complete:
+            # Spread the items the lower bounds miss over their windows
+            exact_sum = sum(w[2] for w in windows if w[3])
+            bound_sum = sum(w[2] for w in windows if not w[3])
+            missing = total - exact_sum - bound_sum
+            if missing > 0 and bound_sum:
+                for window in windows:
+                    if not window[3]:
+                        window[2] += int(round(
+                            missing * window[2] / float(bound_sum)))
+        return [tuple(w[:3]) for w in windows], complete
+
+    def _set_counts(self, params):
+        set_specs = []
+        if self._requests >= self.max_requests:
+            return {}, False
+        self._requests += 1
+        try:
+            for response in OAIResponseIterator(
+                    _without_prefetch(self.sickle), {'verb': 'ListSets'}):
+                set_specs.extend(element.text for element in
+                                 response.xml.iterfind(
+                                     './/' + self.sickle.oai_namespace +
+                                     'setSpec'))
+                token = response.xml.find(
+                    './/' + self.sickle.oai_namespace + 'resumptionToken')
+                if token is None or not token.text or \
+                        self._requests >= self.max_requests:
+                    break
+                self._requests += 1
+        except oaiexceptions.NoSetHierarchy:
+            return {}, True
+        sets = {}
+        complete = True
+        for set_spec in set_specs:
+            if self._requests >= self.max_requests:
+                sets[set_spec] = None
+                complete = False
+                continue
+            size, exact = self._probe(dict(params, set=set_spec))
+            sets[set_spec] = size
+            complete = complete and exact
+        return sets, complete
+
+    def estimate(self, sets=True, quick=False, **kwargs):
+        """Estimate the number of items per date window and set.
+
+        :param sets: Flag for whether to estimate the size of each set.
+        :type sets: bool
+        :param quick: If set, no date windows are probed if the first
+                      probe yields the size of the whole range.
+        :type quick: bool
+        :param kwargs: OAI arguments (e.g. `metadataPrefix`, `from` or
+                       `until`).
+        :rtype: :class:`SizeEstimate`
+        """
+        self._requests = 0
+        total, complete = self._probe(kwargs)
+        windows = []
+        if total and not (quick and complete):
+            windows, windows_complete = self._window_counts(
+                kwargs, total, complete)
+            if not complete and windows:
+                total = max(total, sum(w[2] for w in windows))
+                complete = windows_complete
+        set_counts = {}
+        if sets and total and 'set' not in kwargs:
+            set_counts, sets_complete = self._set_counts(kwargs)
+            complete = complete and sets_complete
+        return SizeEstimate(total, complete, windows, set_counts,
+                            self._requests)
+
+    def sample(self, size=100, estimate=None, **kwargs):
+        """Iterate over a sample of records spread over the date windows.
+
+        Each window contributes records in proportion to its estimated
+        size, taken from the start of a ListRecords request for the
+        window. Deleted records are skipped.
+
+        :param size: The number of records to sample.
+        :type size: int
+        :param estimate: An estimate for the same arguments. If omitted,
+                         one is made without set counts.
+        :type estimate: :class:`SizeEstimate`
+        :param kwargs: OAI arguments (e.g. `metadataPrefix`).
+        """
+        if estimate is None:
+            estimate = self.estimate(sets=False, **kwargs)
+        windows = estimate.windows or [
+            (kwargs.get('from'), kwargs.get('until'), estimate.total)]
+        total = sum(w[2] for w in windows)
+        if not total:
+            return
+        remaining = size
+        for number, (start, end, count) in enumerate(windows):
+            if remaining <= 0:
+                break
+            if number == len(windows) - 1:
+                quota = remaining
+            else:
+                quota = min(remaining, int(round(size * count /
+                                                 float(total))))
+            if not count or not quota:
+                continue
+            params = dict(kwargs, verb='ListRecords')
+            if start is not None:
+                params['from'] = start
+            if end is not None:
+                params['until'] = end
+            try:
+                records = OAIItemIterator(_without_prefetch(self.sickle),
+                                          params, ignore_deleted=True)
+            except oaiexceptions.NoRecordsMatch:
+                continue
+            for record in itertools.islice(records, quota):
+                remaining -= 1
+                yield record
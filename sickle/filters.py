@@ -0,0 +1,121 @@
+# coding: utf-8
+"""
+    sickle.filters
+    ~~~~~~~~~~~~~~
+
+    Predicates for skipping OAI items before they are mapped to Python
+    objects.
+
+    A filter is a callable that receives the XML element of an item
+    (``record`` or ``header``) and returns :obj:`True` if the item should be
+    kept. Filters only look at header-level data and are therefore much
+    cheaper than mapping an item and discarding it afterwards::
+
+        >>> records = sickle.ListRecords(
+        ...     metadataPrefix='oai_dc',
+        ...     item_filter=HeaderFilter(sets=['physics'], deleted=False))
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+
+
+def get_header(element):
+    """Return the ``header`` element of a ``record`` or ``header`` element.
+
+    :param element: A ``record`` or ``header`` element.
+    :type element: :class:`lxml.etree._Element`
+    """
+    namespace, _, tag = element.tag.rpartition('}')
+    if tag == 'header':
+        return element
+    return element.find(namespace + '}header')
+
+
+def is_deleted(element):
+    """Return whether a ``record`` or ``header`` element is flagged as
+    deleted."""
+    header = get_header(element)
+    return header is not None and header.get('status') == 'deleted'
+
+
+def get_identifier(element):
+    """Return the identifier of a ``record`` or ``header`` element."""
+    header = get_header(element)
+    if header is None:
+        return None
+    namespace = header.tag.rpartition('}')[0]
+    return header.findtext(namespace + '}identifier')
+
+
+class HeaderFilter(object):
+    """Filter items by the contents of their headers.
+
+    All given criteria have to be met for an item to be kept.
+
+    :param deleted: If :obj:`False`, skip deleted items, if :obj:`True`,
+                    keep only deleted items.
+    :type deleted: bool
+    :param sets: Keep only items in at least one of these sets.
+    :type sets: iterable
+    :param from_datestamp: Keep only items with a datestamp equal to or
+                           later than this one.
+    :type from_datestamp: str
+    :param until_datestamp: Keep only items with a datestamp equal to or
+                            earlier than this one.
+    :type until_datestamp: str
+    :param identifier_prefix: Keep only items whose identifier starts with
+                              this prefix.
+    :type identifier_prefix: str
+    """
+
+    def __init__(self, deleted=None, sets=None, from_datestamp=None,
+                 until_datestamp=None, identifier_prefix=None):
+        self.deleted = deleted
+        self.sets = frozenset(sets) if sets is not None else None
+        self.from_datestamp = from_datestamp
+        self.until_datestamp = until_datestamp
+        self.identifier_prefix = identifier_prefix
+
+    def __call__(self, element):
+        header = get_header(element)
+        if header is None:
+            return False
+        if self.deleted is not None and \
+                (header.get('status') == 'deleted') != self.deleted:
+            return False
+        namespace = header.tag.rpartition('}')[0] + '}'
+        if self.identifier_prefix is not None:
+            identifier = header.findtext(namespace + 'identifier') or ''
+            if not identifier.startswith(self.identifier_prefix):
+                return False
+        if self.from_datestamp is not None or \
+                self.until_datestamp is not None:
+            datestamp = header.findtext(namespace + 'datestamp')
+            if datestamp is None:
+                return False
+            # Datestamps are compared with the granularity of the given
+            # boundaries (e.g. 2020-01-01 matches 2020-01-01T12:00:00Z)
+            if self.from_datestamp is not None and \
+                    datestamp[:len(self.from_datestamp)] < self.from_datestamp:
+                return False
+            if self.until_datestamp is not None and \
+                    datestamp[:len(self.until_datestamp)] > self.until_datestamp:
+                return False
+        if self.sets is not None:
+            for set_spec in header.iterfind(namespace + 'setSpec'):
+                if set_spec.text in self.sets:
+                    break
+            else:
+                return False
+        return True
+
+
+def all_of(*filters):
+    """Combine filters so that an item is kept only if all of them accept
+    it."""
+    def combined(element):
+        for item_filter in filters:
+            if not item_filter(element):
+                return False
+        return True
+    return combined
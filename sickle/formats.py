@@ -0,0 +1,210 @@
+# coding: utf-8
+"""
+    sickle.formats
+    ~~~~~~~~~~~~~~
+
+    Record classes with optimized metadata mappers for common formats.
+
+    The generic :meth:`sickle.models.Record.get_metadata` walks all
+    descendants of the metadata element and collects their text, which loses
+    the structure of formats like MARCXML or DataCite. The classes in this
+    module know the layout of their format and produce structured
+    dictionaries. Register them through the class mapping::
+
+        >>> sickle = Sickle('http://...',
+        ...                 class_mapping=class_mapping_for('marc21'))
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+from lxml import etree
+
+from .app import DEFAULT_CLASS_MAP
+from .models import Record
+
+MARC_NAMESPACE = 'http://www.loc.gov/MARC21/slim'
+
+_MARC_LEADER = '{%s}leader' % MARC_NAMESPACE
+_MARC_CONTROLFIELD = '{%s}controlfield' % MARC_NAMESPACE
+_MARC_DATAFIELD = '{%s}datafield' % MARC_NAMESPACE
+_MARC_SUBFIELD = '{%s}subfield' % MARC_NAMESPACE
+_MARC_RECORD = etree.XPath('descendant-or-self::marc:record[1]',
+                           namespaces={'marc': MARC_NAMESPACE})
+
+_DATACITE_RESOURCE = etree.XPath(
+    "descendant-or-self::*[local-name()='resource'][1]")
+
+# DataCite elements that contain a list of child elements of one kind
+DATACITE_LISTS = frozenset([
+    'creators', 'titles', 'subjects', 'contributors', 'dates',
+    'alternateIdentifiers', 'relatedIdentifiers', 'sizes', 'formats',
+    'rightsList', 'descriptions', 'geoLocations', 'fundingReferences',
+    'relatedItems',
+])
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def _first_element(element):
+    """Return the first child element of `element`, skipping comments and
+    processing instructions, or :obj:`None`."""
+    return next(element.iterchildren(etree.Element), None)
+
+
+class DublinCoreRecord(Record):
+    """Record with a fast mapper for ``oai_dc`` metadata.
+
+    Produces the same dictionary as :class:`sickle.models.Record` but
+    only looks at the direct children of the ``oai_dc:dc`` element.
+    """
+
+    def get_metadata(self):
+        container = self.xml.find(self._oai_namespace + 'metadata')
+        dc = _first_element(container) if container is not None else None
+        if dc is None:
+            return {}
+        metadata = {}
+        for element in dc.iterchildren(etree.Element):
+            tag = element.tag
+            if self._strip_ns:
+                tag = _local_name(tag)
+            values = metadata.get(tag)
+            if values is None:
+                metadata[tag] = [element.text]
+            else:
+                values.append(element.text)
+        return metadata
+
+
+class MARCXMLRecord(Record):
+    """Record with a structured mapper for MARCXML metadata.
+
+    The metadata dictionary has the form::
+
+        {'leader': '00000nam a2200000 a 4500',
+         'controlfields': {'001': '12345', ...},
+         'datafields': {'245': [{'ind1': '1', 'ind2': '0',
+                                 'subfields': {'a': ['Title'], ...}}],
+                        ...}}
+    """
+
+    def get_metadata(self):
+        container = self.xml.find(self._oai_namespace + 'metadata')
+        marc_record = _MARC_RECORD(container) if container is not None \
+            else None
+        if not marc_record:
+            return {}
+        leader = None
+        controlfields = {}
+        datafields = {}
+        # A single pass over the fields is considerably faster than
+        # selecting each kind of field separately
+        for field in marc_record[0]:
+            tag = field.tag
+            if tag == _MARC_DATAFIELD:
+                subfields = {}
+                for subfield in field.iterchildren(_MARC_SUBFIELD):
+                    code = subfield.get('code')
+                    if code in subfields:
+                        subfields[code].append(subfield.text)
+                    else:
+                        subfields[code] = [subfield.text]
+                datafields.setdefault(field.get('tag'), []).append({
+                    'ind1': field.get('ind1'),
+                    'ind2': field.get('ind2'),
+                    'subfields': subfields,
+                })
+            elif tag == _MARC_CONTROLFIELD:
+                controlfields[field.get('tag')] = field.text
+            elif tag == _MARC_LEADER:
+                leader = field.text
+        return {
+            'leader': leader,
+            'controlfields': controlfields,
+            'datafields': datafields,
+        }
+
+
+def _datacite_value(element):
+    attributes = element.attrib
+    children = list(element.iterchildren(etree.Element))
+    if not children and not attributes:
+        return element.text
+    value = {}
+    for name, attribute in attributes.items():
+        value[_local_name(name)] = attribute
+    if _local_name(element.tag) in DATACITE_LISTS:
+        return [_datacite_value(child) for child in children]
+    for child in children:
+        name = _local_name(child.tag)
+        child_value = _datacite_value(child)
+        if name in DATACITE_LISTS:
+            value[name] = child_value
+        else:
+            value.setdefault(name, []).append(child_value)
+    text = element.text.strip() if element.text else ''
+    if text:
+        value['value'] = text
+    return value
+
+
+class DataCiteRecord(Record):
+    """Record with a structured mapper for DataCite metadata (``datacite``
+    and ``oai_datacite``).
+
+    List elements like ``creators`` or ``titles`` become lists, elements
+    with attributes become dictionaries holding the attributes and the text
+    content as ``value``::
+
+        {'identifier': [{'identifierType': 'DOI', 'value': '10.1234/5'}],
+         'creators': [{'creatorName': ['Doe, Jane'], ...}],
+         'titles': ['A title', {'titleType': 'Subtitle', 'value': '...'}],
+         'publicationYear': ['2019'],
+         ...}
+    """
+
+    def get_metadata(self):
+        container = self.xml.find(self._oai_namespace + 'metadata')
+        resource = _DATACITE_RESOURCE(container) if container is not None \
+            else None
+        if not resource:
+            return {}
+        metadata = {}
+        for child in resource[0].iterchildren(etree.Element):
+            name = _local_name(child.tag)
+            value = _datacite_value(child)
+            if name in DATACITE_LISTS:
+                metadata[name] = value
+            else:
+                metadata.setdefault(name, []).append(value)
+        return metadata
+
+
+#: Record classes for common metadata prefixes
+RECORD_CLASSES = {
+    'oai_dc': DublinCoreRecord,
+    'marc21': MARCXMLRecord,
+    'marcxml': MARCXMLRecord,
+    'datacite': DataCiteRecord,
+    'oai_datacite': DataCiteRecord,
+}
+
+
+def class_mapping_for(metadata_prefix, class_mapping=None):
+    """Return a class mapping that uses the optimized record class for
+    `metadata_prefix`.
+
+    :param metadata_prefix: The metadata prefix to harvest.
+    :type metadata_prefix: str
+    :param class_mapping: The mapping to start from (default:
+                          :data:`sickle.app.DEFAULT_CLASS_MAP`).
+    :type class_mapping: dict
+    :rtype: dict
+    """
+    mapping = dict(class_mapping or DEFAULT_CLASS_MAP)
+    record_class = RECORD_CLASSES.get(metadata_prefix)
+    if record_class is not None:
+        mapping['ListRecords'] = record_class
+        mapping['GetRecord'] = record_class
+    return mapping
@@ -0,0 +1,256 @@
+# coding: utf-8
+"""
+    sickle.hooks
+    ~~~~~~~~~~~~
+
+    Events emitted while harvesting and tools for consuming them.
+
+    Callables can be registered for each event by passing a dictionary to
+    :class:`sickle.app.Sickle`::
+
+        >>> def log_timings(event):
+        ...     print(event['verb'], event['ttfb'], event['download'])
+        >>> sickle = Sickle('http://...',
+        ...                 event_hooks={RESPONSE_RECEIVED: [log_timings]})
+
+    Each hook is called with a dictionary describing the event. All events
+    carry the keys ``event``, ``endpoint``, ``verb``, ``params``,
+    ``attempt`` (0 for the first try of a request), ``request_id`` (the
+    same for all events of one call to
+    :meth:`sickle.app.Sickle.harvest`), ``timestamp`` (wall clock) and
+    ``time`` (monotonic clock, in seconds). Additional keys depend on the
+    event:
+
+    :data:`REQUEST_START`
+        none
+    :data:`RESPONSE_RECEIVED`
+        ``status_code``, ``bytes``, ``duration`` (total time of the
+        request), ``ttfb`` (time until the response headers arrived) and
+        ``download`` (time for receiving the body)
+    :data:`PARSED`
+        ``duration`` (time for parsing the response) and ``response`` (the
+        :class:`sickle.response.OAIResponse`)
+    :data:`RETRIED`
+        ``status_code`` and ``retry_after``
+    :data:`FAILED`
+        ``error`` (the exception)
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import binascii
+import hashlib
+import json
+import os
+import threading
+import time
+
+from ._compat import monotonic
+
+#: A request is about to be sent.
+REQUEST_START = 'request_start'
+#: A response has been received completely.
+RESPONSE_RECEIVED = 'response_received'
+#: A response has been parsed.
+PARSED = 'parsed'
+#: A request is going to be retried.
+RETRIED = 'retried'
+#: A request failed.
+FAILED = 'failed'
+
+EVENTS = (REQUEST_START, RESPONSE_RECEIVED, PARSED, RETRIED, FAILED)
+
+
+def dispatch_hook(hooks, name, event):
+    """Call the hooks registered for `name` with `event`.
+
+    :param hooks: A dictionary mapping event names to a callable or a list
+                  of callables.
+    :type hooks: dict
+    """
+    registered = hooks.get(name)
+    if registered is None:
+        return
+    if callable(registered):
+        registered = [registered]
+    for hook in registered:
+        hook(event)
+
+
+def merge_hooks(*hook_dicts):
+    """Merge several hook dictionaries into one."""
+    merged = {}
+    for hooks in hook_dicts:
+        for name, registered in hooks.items():
+            if callable(registered):
+                registered = [registered]
+            merged.setdefault(name, []).extend(registered)
+    return merged
+
+
+class RateLimiter(object):
+    """Limits the number of requests per second by delaying their start.
+
+    The limiter is thread-safe and can be shared by several Sickle objects
+    harvesting the same server::
+
+        >>> sickle = Sickle('http://...', event_hooks=RateLimiter(2).hooks())
+
+    :param rate: The maximum number of requests per second.
+    :type rate: float
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            now = monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def hooks(self):
+        """Return the hook dictionary to pass to
+        :class:`sickle.app.Sickle`."""
+        return {REQUEST_START: [self]}
+
+
+def _random_id(length):
+    return binascii.hexlify(os.urandom(length)).decode('ascii')
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class SpanExporter(object):
+    """Writes harvesting events as spans to a file.
+
+    Each line of the file is an OTLP/JSON ``ExportTraceServiceRequest``
+    holding one span, the format read by the OpenTelemetry Collector's
+    ``otlpjsonfile`` receiver. One span is written per HTTP request
+    (``oai.<verb>``) and per parsed response (``oai.<verb>.parse``, a
+    child of the request span). All spans of one exporter share a trace
+    id::
+
+        >>> exporter = SpanExporter('spans.jsonl')
+        >>> sickle = Sickle('http://...', event_hooks=exporter.hooks())
+        >>> ...
+        >>> exporter.close()
+
+    :param path: The path of the file the spans are appended to.
+    :type path: str
+    :param service_name: The value of the ``service.name`` resource
+                         attribute.
+    :type service_name: str
+    """
+
+    def __init__(self, path, service_name='sickle'):
+        self.path = path
+        self.service_name = service_name
+        self.trace_id = _random_id(16)
+        self._fp = open(path, 'a')
+        self._lock = threading.Lock()
+        # Start time of the current request of each thread
+        self._requests = threading.local()
+
+    def hooks(self):
+        """Return the hook dictionary to pass to
+        :class:`sickle.app.Sickle`."""
+        return {
+            REQUEST_START: [self._request_start],
+            RESPONSE_RECEIVED: [self._response_received],
+            PARSED: [self._parsed],
+            FAILED: [self._failed],
+        }
+
+    def _request_start(self, event):
+        self._requests.timestamp = event['timestamp']
+
+    def _span_id(self, event):
+        # Derived from the event, as responses may be parsed on another
+        # thread than the one that requested them
+        if event.get('request_id') is None:
+            return None
+        key = '%s %s %d' % (self.trace_id, event['request_id'],
+                            event['attempt'])
+        return hashlib.sha1(key.encode('ascii')).hexdigest()[:16]
+
+    def _write(self, name, start, end, attributes, error=None,
+               span_id=None, parent_span_id=None, kind=3):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': span_id or _random_id(8),
+            'name': name,
+            'kind': kind,
+            'startTimeUnixNano': str(int(start * 1e9)),
+            'endTimeUnixNano': str(int(end * 1e9)),
+            'attributes': [
+                _attribute(key, value)
+                for key, value in sorted(attributes.items())
+                if value is not None],
+            'status': {'code': 2, 'message': str(error)} if error is not None
+            else {'code': 1},
+        }
+        if parent_span_id is not None:
+            span['parentSpanId'] = parent_span_id
+        request = {'resourceSpans': [{
+            'resource': {'attributes': [
+                _attribute('service.name', self.service_name)]},
+            'scopeSpans': [{'scope': {'name': 'sickle'}, 'spans': [span]}],
+        }]}
+        line = json.dumps(request, sort_keys=True)
+        with self._lock:
+            self._fp.write(line + '\n')
+            self._fp.flush()
+
+    def _request_attributes(self, event):
+        attributes = {
+            'http.url': event['endpoint'],
+            'oai.verb': event['verb'],
+            'oai.attempt': event['attempt'],
+        }
+        if 'resumptionToken' in event['params']:
+            attributes['oai.resumption_token'] = \
+                event['params']['resumptionToken']
+        return attributes
+
+    def _response_received(self, event):
+        end = event['timestamp']
+        start = end - event['duration']
+        attributes = self._request_attributes(event)
+        attributes.update({
+            'http.status_code': event['status_code'],
+            'http.response_content_length': event['bytes'],
+            'oai.ttfb': event['ttfb'],
+            'oai.download': event['download'],
+        })
+        self._write('oai.%s' % event['verb'], start, end, attributes,
+                    span_id=self._span_id(event))
+
+    def _parsed(self, event):
+        end = event['timestamp']
+        self._write('oai.%s.parse' % event['verb'], end - event['duration'],
+                    end, self._request_attributes(event),
+                    parent_span_id=self._span_id(event),
+                    kind=1)  # SPAN_KIND_INTERNAL
+
+    def _failed(self, event):
+        start = getattr(self._requests, 'timestamp', None) or \
+            event['timestamp']
+        self._write('oai.%s' % event['verb'], start, event['timestamp'],
+                    self._request_attributes(event), error=event['error'],
+                    span_id=self._span_id(event))
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
@@ -7,9 +7,44 @@
 
     :copyright: Copyright 2015 Mathias Loesch
 """
+import datetime
+import itertools
+import logging
+import threading
+from collections import namedtuple
 
 from sickle import oaiexceptions
+from sickle._compat import monotonic
+from sickle.filters import get_header, is_deleted
 from sickle.models import ResumptionToken
+from sickle.response import scan_response
+from sickle.utils import repository_granularity, truncate_datestamp
+
+logger = logging.getLogger(__name__)
+
+
+class _Prefetch(object):
+    """Requests a page in a background thread."""
+
+    def __init__(self, sickle, params):
+        self.params = params
+        self._response = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(sickle,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, sickle):
+        try:
+            self._response = sickle.harvest(**self.params)
+        except Exception as error:
+            self._error = error
+
+    def result(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._response
 
 
 # Map OAI verbs to the XML elements
@@ -35,14 +70,27 @@ class BaseOAIIterator(object):
     :type params:  dict
     :param ignore_deleted: Flag for whether to ignore deleted records.
     :type ignore_deleted: bool
+    :param item_filter: Optional predicate that is called with the XML
+                        element of each item before it is mapped. Items for
+                        which it returns :obj:`False` are skipped
+                        (see :mod:`sickle.filters`).
     """
 
-    def __init__(self, sickle, params, ignore_deleted=False):
+    def __init__(self, sickle, params, ignore_deleted=False,
+                 item_filter=None):
         self.sickle = sickle
         self.params = params
         self.ignore_deleted = ignore_deleted
+        self.item_filter = item_filter
         self.verb = self.params.get('verb')
         self.resumption_token = None
+        #: Monotonic time at which the current resumption token expires
+        self._token_deadline = None
+        #: Flag for whether the current page has been fetched early already
+        self._fetched_early = False
+        self._prefetched = None
+        #: Position and size of the last page, if pages are inspected
+        self._page_info = None
         self._next_response()
 
     def __iter__(self):
@@ -73,15 +121,37 @@ class BaseOAIIterator(object):
         )
         return resumption_token
 
+    def _seconds_to_expiration(self):
+        """Seconds until the current resumption token expires or :obj:`None`
+        if its expiration date is unknown."""
+        if self._token_deadline is None:
+            return None
+        return self._token_deadline - monotonic()
+
     def _next_response(self):
         """Get the next response from the OAI server."""
         params = self.params
         if self.resumption_token:
+            remaining = self._seconds_to_expiration()
+            if remaining is not None and \
+                    remaining < self.sickle.token_expiry_margin:
+                logger.warning(
+                    "Resumption token %s %s." % (
+                        self.resumption_token.token,
+                        'has expired' if remaining <= 0 else
+                        'expires in %d seconds' % remaining))
             params = {
                 'resumptionToken': self.resumption_token.token,
                 'verb': self.verb
             }
-        self.oai_response = self.sickle.harvest(**params)
+        self.oai_response = self._harvest(params)
+        if self.sickle.salvager is not None:
+            self.oai_response, self._page_info = self.sickle.salvager.process(
+                self.sickle, params, self.oai_response, self._page_info)
+        # A damaged page may be requested again, so the next page is only
+        # requested once the salvager has accepted this one
+        if self.sickle.prefetch:
+            self._prefetch_next_page()
         error = self.oai_response.xml.find(
             './/' + self.sickle.oai_namespace + 'error')
         if error is not None:
@@ -93,6 +163,38 @@ class BaseOAIIterator(object):
             except AttributeError:
                 raise oaiexceptions.OAIError(description)
         self.resumption_token = self._get_resumption_token()
+        self._token_deadline = None
+        self._fetched_early = False
+        expiration = self.resumption_token.expiration \
+            if self.resumption_token else None
+        if expiration is not None and \
+                self.sickle.token_expiry_margin is not None:
+            self._token_deadline = monotonic() + (
+                expiration - datetime.datetime.utcnow()).total_seconds()
+
+    def _harvest(self, params):
+        prefetched, self._prefetched = self._prefetched, None
+        if prefetched is not None:
+            if prefetched.params == params:
+                return prefetched.result()
+            logger.warning(
+                "Discarding the page prefetched for resumption token %s." %
+                prefetched.params['resumptionToken'])
+        return self.sickle.harvest(**params)
+
+    def _prefetch_next_page(self):
+        """Request the next page in the background if the resumption token
+        can be found without parsing the current page. If the parsed page
+        has a different token, the prefetched page is discarded.
+
+        The request uses up the resumption token on servers that accept
+        each token once, even if the page is never consumed."""
+        token, error = scan_response(self.oai_response.http_response.content)
+        if token and error is None:
+            self._prefetched = _Prefetch(self.sickle, {
+                'resumptionToken': token,
+                'verb': self.verb
+            })
 
     def next(self):
         """Must be implemented by subclasses."""
@@ -127,27 +229,190 @@ class OAIItemIterator(BaseOAIIterator):
     :type params:  dict
     :param ignore_deleted: Flag for whether to ignore deleted records.
     :type ignore_deleted: bool
+    :param item_filter: Optional predicate that is called with the XML
+                        element of each item before it is mapped. Items for
+                        which it returns :obj:`False` are skipped
+                        (see :mod:`sickle.filters`).
     """
 
-    def __init__(self, sickle, params, ignore_deleted=False):
+    def __init__(self, sickle, params, ignore_deleted=False,
+                 item_filter=None):
         self.mapper = sickle.class_mapping[params.get('verb')]
         self.element = VERBS_ELEMENTS[params.get('verb')]
-        super(OAIItemIterator, self).__init__(sickle, params, ignore_deleted)
+        self._delivered = set()
+        self._last_datestamp = None
+        self._in_order = True
+        super(OAIItemIterator, self).__init__(sickle, params, ignore_deleted,
+                                              item_filter)
 
     def _next_response(self):
-        super(OAIItemIterator, self)._next_response()
+        try:
+            super(OAIItemIterator, self)._next_response()
+        except oaiexceptions.BadResumptionToken:
+            if not (self.sickle.recover_expired_tokens and
+                    self.resumption_token):
+                raise
+            self._restart()
         self._items = self.oai_response.xml.iterfind(
             './/' + self.sickle.oai_namespace + self.element)
 
+    def _restart(self):
+        """Restart the query after the resumption token has expired.
+
+        If the datestamps delivered so far were in ascending order, the
+        query is restarted from the last delivered datestamp (truncated to
+        the granularity of the repository), otherwise from the start. Items
+        that have already been delivered are skipped.
+        """
+        params = dict(self.params)
+        if self._in_order and self._last_datestamp is not None:
+            params['from'] = truncate_datestamp(
+                self._last_datestamp, repository_granularity(self.sickle))
+        logger.warning(
+            "Resumption token %s has expired, restarting %s from %s." % (
+                self.resumption_token.token, self.verb,
+                params.get('from', 'the start')))
+        self.params = params
+        self.resumption_token = None
+        self._token_deadline = None
+        self._page_info = None
+        super(OAIItemIterator, self)._next_response()
+
+    def _track(self, item):
+        """Remember identifier and datestamp of a delivered item for
+        restarting the query. Returns :obj:`False` if the item has been
+        delivered before.
+
+        While the datestamps are in ascending order, only the identifiers
+        delivered on the day of the last datestamp are kept, as the query
+        is never restarted before that day.
+        """
+        header = get_header(item)
+        if header is None:
+            return True
+        namespace = self.sickle.oai_namespace
+        identifier = header.findtext(namespace + 'identifier')
+        if identifier in self._delivered:
+            return False
+        datestamp = header.findtext(namespace + 'datestamp')
+        if datestamp is not None:
+            if self._last_datestamp is not None and \
+                    datestamp < self._last_datestamp:
+                if self._in_order:
+                    logger.warning(
+                        'Datestamps are not in ascending order, a restarted '
+                        '%s may deliver records again.' % self.verb)
+                self._in_order = False
+            else:
+                if self._in_order and self._last_datestamp is not None \
+                        and datestamp[:10] != self._last_datestamp[:10]:
+                    self._delivered = set()
+                self._last_datestamp = datestamp
+        self._delivered.add(identifier)
+        return True
+
+    def _expires_soon(self):
+        return self._token_deadline is not None and \
+            bool(self.resumption_token.token) and \
+            self._seconds_to_expiration() < self.sickle.token_expiry_margin
+
+    def _prefetch(self):
+        """Request the next page before the current page has been consumed
+        because the resumption token is about to expire.
+
+        This happens at most once per page: if the token of the new page
+        expires within the margin as well (short expirations, skewed
+        clocks), the new page is consumed before it is continued.
+        """
+        logger.warning(
+            "Resumption token %s is about to expire, fetching the next "
+            "page early." % self.resumption_token.token)
+        remaining = list(self._items)
+        self._next_response()
+        self._items = itertools.chain(remaining, self._items)
+        self._fetched_early = self._expires_soon()
+
     def next(self):
         """Return the next record/header/set."""
+        # Deletion status can be read from the header element, so that
+        # deleted records/headers are skipped without being mapped
+        check_header = self.element in ('record', 'header')
+        track = self.sickle.recover_expired_tokens and check_header
         while True:
             for item in self._items:
+                if self.ignore_deleted and check_header and is_deleted(item):
+                    continue
+                # Items sent again after a restart never reach the filter
+                if track and not self._track(item):
+                    continue
+                if self.item_filter is not None and \
+                        not self.item_filter(item):
+                    continue
                 mapped = self.mapper(item)
-                if self.ignore_deleted and mapped.deleted:
+                if self.ignore_deleted and not check_header \
+                        and mapped.deleted:
                     continue
+                if not self._fetched_early and self._expires_soon():
+                    self._prefetch()
                 return mapped
             if self.resumption_token and self.resumption_token.token:
                 self._next_response()
             else:
                 raise StopIteration
+
+
+#: A page of mapped items returned by :class:`OAIBatchIterator`
+Batch = namedtuple('Batch', ['items', 'resumption_token', 'oai_response'])
+
+
+class OAIBatchIterator(OAIItemIterator):
+    """Iterator over the pages of a list request yielding one
+    :class:`Batch` of mapped items per OAI response.
+
+    This allows writing the items of each page in bulk and checkpointing
+    the resumption token once per page::
+
+        >>> sickle = Sickle('http://...', iterator=OAIBatchIterator)
+        >>> for batch in sickle.ListRecords(metadataPrefix='oai_dc'):
+        ...     db.insert_many(batch.items)
+        ...     save_checkpoint(batch.resumption_token)
+
+    Pages whose items are all skipped result in empty batches.
+
+    :param sickle: The Sickle object that issued the first request.
+    :type sickle: :class:`sickle.app.Sickle`
+    :param params: The OAI arguments.
+    :type params:  dict
+    :param ignore_deleted: Flag for whether to ignore deleted records.
+    :type ignore_deleted: bool
+    :param item_filter: Optional predicate that is called with the XML
+                        element of each item before it is mapped.
+    """
+
+    def next(self):
+        """Return the next batch."""
+        if self._items is None:
+            if self.resumption_token and self.resumption_token.token:
+                self._next_response()
+            else:
+                raise StopIteration
+        items, self._items = self._items, None
+        ignore_deleted = self.ignore_deleted
+        item_filter = self.item_filter
+        mapper = self.mapper
+        check_header = self.element in ('record', 'header')
+        track = self.sickle.recover_expired_tokens and check_header
+        mapped_items = []
+        append = mapped_items.append
+        for item in items:
+            if ignore_deleted and check_header and is_deleted(item):
+                continue
+            if track and not self._track(item):
+                continue
+            if item_filter is not None and not item_filter(item):
+                continue
+            mapped = mapper(item)
+            if ignore_deleted and not check_header and mapped.deleted:
+                continue
+            append(mapped)
+        return Batch(mapped_items, self.resumption_token, self.oai_response)
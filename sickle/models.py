@@ -11,7 +11,7 @@
 from lxml import etree
 
 from ._compat import PY3, to_str
-from .utils import get_namespace, xml_to_dict
+from .utils import get_namespace, xml_to_dict, parse_datestamp
 
 
 class ResumptionToken(object):
@@ -24,6 +24,11 @@ class ResumptionToken(object):
         self.complete_list_size = complete_list_size
         self.expiration_date = expiration_date
 
+    @property
+    def expiration(self):
+        """The expiration date as naive UTC datetime or :obj:`None`."""
+        return parse_datestamp(self.expiration_date)
+
     def __repr__(self):
         return '<ResumptionToken %s>' % self.token
 
@@ -46,14 +51,20 @@ class OAIItem(object):
 
 
     def __bytes__(self):
-        return etree.tounicode(self.xml).encode("utf8")
-
-    def __str__(self):
-        return self.__unicode__() if PY3 else self.__bytes__()
+        return self.__unicode__().encode("utf8")
 
     def __unicode__(self):
         return etree.tounicode(self.xml)
 
+    # The methods are looked up on the instance, so that subclasses only
+    # need to override __unicode__
+    if PY3:  # pragma: no cover
+        def __str__(self):
+            return self.__unicode__()
+    else:  # pragma: no cover
+        def __str__(self):
+            return self.__bytes__()
+
     @property
     def raw(self):
         """The original XML as unicode."""
@@ -81,8 +92,7 @@ class Identify(OAIItem):
         return '<Identify>'
 
     def __iter__(self):
-        return iter(self._identify_dict.items()) if PY3 else \
-            self._identify_dict.iteritems()
+        return iter(self._identify_dict.items())
 
 
 class Header(OAIItem):
@@ -141,8 +151,7 @@ class Record(OAIItem):
             return '<Record %s>' % self.header.identifier
 
     def __iter__(self):
-        return iter(self.metadata.items()) if PY3 else \
-            self.metadata.iteritems()
+        return iter(self.metadata.items())
 
     def get_metadata(self):
         # We want to get record/metadata/<container>/*
@@ -171,8 +180,7 @@ class Set(OAIItem):
         return '<Set %s>' % to_str(self.setName)
 
     def __iter__(self):
-        return iter(self._set_dict.items()) if PY3 else \
-            self._set_dict.iteritems()
+        return iter(self._set_dict.items())
 
 
 class MetadataFormat(OAIItem):
@@ -193,5 +201,4 @@ class MetadataFormat(OAIItem):
         return '<MetadataFormat %s>' % to_str(self.metadataPrefix)
 
     def __iter__(self):
-        return iter(self._mdf_dict.items()) if PY3 else \
-            self._mdf_dict.iteritems()
+        return iter(self._mdf_dict.items())
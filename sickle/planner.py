@@ -0,0 +1,267 @@
+# coding: utf-8
+"""
+    sickle.planner
+    ~~~~~~~~~~~~~~
+
+    Planning of harvests based on the observed performance of an endpoint.
+
+    The page size of an OAI interface is chosen by the server, but a harvest
+    can be split into date windows that are requested in parallel. The
+    :class:`HarvestPlanner` measures the latency and the number of items of
+    each page, estimates the size of a harvest from the ``completeListSize``
+    of resumption tokens and chooses the number of windows and the
+    concurrency accordingly. What it learns is kept in an
+    :class:`EndpointProfile` for the next run::
+
+        >>> profile = EndpointProfile.for_endpoint('/var/cache/sickle',
+        ...                                        sickle.endpoint)
+        >>> planner = HarvestPlanner(profile)
+        >>> sickle.event_hooks = merge_hooks(sickle.event_hooks,
+        ...                                  planner.hooks())
+        >>> windows, concurrency = planner.plan(sickle, params)
+        >>> planner.start()
+        >>> ... harvest the windows with `concurrency` workers ...
+        >>> planner.finish()
+
+    The concurrency is increased by one after each run that was faster than
+    the previous one and halved after a run in which the server throttled
+    requests (HTTP 429 or 503).
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import datetime
+import hashlib
+import json
+import math
+import os
+import threading
+
+from sickle._compat import monotonic
+from sickle.hooks import RESPONSE_RECEIVED, PARSED
+from sickle.estimate import probe_size
+from sickle.iterator import VERBS_ELEMENTS
+from sickle.utils import date_windows, parse_date
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class EndpointProfile(object):
+    """Performance figures of an endpoint, persisted as JSON.
+
+    Latency and items per page are kept per verb as moving averages, so
+    that recent runs weigh more than old ones.
+
+    :param path: The path of the JSON file.
+    :type path: str
+    """
+
+    #: Weight of a new observation in the moving averages
+    smoothing = 0.5
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {'verbs': {}, 'concurrency': 2, 'throughput': None,
+                     'records_per_day': None}
+        try:
+            with open(path) as fp:
+                self.data.update(json.load(fp))
+        except (IOError, OSError, ValueError):
+            pass
+
+    @classmethod
+    def for_endpoint(cls, directory, endpoint):
+        """Open the profile of `endpoint` in `directory`.
+
+        :param directory: The directory holding the profiles of all
+                          endpoints.
+        :type directory: str
+        :param endpoint: The endpoint of the OAI interface.
+        :type endpoint: str
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        name = hashlib.sha1(endpoint.encode('utf-8')).hexdigest() + '.json'
+        return cls(os.path.join(directory, name))
+
+    @property
+    def concurrency(self):
+        """The number of parallel requests to use."""
+        return self.data['concurrency']
+
+    def page_seconds(self, verb):
+        """The average time for requesting one page or :obj:`None`."""
+        return self.data['verbs'].get(verb, {}).get('page_seconds')
+
+    def page_items(self, verb):
+        """The average number of items per page or :obj:`None`."""
+        return self.data['verbs'].get(verb, {}).get('page_items')
+
+    def observe(self, verb, page_seconds=None, page_items=None):
+        """Update the moving averages of `verb`."""
+        figures = self.data['verbs'].setdefault(verb, {})
+        for key, value in (('page_seconds', page_seconds),
+                           ('page_items', page_items)):
+            if value is None:
+                continue
+            previous = figures.get(key)
+            if previous is None:
+                figures[key] = value
+            else:
+                figures[key] = previous + self.smoothing * (value - previous)
+
+    def save(self):
+        path = self.path + '.tmp'
+        with open(path, 'w') as fp:
+            json.dump(self.data, fp, indent=2, sort_keys=True)
+        _replace(path, self.path)
+
+
+class HarvestPlanner(object):
+    """Chooses date windows and concurrency for harvesting an endpoint.
+
+    :param profile: The profile of the endpoint.
+    :type profile: :class:`EndpointProfile`
+    :param max_concurrency: The maximum number of parallel requests.
+    :type max_concurrency: int
+    :param window_seconds: The time harvesting one window should take.
+    :type window_seconds: float
+    :param throttle_status_codes: HTTP status codes that indicate that the
+                                  server is overloaded or rate limits
+                                  requests.
+    :type throttle_status_codes: iterable
+    """
+
+    #: Items per page assumed before anything is known about an endpoint
+    default_page_items = 100
+    #: Seconds per page assumed before anything is known about an endpoint
+    default_page_seconds = 2.0
+
+    def __init__(self, profile, max_concurrency=8, window_seconds=300,
+                 throttle_status_codes=(429, 503)):
+        self.profile = profile
+        self.max_concurrency = max_concurrency
+        self.window_seconds = window_seconds
+        self.throttle_status_codes = tuple(throttle_status_codes)
+        self._lock = threading.Lock()
+        self.start()
+
+    def hooks(self):
+        """Return the hook dictionary to pass to
+        :class:`sickle.app.Sickle`."""
+        return {
+            RESPONSE_RECEIVED: [self._response_received],
+            PARSED: [self._parsed],
+        }
+
+    def start(self):
+        """Reset the measurements at the start of a harvest."""
+        with self._lock:
+            self._started = monotonic()
+            self._seconds = {}
+            self._pages = {}
+            self._items = {}
+            self.throttled = 0
+
+    def _response_received(self, event):
+        with self._lock:
+            if event['status_code'] in self.throttle_status_codes:
+                self.throttled += 1
+                return
+            verb = event['verb']
+            self._seconds[verb] = self._seconds.get(verb, 0.0) + \
+                event['duration']
+
+    def _parsed(self, event):
+        response = event.get('response')
+        element = VERBS_ELEMENTS.get(event['verb'])
+        if response is None or element is None or response.xml is None:
+            return
+        namespace = response.xml.tag.rpartition('}')[0] + '}'
+        items = len(response.xml.findall('.//' + namespace + element))
+        verb = event['verb']
+        with self._lock:
+            self._pages[verb] = self._pages.get(verb, 0) + 1
+            self._items[verb] = self._items.get(verb, 0) + items
+
+    @property
+    def items(self):
+        """The number of items received since :meth:`start`."""
+        with self._lock:
+            return sum(self._items.values())
+
+    def finish(self):
+        """Fold the measurements of the harvest into the profile, adapt the
+        concurrency and save the profile."""
+        with self._lock:
+            elapsed = monotonic() - self._started
+            for verb, pages in self._pages.items():
+                self.profile.observe(
+                    verb,
+                    page_seconds=self._seconds.get(verb, 0.0) / pages,
+                    page_items=float(self._items[verb]) / pages)
+            items = sum(self._items.values())
+        data = self.profile.data
+        throughput = items / elapsed if items and elapsed > 0 else None
+        if self.throttled:
+            data['concurrency'] = max(1, data['concurrency'] // 2)
+        elif throughput is not None and (
+                data['throughput'] is None or
+                throughput > data['throughput']):
+            data['concurrency'] = min(self.max_concurrency,
+                                      data['concurrency'] + 1)
+        if throughput is not None:
+            data['throughput'] = throughput
+        self.profile.save()
+
+    def estimate_size(self, sickle, params):
+        """Return the number of items `params` select or :obj:`None`.
+
+        The estimate is read from the ``completeListSize`` of the first
+        ListIdentifiers page, which is usually much cheaper than the first
+        page of the actual harvest.
+        """
+        size, complete = probe_size(sickle, params)
+        return size if complete else None
+
+    def window_count(self, size, verb, days):
+        """Return the number of date windows for a harvest of `size` items
+        over `days` days."""
+        page_items = self.profile.page_items(verb) or self.default_page_items
+        page_seconds = self.profile.page_seconds(verb) or \
+            self.default_page_seconds
+        pages = int(math.ceil(size / float(page_items)))
+        windows = int(math.ceil(pages * page_seconds / self.window_seconds))
+        # Give every worker a window as long as they have a page to fetch
+        windows = max(windows, min(pages, self.profile.concurrency))
+        return max(1, min(windows, days))
+
+    def plan(self, sickle, params):
+        """Split the harvest described by `params` into date windows.
+
+        :param sickle: The client for the endpoint.
+        :type sickle: :class:`sickle.app.Sickle`
+        :param params: The OAI parameters of the harvest.
+        :type params: dict
+        :returns: A list of parameter dictionaries and the number of
+                  windows to harvest in parallel.
+        """
+        start = params.get('from') or sickle.Identify().earliestDatestamp
+        start = parse_date(start)
+        end = parse_date(params['until']) if params.get('until') \
+            else datetime.date.today()
+        days = (end - start).days + 1
+        size = self.estimate_size(sickle, params)
+        if size is None and self.profile.data['records_per_day']:
+            size = self.profile.data['records_per_day'] * days
+        if size is None or days < 2:
+            return [params], 1
+        if days >= 30:
+            # Estimates of short periods say little about the density
+            self.profile.data['records_per_day'] = float(size) / days
+        count = self.window_count(size, params.get('verb'), days)
+        if count == 1:
+            return [params], 1
+        length = int(math.ceil(days / float(count)))
+        windows = [dict(params, **{'from': window[0], 'until': window[1]})
+                   for window in date_windows(start, end, length)]
+        return windows, min(len(windows), self.profile.concurrency)
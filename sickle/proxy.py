@@ -0,0 +1,601 @@
+# coding: utf-8
+"""
+    sickle.proxy
+    ~~~~~~~~~~~~
+
+    A caching OAI-PMH proxy.
+
+    An :class:`OAIProxy` harvests an upstream repository once through a
+    :class:`sickle.app.Sickle` object into a local SQLite database (one
+    :class:`sickle.sink.SQLiteSink` table per metadata format) and serves
+    the six OAI-PMH verbs from it as a WSGI application, so that many
+    internal clients put load on the upstream repository only once::
+
+        >>> proxy = OAIProxy(Sickle('http://example.com/oai'), 'proxy.db',
+        ...                  metadata_prefixes=['oai_dc', 'marc21'])
+        >>> proxy.refresh()
+        {'oai_dc': <SinkStats rows=5312 deleted=12 rows/s=4811.3>, ...}
+        >>> serve(proxy, port=8000, refresh_interval=3600)
+
+    Later refreshes are incremental and start at the latest stored
+    datestamp. ``from``, ``until`` and ``set`` queries are answered from
+    the indexed columns of the local tables. The proxy issues its own
+    resumption tokens, which encode the query and the last identifier
+    delivered: they do not expire and stay valid across refreshes.
+
+    The proxy can also be started from the command line::
+
+        $ sickle-proxy http://example.com/oai -m oai_dc --port 8000
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import argparse
+import base64
+import json
+import logging
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+from lxml import etree
+
+from sickle import oaiexceptions
+from sickle._compat import string_types
+from sickle.sink import SQLiteSink, SinkStats
+
+try:
+    from urllib.parse import parse_qs
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from urlparse import parse_qs
+    from SocketServer import ThreadingMixIn
+
+logger = logging.getLogger(__name__)
+
+OAI_NAMESPACE = 'http://www.openarchives.org/OAI/2.0/'
+
+#: Required and optional arguments of each verb
+VERBS = {
+    'Identify': ((), ()),
+    'ListMetadataFormats': ((), ('identifier',)),
+    'ListSets': ((), ('resumptionToken',)),
+    'GetRecord': (('identifier', 'metadataPrefix'), ()),
+    'ListIdentifiers': (('metadataPrefix',),
+                        ('from', 'until', 'set', 'resumptionToken')),
+    'ListRecords': (('metadataPrefix',),
+                    ('from', 'until', 'set', 'resumptionToken')),
+}
+
+_CODES = {
+    oaiexceptions.BadArgument: 'badArgument',
+    oaiexceptions.BadResumptionToken: 'badResumptionToken',
+    oaiexceptions.BadVerb: 'badVerb',
+    oaiexceptions.CannotDisseminateFormat: 'cannotDisseminateFormat',
+    oaiexceptions.IdDoesNotExist: 'idDoesNotExist',
+    oaiexceptions.NoMetadataFormat: 'noMetadataFormats',
+    oaiexceptions.NoRecordsMatch: 'noRecordsMatch',
+    oaiexceptions.NoSetHierarchy: 'noSetHierarchy',
+}
+
+_ENVELOPE = (
+    u'<?xml version="1.0" encoding="UTF-8"?>\n'
+    u'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/" '
+    u'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    u'xsi:schemaLocation="http://www.openarchives.org/OAI/2.0/ '
+    u'http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd">'
+    u'<responseDate>%s</responseDate>%s%s</OAI-PMH>')
+
+_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}:\d{2}Z)?$')
+
+
+def _table(prefix):
+    return 'records_' + re.sub(r'\W', '_', prefix)
+
+
+def _where(conditions):
+    if not conditions:
+        return ''
+    return ' WHERE ' + ' AND '.join(conditions)
+
+
+def _header(identifier, datestamp, deleted, set_specs):
+    parts = [u'<header status="deleted">' if deleted else u'<header>',
+             u'<identifier>%s</identifier>' % escape(identifier),
+             u'<datestamp>%s</datestamp>' % escape(datestamp or u'')]
+    for spec in (set_specs or u'').split():
+        parts.append(u'<setSpec>%s</setSpec>' % escape(spec))
+    parts.append(u'</header>')
+    return u''.join(parts)
+
+
+def _record(identifier, datestamp, deleted, set_specs, raw):
+    if raw is None:
+        return u'<record>%s</record>' % _header(
+            identifier, datestamp, deleted, set_specs)
+    return zlib.decompress(bytes(raw)).decode('utf-8').strip()
+
+
+def _check_dates(args):
+    """Raise :class:`sickle.oaiexceptions.BadArgument` unless `from` and
+    `until` are valid datestamps of the same granularity."""
+    for name in ('from', 'until'):
+        if name in args and not _DATE.match(args[name]):
+            raise oaiexceptions.BadArgument(
+                'Illegal date: %s.' % args[name])
+    if 'from' in args and 'until' in args and \
+            len(args['from']) != len(args['until']):
+        raise oaiexceptions.BadArgument(
+            'from and until must have the same granularity.')
+
+
+def _valid_state(verb, query, last, cursor, total):
+    if not isinstance(query, dict) or \
+            not isinstance(last, string_types) or \
+            not all(isinstance(n, int) and n >= 0 for n in (cursor, total)):
+        return False
+    required, optional = VERBS[verb]
+    if any(name not in query for name in required) or \
+            any(name not in required + optional or name == 'resumptionToken'
+                or not isinstance(value, string_types)
+                for name, value in query.items()):
+        return False
+    try:
+        _check_dates(query)
+    except oaiexceptions.BadArgument:
+        return False
+    return True
+
+
+def encode_token(verb, query, last, cursor, total):
+    """Encode the state of a list request as a resumption token.
+
+    :param verb: The verb of the request.
+    :param query: The arguments of the first request of the list.
+    :type query: dict
+    :param last: The key of the last item delivered.
+    :param cursor: The number of items delivered.
+    :param total: The size of the complete list.
+    """
+    state = json.dumps([verb, query, last, cursor, total], sort_keys=True,
+                       separators=(',', ':'))
+    return base64.urlsafe_b64encode(state.encode('utf-8')) \
+        .decode('ascii').rstrip('=')
+
+
+def decode_token(verb, token):
+    """Return ``(query, last, cursor, total)`` of a resumption token issued
+    for `verb`.
+
+    :raises: :class:`sickle.oaiexceptions.BadResumptionToken` if the token
+             is invalid.
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(
+            (token + '=' * (-len(token) % 4)).encode('ascii'))
+            .decode('utf-8'))
+        token_verb, query, last, cursor, total = state
+        # The state is checked like the arguments of a request
+        valid = token_verb == verb and \
+            _valid_state(verb, query, last, cursor, total)
+    except (TypeError, ValueError, UnicodeError):
+        valid = False
+    if not valid:
+        raise oaiexceptions.BadResumptionToken(
+            'The resumptionToken is invalid.')
+    return query, last, cursor, total
+
+
+class OAIProxy(object):
+    """Serves the records of an upstream repository from a local store.
+
+    The object is a WSGI application answering GET and POST requests. It
+    can be shared between threads; :meth:`refresh` may run while requests
+    are served.
+
+    :param sickle: The client for the upstream repository.
+    :type sickle: :class:`sickle.app.Sickle`
+    :param path: The path of the SQLite database.
+    :type path: str
+    :param metadata_prefixes: The metadata formats harvested and served.
+    :type metadata_prefixes: list
+    :param page_size: The number of items per list response.
+    :type page_size: int
+    :param base_url: The base URL of the proxy as announced in Identify
+                     responses. By default it is taken from the request.
+    :type base_url: str
+    """
+
+    def __init__(self, sickle, path, metadata_prefixes=('oai_dc',),
+                 page_size=100, base_url=None):
+        self.sickle = sickle
+        self.path = path
+        self.metadata_prefixes = list(metadata_prefixes)
+        self.page_size = page_size
+        self.base_url = base_url
+        self._sinks = dict((prefix, SQLiteSink(path, table=_table(prefix)))
+                           for prefix in self.metadata_prefixes)
+        # One connection serves all request threads, one query at a time
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'verb TEXT, key TEXT, raw TEXT, PRIMARY KEY (verb, key))')
+        self.connection.commit()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _fetchall(self, sql, params=()):
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def _fetchone(self, sql, params=()):
+        with self._lock:
+            return self.connection.execute(sql, params).fetchone()
+
+    def refresh(self):
+        """Harvest the upstream repository.
+
+        Identify, ListMetadataFormats and ListSets responses are replaced,
+        the records of each metadata format are harvested incrementally.
+
+        :returns: The :class:`sickle.sink.SinkStats` by metadata prefix.
+        :rtype: dict
+        """
+        with self._refresh_lock:
+            identify = self.sickle.Identify()
+            formats = [(f.metadataPrefix, f.raw)
+                       for f in self.sickle.ListMetadataFormats()]
+            try:
+                sets = [(s.setSpec, s.raw) for s in self.sickle.ListSets()]
+            except oaiexceptions.NoSetHierarchy:
+                sets = []
+            with self._lock, self.connection as connection:
+                connection.execute('DELETE FROM responses')
+                connection.executemany(
+                    'INSERT INTO responses VALUES (?, ?, ?)',
+                    [('Identify', '', identify.raw)] +
+                    [('ListMetadataFormats', k, r) for k, r in formats] +
+                    [('ListSets', k, r.strip()) for k, r in sets])
+            stats = {}
+            for prefix, sink in self._sinks.items():
+                params = {'metadataPrefix': prefix}
+                latest = sink.latest_datestamp()
+                if latest is not None:
+                    if getattr(identify, 'granularity', None) == \
+                            'YYYY-MM-DD':
+                        latest = latest[:10]
+                    params['from'] = latest
+                try:
+                    stats[prefix] = sink.consume(
+                        self.sickle.ListRecords(**params))
+                except oaiexceptions.NoRecordsMatch:
+                    stats[prefix] = SinkStats()
+                logger.info('Refreshed %s: %r' % (prefix, stats[prefix]))
+            return stats
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if method == 'POST':
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            query = environ['wsgi.input'].read(length).decode('utf-8')
+        elif method == 'GET':
+            query = environ.get('QUERY_STRING', '')
+        else:
+            start_response('405 Method Not Allowed',
+                           [('Allow', 'GET, POST')])
+            return [b'']
+        base_url = self.base_url
+        if base_url is None:
+            from wsgiref.util import request_uri
+            base_url = request_uri(environ, include_query=False)
+        content = self.handle(parse_qs(query, keep_blank_values=True),
+                              base_url)
+        if content is None:
+            start_response('503 Service Unavailable', [
+                ('Content-Type', 'text/plain'), ('Retry-After', '60')])
+            return [b'The repository has not been harvested yet.']
+        body = content.encode('utf-8')
+        start_response('200 OK', [
+            ('Content-Type', 'text/xml; charset=utf-8'),
+            ('Content-Length', str(len(body)))])
+        return [body]
+
+    def handle(self, arguments, base_url):
+        """Return the response to an OAI-PMH request.
+
+        :param arguments: The request arguments mapped to lists of values,
+                          as returned by :func:`parse_qs`.
+        :type arguments: dict
+        :param base_url: The base URL of the proxy.
+        :returns: The response as unicode or :obj:`None` if the proxy has
+                  not harvested the repository yet.
+        """
+        identify = self._raw('Identify')
+        if identify is None:
+            return None
+        request = u'<request>%s</request>' % escape(base_url)
+        try:
+            verb, args = self._arguments(arguments)
+            request = u'<request%s>%s</request>' % (u''.join(
+                u' %s=%s' % (name, quoteattr(value))
+                for name, value in sorted(args.items())), escape(base_url))
+            if verb == 'Identify':
+                content = self._identify(identify, base_url)
+            elif verb == 'ListMetadataFormats':
+                content = self._list_metadata_formats(args)
+            elif verb == 'ListSets':
+                content = self._list_sets(args)
+            elif verb == 'GetRecord':
+                content = self._get_record(args)
+            else:
+                content = self._list(verb, args)
+        except tuple(_CODES) as error:
+            content = u'<error code="%s">%s</error>' % (
+                _CODES[type(error)], escape(u'%s' % error))
+        return _ENVELOPE % (time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                          time.gmtime()), request, content)
+
+    def _arguments(self, arguments):
+        verbs = arguments.get('verb', [])
+        if len(verbs) != 1 or verbs[0] not in VERBS:
+            raise oaiexceptions.BadVerb('Illegal OAI verb.')
+        verb = verbs[0]
+        required, optional = VERBS[verb]
+        args = {}
+        for name, values in arguments.items():
+            if name == 'verb':
+                continue
+            if name not in required and name not in optional:
+                raise oaiexceptions.BadArgument(
+                    'Illegal argument: %s.' % name)
+            if len(values) > 1:
+                raise oaiexceptions.BadArgument(
+                    'Repeated argument: %s.' % name)
+            args[name] = values[0]
+        if 'resumptionToken' in args:
+            if len(args) > 1:
+                raise oaiexceptions.BadArgument(
+                    'resumptionToken is an exclusive argument.')
+        else:
+            for name in required:
+                if not args.get(name):
+                    raise oaiexceptions.BadArgument(
+                        'Missing argument: %s.' % name)
+        _check_dates(args)
+        return verb, args
+
+    def _raw(self, verb, key=''):
+        row = self._fetchone(
+            'SELECT raw FROM responses WHERE verb = ? AND key = ?',
+            (verb, key))
+        return row[0] if row else None
+
+    def _table(self, prefix):
+        if prefix not in self._sinks:
+            raise oaiexceptions.CannotDisseminateFormat(
+                'The metadata format is not available: %s.' % prefix)
+        return _table(prefix)
+
+    def _identify(self, raw, base_url):
+        element = etree.XML(raw)
+        base = element.find('{%s}baseURL' % OAI_NAMESPACE)
+        if base is not None:
+            base.text = base_url
+        return etree.tounicode(element).strip()
+
+    def _list_metadata_formats(self, args):
+        prefixes = self.metadata_prefixes
+        identifier = args.get('identifier')
+        if identifier is not None:
+            prefixes = [p for p in prefixes if self._fetchone(
+                'SELECT 1 FROM %s WHERE identifier = ?' % _table(p),
+                (identifier,))]
+            if not prefixes:
+                raise oaiexceptions.IdDoesNotExist(
+                    'The identifier does not exist: %s.' % identifier)
+        formats = [self._raw('ListMetadataFormats', p) for p in prefixes]
+        formats = [f.strip() for f in formats if f is not None]
+        if not formats:
+            raise oaiexceptions.NoMetadataFormat(
+                'There are no metadata formats available.')
+        return u'<ListMetadataFormats>%s</ListMetadataFormats>' % \
+            u''.join(formats)
+
+    def _list_sets(self, args):
+        if 'resumptionToken' in args:
+            query, last, cursor, total = decode_token(
+                'ListSets', args['resumptionToken'])
+        else:
+            last, cursor = '', 0
+            total = self._fetchone(
+                'SELECT COUNT(*) FROM responses WHERE verb = ?',
+                ('ListSets',))[0]
+            if not total:
+                raise oaiexceptions.NoSetHierarchy(
+                    'The repository does not support sets.')
+        rows = self._fetchall(
+            'SELECT key, raw FROM responses WHERE verb = ? AND key > ? '
+            'ORDER BY key LIMIT ?', ('ListSets', last, self.page_size + 1))
+        return u'<ListSets>%s%s</ListSets>' % (
+            u''.join(raw for _, raw in rows[:self.page_size]),
+            self._resumption_token('ListSets', {}, rows, cursor, total))
+
+    def _resumption_token(self, verb, query, rows, cursor, total):
+        """Return the resumptionToken element for a page of `rows`, which
+        holds one row more than the page if the list is incomplete."""
+        if len(rows) <= self.page_size:
+            if not cursor:
+                return u''
+            token = u''
+        else:
+            token = encode_token(verb, query, rows[self.page_size - 1][0],
+                                 cursor + self.page_size, total)
+        return u'<resumptionToken completeListSize="%d" cursor="%d">%s' \
+            u'</resumptionToken>' % (total, cursor, token)
+
+    def _get_record(self, args):
+        identifier = args['identifier']
+        table = self._table(args['metadataPrefix'])
+        row = self._fetchone(
+            'SELECT identifier, datestamp, deleted, setSpecs, raw '
+            'FROM %s WHERE identifier = ?' % table, (identifier,))
+        if row is None:
+            if any(self._fetchone(
+                    'SELECT 1 FROM %s WHERE identifier = ?' % _table(p),
+                    (identifier,)) for p in self._sinks):
+                raise oaiexceptions.CannotDisseminateFormat(
+                    'The record is not available in this format.')
+            raise oaiexceptions.IdDoesNotExist(
+                'The identifier does not exist: %s.' % identifier)
+        return u'<GetRecord>%s</GetRecord>' % _record(*row)
+
+    def _conditions(self, query):
+        conditions, params = [], []
+        if 'from' in query:
+            conditions.append('datestamp >= ?')
+            params.append(query['from'])
+        if 'until' in query:
+            until = query['until']
+            if len(until) == 10:
+                until += 'T23:59:59Z'
+            conditions.append('datestamp <= ?')
+            params.append(until)
+        if 'set' in query:
+            if not self._fetchone('SELECT 1 FROM responses WHERE verb = ?',
+                                  ('ListSets',)):
+                raise oaiexceptions.NoSetHierarchy(
+                    'The repository does not support sets.')
+            # Sets are hierarchical: "a" also selects records in "a:b"
+            conditions.append("(instr(' ' || setSpecs || ' ', ?) > 0 OR "
+                              "instr(' ' || setSpecs, ?) > 0)")
+            params.extend([' %s ' % query['set'], ' %s:' % query['set']])
+        return conditions, params
+
+    def _list(self, verb, args):
+        if 'resumptionToken' in args:
+            query, last, cursor, total = decode_token(
+                verb, args['resumptionToken'])
+        else:
+            query, last, cursor, total = args, None, 0, None
+        table = self._table(query['metadataPrefix'])
+        conditions, params = self._conditions(query)
+        if total is None:
+            total = self._fetchone(
+                'SELECT COUNT(*) FROM %s%s' % (table, _where(conditions)),
+                params)[0]
+            if not total:
+                raise oaiexceptions.NoRecordsMatch(
+                    'The combination of the values of the from, until and '
+                    'set arguments results in an empty list.')
+        if last is not None:
+            conditions.append('identifier > ?')
+            params.append(last)
+        columns = 'identifier, datestamp, deleted, setSpecs'
+        if verb == 'ListRecords':
+            columns += ', raw'
+        rows = self._fetchall(
+            'SELECT %s FROM %s%s ORDER BY identifier LIMIT ?' % (
+                columns, table, _where(conditions)),
+            params + [self.page_size + 1])
+        item = _record if verb == 'ListRecords' else _header
+        return u'<%s>%s%s</%s>' % (
+            verb, u''.join(item(*row) for row in rows[:self.page_size]),
+            self._resumption_token(verb, query, rows, cursor, total), verb)
+
+    def close(self):
+        for sink in self._sinks.values():
+            sink.close()
+        with self._lock:
+            self.connection.close()
+
+
+def serve(proxy, host='localhost', port=8000, refresh_interval=None):
+    """Serve `proxy` over HTTP until interrupted.
+
+    Requests are handled in threads.
+
+    :param proxy: The proxy to serve.
+    :type proxy: :class:`OAIProxy`
+    :param refresh_interval: The number of seconds between refreshes in a
+                             background thread (no refreshes by default).
+    :type refresh_interval: float
+    """
+    from wsgiref.simple_server import make_server, WSGIServer
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    if refresh_interval:
+        def refresh():
+            while True:
+                time.sleep(refresh_interval)
+                try:
+                    proxy.refresh()
+                except Exception:
+                    logger.exception('Refreshing the proxy failed.')
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+    server = make_server(host, port, proxy, server_class=ThreadingWSGIServer)
+    logger.info('Serving on http://%s:%d/' % (host, port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='sickle-proxy',
+        description='Serve an OAI-PMH interface from a local copy.')
+    parser.add_argument('endpoint', metavar='ENDPOINT',
+                        help='base URL of the upstream OAI interface')
+    parser.add_argument('-d', '--database', default='proxy.db',
+                        help='path of the local database (default: '
+                             'proxy.db)')
+    parser.add_argument('-m', '--metadata-prefix', action='append',
+                        dest='metadata_prefixes',
+                        help='metadata prefix, can be repeated (default: '
+                             'oai_dc)')
+    parser.add_argument('--host', default='localhost',
+                        help='host to listen on (default: localhost)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen on (default: 8000)')
+    parser.add_argument('--base-url',
+                        help='base URL announced to clients (default: the '
+                             'requested URL)')
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='items per list response (default: 100)')
+    parser.add_argument('--refresh-interval', type=float, default=3600,
+                        help='seconds between refreshes, 0 disables them '
+                             '(default: 3600)')
+    parser.add_argument('--no-initial-refresh', action='store_true',
+                        help='serve the local copy without refreshing it '
+                             'first')
+    return parser
+
+
+def main(argv=None):
+    from sickle.app import Sickle
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    proxy = OAIProxy(Sickle(args.endpoint), args.database,
+                     metadata_prefixes=args.metadata_prefixes or ['oai_dc'],
+                     page_size=args.page_size, base_url=args.base_url)
+    if not args.no_initial_refresh:
+        proxy.refresh()
+    try:
+        serve(proxy, args.host, args.port, args.refresh_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.close()
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
@@ -5,11 +5,127 @@
 
     :copyright: Copyright 2015 Mathias Loesch
 """
+import re
+import threading
+from xml.sax.saxutils import unescape
 
 from lxml import etree
 
+from ._compat import monotonic
+
+#: Parse with ``recover=True`` (default). Broken responses are parsed as far
+#: as possible or result in :obj:`None`.
+RECOVER = 'recover'
+#: Parse strictly. Broken responses raise :class:`lxml.etree.XMLSyntaxError`.
+STRICT = 'strict'
+#: Parse strictly and fall back to :data:`RECOVER` only if that fails. This
+#: is faster for well-formed responses.
+FAST = 'fast'
+
+PARSER_MODES = (RECOVER, STRICT, FAST)
+
+# Kept for backwards compatibility. lxml parsers must not be used by several
+# threads at the same time, use :func:`get_parser` instead.
 XMLParser = etree.XMLParser(remove_blank_text=True, recover=True, resolve_entities=False)
 
+_local = threading.local()
+
+
+def get_parser(recover=True, huge_tree=False, remove_blank_text=True):
+    """Return an XML parser with the given options for the current thread.
+
+    Parsers are created once per thread and option set and reused
+    afterwards.
+
+    :param recover: Flag for whether to try hard to parse broken XML.
+    :type recover: bool
+    :param huge_tree: Flag for whether to disable lxml's security
+                      restrictions on tree depth and text size.
+    :type huge_tree: bool
+    :param remove_blank_text: Flag for whether to discard ignorable
+                              whitespace.
+    :type remove_blank_text: bool
+    :rtype: :class:`lxml.etree.XMLParser`
+    """
+    key = (recover, huge_tree, remove_blank_text)
+    parsers = getattr(_local, 'parsers', None)
+    if parsers is None:
+        parsers = _local.parsers = {}
+    parser = parsers.get(key)
+    if parser is None:
+        parser = parsers[key] = etree.XMLParser(
+            remove_blank_text=remove_blank_text, recover=recover,
+            resolve_entities=False, huge_tree=huge_tree)
+    return parser
+
+
+def parse_xml(content, mode=RECOVER, huge_tree=False, remove_blank_text=True):
+    """Parse an XML document using a parser of the current thread.
+
+    :param content: The XML document.
+    :type content: bytes
+    :param mode: One of :data:`RECOVER`, :data:`STRICT` and :data:`FAST`.
+    :type mode: str
+    :param huge_tree: See :func:`get_parser`.
+    :param remove_blank_text: See :func:`get_parser`.
+    :rtype: :class:`lxml.etree._Element`
+    """
+    return _parse(content, mode, huge_tree, remove_blank_text)[0]
+
+
+def _parse(content, mode, huge_tree, remove_blank_text):
+    """Parse like :func:`parse_xml` and return the tree and a flag for
+    whether the parser had to recover from errors."""
+    if mode != RECOVER:
+        try:
+            return etree.XML(content, parser=get_parser(
+                False, huge_tree, remove_blank_text)), False
+        except etree.XMLSyntaxError:
+            if mode == STRICT:
+                raise
+    parser = get_parser(True, huge_tree, remove_blank_text)
+    tree = etree.XML(content, parser=parser)
+    return tree, bool(parser.error_log.filter_from_errors())
+
+
+_TOKEN = re.compile(
+    br'<(?:[\w.-]+:)?resumptionToken\b[^>]*?(?:/>|>([^<]*)<)')
+_ERROR = re.compile(
+    br'<(?:[\w.-]+:)?error\b[^>]*?\bcode\s*=\s*["\']([^"\']*)')
+
+
+def scan_response(content, head=4096, tail=4096):
+    """Find the resumption token and the error code of a response without
+    parsing it.
+
+    Only the start of the response (where OAI errors are) and its end (where
+    the resumption token is) are searched. The result is a guess that allows
+    acting on a response before it is parsed; the parsed response is
+    authoritative.
+
+    :param content: The response body.
+    :type content: bytes
+    :param head: The number of bytes at the start searched for errors.
+    :type head: int
+    :param tail: The number of bytes at the end searched for the token.
+    :type tail: int
+    :returns: A tuple of the resumption token (``''`` for an empty token,
+              :obj:`None` if not found) and the error code (or :obj:`None`).
+    """
+    error = _ERROR.search(bytes(content[:head]))
+    if error is not None:
+        return None, error.group(1).decode('utf-8', 'replace')
+    token = None
+    matches = list(_TOKEN.finditer(bytes(content[-tail:])))
+    if matches:
+        value = matches[-1].group(1) or b''
+        token = unescape(value.decode('utf-8', 'replace').strip(),
+                         {'&quot;': '"', '&apos;': "'"})
+    return token, None
+
+
+_UNPARSED = object()
+
 
 class OAIResponse(object):
     """A response from an OAI server.
@@ -20,11 +136,26 @@ class OAIResponse(object):
     :param http_response: The original HTTP response.
     :param params: The OAI parameters for the request.
     :type params: dict
+    :param parser_mode: How to parse the response (see :func:`parse_xml`).
+    :type parser_mode: str
+    :param huge_tree: Flag for whether to allow very deep trees and very
+                      long text content.
+    :type huge_tree: bool
+    :param on_parse: Optional callable that is called with the response and
+                     the time spent on parsing it in seconds.
     """
 
-    def __init__(self, http_response, params):
+    def __init__(self, http_response, params, parser_mode=RECOVER,
+                 huge_tree=False, on_parse=None):
         self.params = params
         self.http_response = http_response
+        self.parser_mode = parser_mode
+        self.huge_tree = huge_tree
+        self.on_parse = on_parse
+        #: Whether the response is malformed and the parser had to recover
+        #: from errors (set when :attr:`xml` is accessed)
+        self.recovered = False
+        self._xml = _UNPARSED
 
     @property
     def raw(self):
@@ -33,9 +164,18 @@ class OAIResponse(object):
 
     @property
     def xml(self):
-        """The server's response as parsed XML."""
-        return etree.XML(self.http_response.content,
-                         parser=XMLParser)
+        """The server's response as parsed XML.
+
+        The response is parsed on first access only.
+        """
+        if self._xml is _UNPARSED:
+            start = monotonic()
+            self._xml, self.recovered = _parse(
+                self.http_response.content, self.parser_mode,
+                self.huge_tree, True)
+            if self.on_parse is not None:
+                self.on_parse(self, monotonic() - start)
+        return self._xml
 
     def __repr__(self):
         return '<OAIResponse %s>' % self.params.get('verb')
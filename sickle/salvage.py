@@ -0,0 +1,314 @@
+# coding: utf-8
+"""
+    sickle.salvage
+    ~~~~~~~~~~~~~~
+
+    Detection and salvage of damaged pages.
+
+    A truncated or otherwise malformed response either breaks the
+    resumption chain or silently loses items when it is parsed with
+    ``recover=True``. A :class:`PageSalvager` inspects every page of a list
+    request. Damaged pages are requested again a bounded number of times; if
+    they stay damaged, the well-formed items are salvaged one by one and the
+    identifiers of the lost items are written to a :class:`Quarantine`::
+
+        >>> quarantine = Quarantine('quarantine.jsonl')
+        >>> sickle = Sickle('http://...',
+        ...                 salvager=PageSalvager(quarantine=quarantine))
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+
+from lxml import etree
+
+from sickle.cache import CachedResponse
+from sickle.iterator import VERBS_ELEMENTS
+from sickle.response import OAIResponse, STRICT
+
+logger = logging.getLogger(__name__)
+
+#: The verbs whose pages are inspected
+LIST_VERBS = ('ListRecords', 'ListIdentifiers', 'ListSets',
+              'ListMetadataFormats')
+
+#: Position and size of an inspected page. `consistent` tells whether the
+#: cursor continues the previous page, as many servers do not maintain it.
+PageInfo = namedtuple('PageInfo', ['cursor', 'count', 'complete_list_size',
+                                   'consistent'])
+
+_ROOT = re.compile(br'<([\w.-]+:)?OAI-PMH\b[^>]*>')
+
+# OAI elements that hold XML of other formats, which may contain elements
+# named like the items (e.g. MARCXML records in the default namespace)
+_CONTAINERS = (b'metadata', b'about', b'setDescription')
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Quarantine(object):
+    """Log of damaged pages and lost items, written as JSON lines.
+
+    Each entry holds the keys ``time``, ``endpoint``, ``params`` (the OAI
+    arguments of the page), ``reason`` and ``identifier`` (:obj:`None` if
+    the item could not be identified or the entry concerns a whole page).
+
+    :param path: The path of the file the entries are appended to.
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, 'a')
+        self._lock = threading.Lock()
+        #: The number of entries written by this object
+        self.count = 0
+
+    def add(self, endpoint, params, reason, identifier=None):
+        entry = json.dumps({
+            'time': time.time(),
+            'endpoint': endpoint,
+            'params': params,
+            'reason': reason,
+            'identifier': identifier,
+        }, sort_keys=True)
+        with self._lock:
+            self._fp.write(entry + '\n')
+            self._fp.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+
+class PageSalvager(object):
+    """Inspects the pages of list requests and repairs damaged ones.
+
+    A page is considered damaged if
+
+    - it is not well-formed XML,
+    - the list element is missing,
+    - the resumption token is missing although the ``completeListSize`` of
+      the previous token says that more items follow, or
+    - the number of items on the last page does not match the
+      ``completeListSize`` and ``cursor`` of its token.
+
+    The last two checks are only made if the server maintains the
+    ``cursor`` of its tokens correctly.
+
+    :param max_retries: How often a damaged page is requested again before
+                        it is salvaged.
+    :type max_retries: int
+    :param quarantine: Optional log for damaged pages and lost items.
+    :type quarantine: :class:`Quarantine`
+    """
+
+    def __init__(self, max_retries=2, quarantine=None):
+        self.max_retries = max_retries
+        self.quarantine = quarantine
+
+    def inspect(self, sickle, verb, oai_response, previous=None):
+        """Check a page for damage.
+
+        :param sickle: The client that requested the page.
+        :type sickle: :class:`sickle.app.Sickle`
+        :param verb: The OAI verb of the request.
+        :type verb: str
+        :param oai_response: The page.
+        :type oai_response: :class:`sickle.response.OAIResponse`
+        :param previous: The information about the previous page of the
+                         same list or :obj:`None` for the first page.
+        :type previous: :class:`PageInfo`
+        :returns: A description of the damage (or :obj:`None`) and the
+                  :class:`PageInfo` of the page.
+        """
+        xml = oai_response.xml
+        if xml is None:
+            return 'not well-formed', None
+        damage = 'not well-formed' if oai_response.recovered else None
+        namespace = sickle.oai_namespace
+        if xml.find(namespace + 'error') is not None:
+            return damage, None
+        container = xml.find(namespace + verb)
+        if container is None:
+            return damage or 'missing %s element' % verb, None
+        count = len(container.findall(namespace + VERBS_ELEMENTS[verb]))
+        token = container.find(namespace + 'resumptionToken')
+        cursor = complete_list_size = None
+        if token is not None:
+            cursor = _int(token.get('cursor'))
+            complete_list_size = _int(token.get('completeListSize'))
+        if previous is None:
+            consistent = cursor == 0
+        else:
+            consistent = cursor is not None and previous.consistent and \
+                cursor == previous.cursor + previous.count
+        info = PageInfo(cursor, count, complete_list_size, consistent)
+        if damage:
+            return damage, info
+        if token is None and previous is not None and \
+                previous.consistent and \
+                previous.complete_list_size is not None and \
+                previous.cursor + previous.count + count < \
+                previous.complete_list_size:
+            return 'missing resumption token', info
+        if token is not None and not (token.text or '').strip() and \
+                consistent and complete_list_size is not None and \
+                cursor + count != complete_list_size:
+            return ('%d items on the last page, expected %d' % (
+                count, complete_list_size - cursor)), info
+        return None, info
+
+    def process(self, sickle, params, oai_response, previous=None):
+        """Inspect a page and repair it if it is damaged.
+
+        :param sickle: The client that requested the page.
+        :type sickle: :class:`sickle.app.Sickle`
+        :param params: The OAI arguments of the page.
+        :type params: dict
+        :param oai_response: The page.
+        :type oai_response: :class:`sickle.response.OAIResponse`
+        :param previous: See :meth:`inspect`.
+        :returns: The (possibly repaired) page and its :class:`PageInfo`.
+        """
+        verb = params.get('verb')
+        if verb not in LIST_VERBS:
+            return oai_response, None
+        damage, info = self.inspect(sickle, verb, oai_response, previous)
+        retries = 0
+        while damage is not None and retries < self.max_retries:
+            retries += 1
+            logger.warning('Damaged page (%s), requesting it again (%d/%d).'
+                           % (damage, retries, self.max_retries))
+            oai_response = sickle.harvest(**params)
+            damage, info = self.inspect(sickle, verb, oai_response, previous)
+        if damage is None:
+            return oai_response, info
+        logger.warning('Damaged page (%s), salvaging its items.' % damage)
+        self._quarantine(sickle, params, damage)
+        salvaged = self.salvage(sickle, params, oai_response)
+        return salvaged, self.inspect(sickle, verb, salvaged, previous)[1]
+
+    def salvage(self, sickle, params, oai_response):
+        """Rebuild a page from its well-formed items.
+
+        The raw page is split at the start tags of the items, ignoring
+        the contents of ``metadata``, ``about`` and ``setDescription``
+        elements. Each item is parsed on its own; items that are not
+        well-formed are quarantined.
+        The resumption token is kept if it can be found.
+
+        :rtype: :class:`sickle.response.OAIResponse`
+        """
+        verb = params.get('verb')
+        content = bytes(oai_response.http_response.content)
+        root = _ROOT.search(content)
+        if root is not None:
+            root_tag, prefix = root.group(0), root.group(1) or b''
+        else:
+            root_tag = ('<OAI-PMH xmlns="%s">' % sickle.oai_namespace.strip(
+                '{}')).encode('utf-8')
+            prefix = b''
+        root_end = b'</' + prefix + b'OAI-PMH>'
+        # The items are parsed inside copies of the root and verb start
+        # tags, which may declare the namespaces of their metadata
+        verb_name = prefix + verb.encode('utf-8')
+        container = re.search(b'<' + re.escape(verb_name) + br'\b[^>]*>',
+                              content)
+        if container is not None and not container.group(0).endswith(b'/>'):
+            verb_tag = container.group(0)
+        else:
+            verb_tag = b'<' + verb_name + b'>'
+        verb_end = b'</' + verb_name + b'>'
+        element = VERBS_ELEMENTS[verb].encode('utf-8')
+        end_tag = b'</' + prefix + element + b'>'
+        starts = self._item_starts(content, prefix, element)
+        items = []
+        for number, start in enumerate(starts):
+            end = starts[number + 1] if number + 1 < len(starts) \
+                else len(content)
+            segment = content[start:end]
+            close = segment.rfind(end_tag)
+            if close != -1:
+                item = segment[:close + len(end_tag)]
+            elif segment.rstrip().endswith(b'/>'):
+                item = segment.rstrip()
+            else:
+                item = None
+            if item is not None:
+                try:
+                    etree.XML(root_tag + verb_tag + item + verb_end +
+                              root_end)
+                    items.append(item)
+                    continue
+                except etree.XMLSyntaxError:
+                    pass
+            self._quarantine(sickle, params, 'malformed item',
+                             self._identifier(segment, prefix))
+        token = re.search(
+            b'<' + re.escape(prefix) + br'resumptionToken\b[^>]*?'
+            br'(?:/>|>[^<]*</' + re.escape(prefix) + br'resumptionToken>)',
+            content[-4096:])
+        body = root_tag + verb_tag + b''.join(items) + \
+            (token.group(0) if token else b'') + verb_end + root_end
+        salvaged = OAIResponse(CachedResponse(body, 'utf-8'), params,
+                               parser_mode=STRICT, huge_tree=sickle.huge_tree)
+        try:
+            salvaged.xml
+        except etree.XMLSyntaxError:
+            # The root start tag itself is damaged
+            salvaged = OAIResponse(CachedResponse(
+                b'<OAI-PMH xmlns="' +
+                sickle.oai_namespace.strip('{}').encode('utf-8') + b'"><' +
+                verb.encode('utf-8') + b'/></OAI-PMH>', 'utf-8'), params)
+        logger.warning('Salvaged %d of %d items.' % (len(items), len(starts)))
+        return salvaged
+
+    @staticmethod
+    def _item_starts(content, prefix, element):
+        """Return the offsets of the start tags of the items, skipping the
+        contents of metadata containers."""
+        tags = re.compile(b'<(/?)' + re.escape(prefix) + b'(' + b'|'.join(
+            re.escape(name) for name in (element,) + _CONTAINERS) +
+            br')[\s/>]')
+        starts = []
+        container = None
+        for match in tags.finditer(content):
+            closing, name = match.group(1), match.group(2)
+            if container is not None:
+                if closing and name == container:
+                    container = None
+            elif closing:
+                continue
+            elif name == element:
+                starts.append(match.start())
+            else:
+                tag_end = content.find(b'>', match.start())
+                if tag_end != -1 and content[tag_end - 1:tag_end] != b'/':
+                    container = name
+        return starts
+
+    @staticmethod
+    def _identifier(segment, prefix):
+        match = re.search(b'<' + re.escape(prefix) +
+                          br'identifier>\s*([^<]+?)\s*<', segment)
+        if match is None:
+            return None
+        return match.group(1).decode('utf-8', 'replace')
+
+    def _quarantine(self, sickle, params, reason, identifier=None):
+        if identifier is not None:
+            logger.warning('Quarantined %s (%s).' % (identifier, reason))
+        if self.quarantine is not None:
+            self.quarantine.add(sickle.endpoint, params, reason, identifier)
@@ -0,0 +1,359 @@
+# coding: utf-8
+"""
+    sickle.serialize
+    ~~~~~~~~~~~~~~~~
+
+    Compact binary encoding of OAI items.
+
+    Pickling :class:`sickle.models.Record` objects means pickling their lxml
+    elements, which is slow or fails altogether. :func:`encode` writes the
+    fields of headers, records, sets and metadata formats in a small
+    versioned envelope followed by a `MessagePack <https://msgpack.org>`_
+    body, and :func:`decode` turns the bytes back into model objects without
+    parsing any XML::
+
+        >>> data = encode(record, raw=True)
+        >>> record = decode(data)
+        >>> record.metadata['title']
+        ['A title']
+
+    The XML of a decoded item is parsed on first access of its ``xml``
+    attribute if the raw XML has been encoded, otherwise it is
+    :obj:`None`. The ``msgpack`` package is used if it is installed; the
+    pure Python fallback reads and writes the same format.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import struct
+
+from lxml import etree
+
+from sickle._compat import PY3, text_type
+from sickle.models import Header, Record, Set, MetadataFormat
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+OAI_NAMESPACE = '{http://www.openarchives.org/OAI/2.0/}'
+
+#: Marks the start of an encoded item
+MAGIC = b'SKL'
+#: The version of the encoding written by :func:`encode`
+VERSION = 1
+
+HEADER = 1
+RECORD = 2
+SET = 3
+METADATA_FORMAT = 4
+
+
+class _Decoded(object):
+    """Mixin for decoded items that parses the raw XML on demand.
+
+    :meth:`OAIItem.__init__ <sickle.models.OAIItem>` is not called for
+    decoded items, so the attributes it sets are provided here. Items
+    encoded without their raw XML are rendered by :func:`repr` when
+    converted to a string.
+    """
+
+    _xml = None
+    _raw = None
+    _strip_ns = True
+    _oai_namespace = OAI_NAMESPACE
+
+    @property
+    def xml(self):
+        if self._xml is None and self._raw is not None:
+            self._xml = etree.XML(self._raw)
+        return self._xml
+
+    @xml.setter
+    def xml(self, value):
+        self._xml = value
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            return None
+        return self._raw.decode('utf-8')
+
+    def __unicode__(self):
+        if self._raw is None:
+            return text_type(repr(self))
+        return self.raw
+
+
+class DecodedHeader(_Decoded, Header):
+    """A :class:`sickle.models.Header` created by :func:`decode`."""
+
+    def __init__(self, identifier, datestamp, setSpecs, deleted, raw=None):
+        self.identifier = identifier
+        self.datestamp = datestamp
+        self.setSpecs = setSpecs
+        self.deleted = deleted
+        self._raw = raw
+
+
+class DecodedRecord(_Decoded, Record):
+    """A :class:`sickle.models.Record` created by :func:`decode`."""
+
+    def __init__(self, header, metadata, raw=None):
+        self.header = header
+        self.deleted = header.deleted
+        if metadata is not None:
+            self.metadata = metadata
+        self._raw = raw
+
+
+class DecodedSet(_Decoded, Set):
+    """A :class:`sickle.models.Set` created by :func:`decode`."""
+
+    def __init__(self, fields, raw=None):
+        self._set_dict = fields
+        for k, v in fields.items():
+            setattr(self, k.replace('-', '_'), v[0])
+        self._raw = raw
+
+
+class DecodedMetadataFormat(_Decoded, MetadataFormat):
+    """A :class:`sickle.models.MetadataFormat` created by :func:`decode`."""
+
+    def __init__(self, fields, raw=None):
+        self._mdf_dict = fields
+        for k, v in fields.items():
+            setattr(self, k.replace('-', '_'), v[0])
+        self._raw = raw
+
+
+def _raw_bytes(item):
+    if isinstance(item, _Decoded):
+        raw = item._raw
+    else:
+        raw = etree.tostring(item.xml, encoding='utf-8',
+                             xml_declaration=False, with_tail=False)
+    # bytearray keeps the raw XML a binary value on Python 2
+    return bytearray(raw) if raw is not None else None
+
+
+def _fields(item, raw):
+    """Return the kind of `item` and the list of its fields."""
+    if isinstance(item, Record):
+        header = item.header
+        fields = [RECORD, header.identifier, header.datestamp,
+                  header.setSpecs, header.deleted,
+                  getattr(item, 'metadata', None)]
+    elif isinstance(item, Header):
+        fields = [HEADER, item.identifier, item.datestamp, item.setSpecs,
+                  item.deleted]
+    elif isinstance(item, Set):
+        fields = [SET, item._set_dict]
+    elif isinstance(item, MetadataFormat):
+        fields = [METADATA_FORMAT, item._mdf_dict]
+    else:
+        raise TypeError('Cannot encode %r' % item)
+    fields.append(_raw_bytes(item) if raw else None)
+    return fields
+
+
+def _item(fields):
+    kind = fields[0]
+    if kind == RECORD:
+        _, identifier, datestamp, set_specs, deleted, metadata, raw = fields
+        return DecodedRecord(
+            DecodedHeader(identifier, datestamp, set_specs, deleted),
+            metadata, raw)
+    if kind == HEADER:
+        return DecodedHeader(*fields[1:])
+    if kind == SET:
+        return DecodedSet(*fields[1:])
+    if kind == METADATA_FORMAT:
+        return DecodedMetadataFormat(*fields[1:])
+    raise ValueError('Unknown item kind %r' % kind)
+
+
+def encode(item, raw=False):
+    """Encode a header, record, set or metadata format.
+
+    Records are encoded with their header fields and metadata
+    dictionary, headers with identifier, datestamp, setSpecs and deletion
+    flag, sets and metadata formats with their field dictionary.
+
+    :param item: The item to encode.
+    :param raw: Flag for whether to include the raw XML.
+    :type raw: bool
+    :rtype: bytes
+    """
+    fields = _fields(item, raw)
+    if msgpack is not None:
+        body = msgpack.packb(fields, use_bin_type=True)
+    else:
+        parts = []
+        _pack(fields, parts)
+        body = b''.join(parts)
+    return MAGIC + struct.pack('B', VERSION) + body
+
+
+def decode(data):
+    """Decode an item written by :func:`encode`.
+
+    :param data: The encoded item.
+    :type data: bytes
+    :returns: An instance of :class:`DecodedHeader`,
+              :class:`DecodedRecord`, :class:`DecodedSet` or
+              :class:`DecodedMetadataFormat`.
+    :raises ValueError: If `data` is not an encoded item or has been
+                        written by an unknown version.
+    """
+    data = bytes(data)
+    if data[:3] != MAGIC:
+        raise ValueError('Not an encoded OAI item')
+    version = struct.unpack('B', data[3:4])[0]
+    if version != VERSION:
+        raise ValueError('Unsupported encoding version %d' % version)
+    if msgpack is not None:
+        fields = msgpack.unpackb(data[4:], raw=False)
+    else:
+        fields, _ = _unpack(data, 4)
+    return _item(fields)
+
+
+# A MessagePack subset: nil, booleans, integers, floats, strings, binary
+# data, arrays and maps.
+
+def _pack(value, parts):
+    append = parts.append
+    if value is None:
+        append(b'\xc0')
+    elif value is True:
+        append(b'\xc3')
+    elif value is False:
+        append(b'\xc2')
+    elif isinstance(value, text_type) or not PY3 and isinstance(value, str):
+        if isinstance(value, text_type):
+            value = value.encode('utf-8')
+        length = len(value)
+        if length < 32:
+            append(struct.pack('B', 0xa0 | length))
+        elif length < 0x100:
+            append(struct.pack('>BB', 0xd9, length))
+        elif length < 0x10000:
+            append(struct.pack('>BH', 0xda, length))
+        else:
+            append(struct.pack('>BI', 0xdb, length))
+        append(value)
+    elif isinstance(value, (bytes, bytearray)):
+        length = len(value)
+        if length < 0x100:
+            append(struct.pack('>BB', 0xc4, length))
+        elif length < 0x10000:
+            append(struct.pack('>BH', 0xc5, length))
+        else:
+            append(struct.pack('>BI', 0xc6, length))
+        append(bytes(value))
+    elif isinstance(value, (list, tuple)):
+        length = len(value)
+        if length < 16:
+            append(struct.pack('B', 0x90 | length))
+        elif length < 0x10000:
+            append(struct.pack('>BH', 0xdc, length))
+        else:
+            append(struct.pack('>BI', 0xdd, length))
+        for element in value:
+            _pack(element, parts)
+    elif isinstance(value, dict):
+        length = len(value)
+        if length < 16:
+            append(struct.pack('B', 0x80 | length))
+        elif length < 0x10000:
+            append(struct.pack('>BH', 0xde, length))
+        else:
+            append(struct.pack('>BI', 0xdf, length))
+        for key, element in value.items():
+            _pack(key, parts)
+            _pack(element, parts)
+    elif isinstance(value, float):
+        append(struct.pack('>Bd', 0xcb, value))
+    elif isinstance(value, int) or not PY3 and isinstance(value, long):  # noqa
+        if 0 <= value < 0x80:
+            append(struct.pack('B', value))
+        elif -32 <= value < 0:
+            append(struct.pack('b', value))
+        elif 0 <= value < 0x100:
+            append(struct.pack('>BB', 0xcc, value))
+        elif 0 <= value < 0x10000:
+            append(struct.pack('>BH', 0xcd, value))
+        elif 0 <= value < 0x100000000:
+            append(struct.pack('>BI', 0xce, value))
+        elif 0 <= value < 0x10000000000000000:
+            append(struct.pack('>BQ', 0xcf, value))
+        else:
+            append(struct.pack('>Bq', 0xd3, value))
+    else:
+        raise TypeError('Cannot encode %r' % value)
+
+
+# Fixed-size formats: code -> (struct format, size)
+_FIXED = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+# Length-prefixed formats: code -> (struct format of the length, size, kind)
+_SIZED = {
+    0xc4: ('>B', 1, 'bin'), 0xc5: ('>H', 2, 'bin'), 0xc6: ('>I', 4, 'bin'),
+    0xd9: ('>B', 1, 'str'), 0xda: ('>H', 2, 'str'), 0xdb: ('>I', 4, 'str'),
+    0xdc: ('>H', 2, 'array'), 0xdd: ('>I', 4, 'array'),
+    0xde: ('>H', 2, 'map'), 0xdf: ('>I', 4, 'map'),
+}
+
+
+def _unpack(data, offset):
+    """Decode the value at `offset`, returning it and the next offset."""
+    code = bytearray(data[offset:offset + 1])
+    if not code:
+        raise ValueError('Truncated data')
+    code = code[0]
+    offset += 1
+    if code < 0x80:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if 0xa0 <= code < 0xc0:
+        kind, length = 'str', code & 0x1f
+    elif 0x90 <= code < 0xa0:
+        kind, length = 'array', code & 0x0f
+    elif 0x80 <= code < 0x90:
+        kind, length = 'map', code & 0x0f
+    elif code == 0xc0:
+        return None, offset
+    elif code == 0xc2:
+        return False, offset
+    elif code == 0xc3:
+        return True, offset
+    elif code in _FIXED:
+        fmt, size = _FIXED[code]
+        return struct.unpack(fmt, data[offset:offset + size])[0], \
+            offset + size
+    elif code in _SIZED:
+        fmt, size, kind = _SIZED[code]
+        length = struct.unpack(fmt, data[offset:offset + size])[0]
+        offset += size
+    else:
+        raise ValueError('Unsupported type code 0x%02x' % code)
+    if kind == 'str':
+        return data[offset:offset + length].decode('utf-8'), offset + length
+    if kind == 'bin':
+        return data[offset:offset + length], offset + length
+    if kind == 'array':
+        values = []
+        for _ in range(length):
+            value, offset = _unpack(data, offset)
+            values.append(value)
+        return values, offset
+    values = {}
+    for _ in range(length):
+        key, offset = _unpack(data, offset)
+        values[key], offset = _unpack(data, offset)
+    return values, offset
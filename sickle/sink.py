@@ -0,0 +1,322 @@
+# coding: utf-8
+"""
+    sickle.sink
+    ~~~~~~~~~~~
+
+    Writing of harvested items to a SQLite database.
+
+    A :class:`SQLiteSink` consumes any iterator over records or headers and
+    writes them in large transactions. Each item is upserted on its OAI
+    identifier; deleted records replace the stored row with a tombstone.
+    The raw XML is stored compressed, selected metadata fields are stored as
+    columns::
+
+        >>> sink = SQLiteSink('records.db', fields=['title', 'date'])
+        >>> stats = sink.consume(sickle.ListRecords(metadataPrefix='oai_dc'))
+        >>> stats.rows_per_second
+        5321.4
+
+    The database serves as the local index for the next incremental run,
+    which starts at the latest stored datestamp::
+
+        >>> stats = sink.consume(sickle.ListRecords(
+        ...     metadataPrefix='oai_dc',
+        ...     **{'from': sink.latest_datestamp()}))
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import json
+import logging
+import re
+import sqlite3
+import zlib
+
+from sickle._compat import monotonic, string_types
+
+logger = logging.getLogger(__name__)
+
+#: The columns every table has, followed by one column per metadata field
+COLUMNS = ('identifier', 'datestamp', 'deleted', 'setSpecs', 'raw')
+
+# ON CONFLICT ... DO UPDATE has been added in SQLite 3.24
+_NATIVE_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+
+class SinkStats(object):
+    """Counts of a :meth:`SQLiteSink.consume` run.
+
+    :param rows: The number of rows written.
+    :param deleted: The number of deletions among them.
+    :param skipped: The number of items skipped for lack of an identifier.
+    :param seconds: The duration of the run.
+    """
+
+    def __init__(self, rows=0, deleted=0, skipped=0, seconds=0.0):
+        self.rows = rows
+        self.deleted = deleted
+        self.skipped = skipped
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        if not self.seconds:
+            return 0.0
+        return self.rows / self.seconds
+
+    def __repr__(self):
+        return '<SinkStats rows=%d deleted=%d rows/s=%.1f>' % (
+            self.rows, self.deleted, self.rows_per_second)
+
+
+def _column_name(field):
+    return 'md_' + re.sub(r'\W', '_', field)
+
+
+def _field_value(value):
+    """Return the column value of a metadata field: lists of strings are
+    joined with newlines, strings are kept and other values (e.g. the
+    dictionaries of :mod:`sickle.formats` mappers) are JSON-encoded."""
+    if value is None or isinstance(value, string_types):
+        return value or None
+    if isinstance(value, (list, tuple)) and all(
+            v is None or isinstance(v, string_types) for v in value):
+        return '\n'.join(v for v in value if v is not None) or None
+    return json.dumps(value, sort_keys=True)
+
+
+class SQLiteSink(object):
+    """Stores records and headers in a SQLite table keyed by identifier.
+
+    Rows are written with one prepared upsert statement per batch of
+    `batch_size` items and committed every `transaction_size` items and on
+    :meth:`flush`. Upserts only replace the columns the item provides:
+    headers (from ListIdentifiers) keep the stored raw XML and metadata of
+    a record, and metadata columns that are not among `fields` are kept as
+    well. Deletions clear the raw XML and all metadata columns. SQLite
+    versions before 3.24 have no upserts; there each row is written with
+    an UPDATE, followed by an INSERT if no row has been updated.
+
+    :param path: The path of the database file.
+    :type path: str
+    :param fields: The metadata fields stored as columns (named ``md_``
+                   followed by the field name). Multiple values are joined
+                   with newlines, values that are neither strings nor lists
+                   of strings are stored as JSON. Columns for new fields are added to an
+                   existing table. Fields must map to distinct column
+                   names.
+    :type fields: list
+    :param table: The name of the table.
+    :type table: str
+    :param batch_size: The number of rows written per statement.
+    :type batch_size: int
+    :param transaction_size: The number of rows written per transaction.
+    :type transaction_size: int
+    :param keep_tombstones: Flag for whether deleted records are kept as
+                            rows with ``deleted = 1``. Otherwise their rows
+                            are removed.
+    :type keep_tombstones: bool
+    :param compress_level: The zlib level used for the raw XML.
+    :type compress_level: int
+    """
+
+    def __init__(self, path, fields=(), table='records', batch_size=1000,
+                 transaction_size=50000, keep_tombstones=True,
+                 compress_level=6):
+        if not re.match(r'^\w+$', table):
+            raise ValueError('Invalid table name: %r' % table)
+        names = {}
+        for field in fields:
+            name = names.setdefault(_column_name(field), field)
+            if name != field:
+                raise ValueError('Fields %r and %r map to the same column.'
+                                 % (name, field))
+        self.path = path
+        self.fields = list(fields)
+        self.table = table
+        self.batch_size = batch_size
+        self.transaction_size = transaction_size
+        self.keep_tombstones = keep_tombstones
+        self.compress_level = compress_level
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS %s ('
+            'identifier TEXT PRIMARY KEY, datestamp TEXT, '
+            'deleted INTEGER NOT NULL, setSpecs TEXT, raw BLOB)' % table)
+        existing = [row[1] for row in self.connection.execute(
+            'PRAGMA table_info(%s)' % table)]
+        self._columns = list(COLUMNS) + [_column_name(f) for f in self.fields]
+        for column in self._columns:
+            if column not in existing:
+                self.connection.execute(
+                    'ALTER TABLE %s ADD COLUMN %s TEXT' % (table, column))
+                existing.append(column)
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS %s_datestamp ON %s (datestamp)' % (
+                table, table))
+        self.connection.commit()
+        self._upsert = self._upsert_statement(self._columns, existing)
+        self._upsert_header = self._upsert_statement(COLUMNS[:4], existing)
+        self._delete = 'DELETE FROM %s WHERE identifier = ?' % table
+        self._batch = []
+        self._statement = self._upsert
+        self._uncommitted = 0
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM %s' % self.table).fetchone()[0]
+
+    def __contains__(self, identifier):
+        return self.get(identifier) is not None
+
+    def _upsert_statement(self, columns, existing):
+        """Return an upsert of `columns` that keeps the other columns of
+        an existing row unless the new row is a deletion.
+
+        Without native upserts, an ``(update, insert, cleared)`` tuple is
+        returned instead, `cleared` being the number of columns the update
+        clears for deletions (see :meth:`_execute`).
+        """
+        cleared = [c for c in existing if c not in columns and
+                   (c == 'raw' or c.startswith('md_'))]
+        insert = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            self.table, ', '.join(columns), ', '.join('?' for _ in columns))
+        if not _NATIVE_UPSERT:
+            updates = ['%s = ?' % c for c in columns[1:]]
+            updates.extend('%s = CASE WHEN ? THEN NULL ELSE %s END' % (c, c)
+                           for c in cleared)
+            update = 'UPDATE %s SET %s WHERE identifier = ?' % (
+                self.table, ', '.join(updates))
+            return update, insert, len(cleared)
+        updates = ['%s = excluded.%s' % (c, c) for c in columns[1:]]
+        updates.extend(
+            '%s = CASE WHEN excluded.deleted THEN NULL ELSE %s END' % (c, c)
+            for c in cleared)
+        return insert + ' ON CONFLICT (identifier) DO UPDATE SET %s' % (
+            ', '.join(updates))
+
+    def _execute(self, statement, batch):
+        if not isinstance(statement, tuple):
+            self.connection.executemany(statement, batch)
+            return
+        update, insert, cleared = statement
+        execute = self.connection.execute
+        for row in batch:
+            # The deletion flag selects the columns to clear
+            if not execute(update, row[1:] + (row[2],) * cleared +
+                           (row[0],)).rowcount:
+                execute(insert, row)
+
+    def _header_row(self, header):
+        set_specs = ' '.join(header.setSpecs) if header.setSpecs else None
+        return (header.identifier, header.datestamp,
+                1 if header.deleted else 0, set_specs)
+
+    def _row(self, item):
+        header = item.header
+        if header.deleted:
+            return self._header_row(header) + (None,) * (
+                len(self.fields) + 1)
+        raw = sqlite3.Binary(zlib.compress(
+            item.raw.encode('utf-8'), self.compress_level))
+        metadata = item.metadata
+        values = tuple(_field_value(metadata.get(field))
+                       for field in self.fields)
+        return self._header_row(header) + (raw,) + values
+
+    def write(self, item):
+        """Add a record or header to the current batch.
+
+        :param item: The item to write.
+        :type item: :class:`sickle.models.Record` or
+                    :class:`sickle.models.Header`
+        :returns: :obj:`True` if the item is a deletion, :obj:`None` if it
+                  has been skipped because it has no identifier.
+        """
+        header = getattr(item, 'header', item)
+        if header.identifier is None:
+            logger.warning('Skipping %r without identifier.' % item)
+            return None
+        if header.deleted and not self.keep_tombstones:
+            statement, row = self._delete, (header.identifier,)
+        elif item is header:
+            statement, row = self._upsert_header, self._header_row(header)
+        else:
+            statement, row = self._upsert, self._row(item)
+        if statement is not self._statement:
+            # Keep the order of upserts and removals of the same identifier
+            self._write_batch()
+            self._statement = statement
+        self._batch.append(row)
+        if len(self._batch) >= self.batch_size:
+            self._write_batch()
+        return header.deleted
+
+    def _write_batch(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        self._execute(self._statement, batch)
+        self._uncommitted += len(batch)
+        if self._uncommitted >= self.transaction_size:
+            self.connection.commit()
+            self._uncommitted = 0
+
+    def flush(self):
+        """Write the current batch and commit the transaction."""
+        self._write_batch()
+        self.connection.commit()
+        self._uncommitted = 0
+
+    def consume(self, items):
+        """Write all items of an iterator.
+
+        :param items: An iterable of records or headers, e.g. the result of
+                      :meth:`sickle.app.Sickle.ListRecords`.
+        :rtype: :class:`SinkStats`
+        """
+        stats = SinkStats()
+        start = monotonic()
+        try:
+            for item in items:
+                deleted = self.write(item)
+                if deleted is None:
+                    stats.skipped += 1
+                    continue
+                stats.rows += 1
+                if deleted:
+                    stats.deleted += 1
+        finally:
+            self.flush()
+            stats.seconds = monotonic() - start
+        return stats
+
+    def get(self, identifier):
+        """Return ``(datestamp, deleted)`` for `identifier` or :obj:`None`."""
+        row = self.connection.execute(
+            'SELECT datestamp, deleted FROM %s WHERE identifier = ?' %
+            self.table, (identifier,)).fetchone()
+        if row is None:
+            return None
+        return row[0], bool(row[1])
+
+    def raw(self, identifier):
+        """Return the stored XML of a record as unicode or :obj:`None`."""
+        row = self.connection.execute(
+            'SELECT raw FROM %s WHERE identifier = ?' % self.table,
+            (identifier,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return zlib.decompress(bytes(row[0])).decode('utf-8')
+
+    def latest_datestamp(self):
+        """Return the latest stored datestamp, which is the `from` argument
+        for the next incremental harvest, or :obj:`None` if the table is
+        empty."""
+        return self.connection.execute(
+            'SELECT MAX(datestamp) FROM %s' % self.table).fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,243 @@
+# coding: utf-8
+"""
+    sickle.store
+    ~~~~~~~~~~~~
+
+    An append-only on-disk store for raw OAI responses.
+
+    Jobs that process a harvest several times can store the pages once and
+    replay them instead of harvesting again or keeping the responses in
+    memory. The pages are appended to a segment file; an index file holds
+    the offset and length of each page. Stored pages are read through a
+    memory map and handed to the parser as :class:`memoryview` slices
+    without copying::
+
+        >>> store = PageStore('/var/cache/sickle/harvest')
+        >>> for response in sickle.ListRecords(metadataPrefix='oai_dc'):
+        ...     store.add(response)  # with iterator=OAIResponseIterator
+        >>> for record in store.replay(sickle, 'ListRecords'):
+        ...     validate(record)
+        >>> for record in store.replay(sickle, 'ListRecords'):
+        ...     index(record)
+        >>> store.close()
+
+    Replaying uses the iterator and class mapping of the given
+    :class:`sickle.app.Sickle`, so it yields the same objects as the
+    original harvest.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import copy
+import logging
+import mmap
+import os
+import struct
+
+from lxml import etree
+
+from sickle.cache import CachedResponse
+from sickle.iterator import OAIItemIterator
+from sickle.response import OAIResponse
+
+logger = logging.getLogger(__name__)
+
+# Offset and length of a page in the segment file
+_INDEX_ENTRY = struct.Struct('<QQ')
+
+# Ends a replay whose last stored page has a resumption token
+_LAST_PAGE = '<OAI-PMH xmlns="%s"><%s/></OAI-PMH>'
+
+_buffer_parsing = None
+
+
+def _accepts_buffers():
+    """Check whether lxml can parse from buffers (lxml 5 and later)."""
+    global _buffer_parsing
+    if _buffer_parsing is None:
+        try:
+            etree.XML(memoryview(b'<a/>'))
+            _buffer_parsing = True
+        except (TypeError, ValueError):
+            _buffer_parsing = False
+    return _buffer_parsing
+
+
+class StoredPage(CachedResponse):
+    """Mimics the HTTP response object for pages read from a
+    :class:`PageStore`.
+
+    :param content: The page as slice of the store's memory map.
+    :type content: :class:`memoryview`
+    """
+
+    @property
+    def text(self):
+        """The page as unicode."""
+        return bytes(self.content).decode(self.encoding or 'utf-8',
+                                          'replace')
+
+
+class PageStore(object):
+    """Append-only store of raw response bodies.
+
+    The pages are kept in the file `path`, their offsets and lengths in
+    ``path + '.idx'``. Both files are created if they do not exist.
+
+    :param path: The path of the segment file.
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._segment = open(path, 'ab')
+        self._index_file = open(self.index_path, 'ab')
+        self._index = []
+        with open(self.index_path, 'rb') as fp:
+            data = fp.read()
+        # Ignore a partially written entry at the end
+        usable = len(data) - len(data) % _INDEX_ENTRY.size
+        for position in range(0, usable, _INDEX_ENTRY.size):
+            self._index.append(_INDEX_ENTRY.unpack_from(data, position))
+        self._size = self._index[-1][0] + self._index[-1][1] \
+            if self._index else 0
+        self._index_file.truncate(usable)
+        self._map = None
+        self._view = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def append(self, content):
+        """Append a page.
+
+        :param content: The raw response body.
+        :type content: bytes
+        :returns: The number of the page.
+        :rtype: int
+        """
+        # Continue after the last indexed page, discarding the remains of
+        # an interrupted write
+        self._segment.truncate(self._size)
+        self._segment.write(content)
+        self._segment.flush()
+        entry = (self._size, len(content))
+        # The index entry is written after the data so that it never points
+        # to incomplete pages
+        self._index_file.write(_INDEX_ENTRY.pack(*entry))
+        self._index_file.flush()
+        self._index.append(entry)
+        self._size += len(content)
+        return len(self._index) - 1
+
+    def add(self, oai_response):
+        """Append the body of an :class:`sickle.response.OAIResponse`."""
+        return self.append(oai_response.http_response.content)
+
+    def _mapped(self):
+        if self._map is None or len(self._map) < self._size:
+            # Views handed out earlier keep the old map alive
+            with open(self.path, 'rb') as fp:
+                self._map = mmap.mmap(fp.fileno(), self._size,
+                                      access=mmap.ACCESS_READ)
+            self._view = memoryview(self._map)
+        return self._view
+
+    def page(self, number):
+        """Return the page `number` without copying it.
+
+        :param number: The number of the page.
+        :type number: int
+        :rtype: :class:`memoryview`
+        """
+        offset, length = self._index[number]
+        if not length:
+            return memoryview(b'')
+        return self._mapped()[offset:offset + length]
+
+    def pages(self, start=0):
+        """Iterate over the stored pages, beginning with page `start`."""
+        for number in range(start, len(self._index)):
+            yield self.page(number)
+
+    def response(self, number, params=None, sickle=None):
+        """Return page `number` as :class:`sickle.response.OAIResponse`.
+
+        :param params: The OAI arguments of the response.
+        :type params: dict
+        :param sickle: The client whose parser settings are used.
+        :type sickle: :class:`sickle.app.Sickle`
+        """
+        content = self.page(number)
+        if not _accepts_buffers():
+            content = content.tobytes()
+        kwargs = {}
+        if sickle is not None:
+            kwargs = {'parser_mode': sickle.parser_mode,
+                      'huge_tree': sickle.huge_tree}
+        return OAIResponse(StoredPage(content), params or {}, **kwargs)
+
+    def replay(self, sickle, verb='ListRecords', start=0,
+               ignore_deleted=False, item_filter=None):
+        """Iterate over the items of the stored pages as if they were
+        harvested again.
+
+        The pages are read in order beginning with page `start`, following
+        the resumption tokens of the pages. Iteration ends after the first
+        page without a resumption token or, with a warning, after the last
+        stored page if the harvest has been interrupted.
+
+        :param sickle: The client whose iterator, class mapping and parser
+                       settings are used.
+        :type sickle: :class:`sickle.app.Sickle`
+        :param verb: The OAI verb the pages were harvested with.
+        :type verb: str
+        :param start: The number of the first page.
+        :type start: int
+        :param ignore_deleted: See :meth:`sickle.app.Sickle.ListRecords`.
+        :param item_filter: See :meth:`sickle.app.Sickle.ListRecords`.
+        """
+        replaying = copy.copy(sickle)
+        positions = iter(range(start, len(self._index)))
+
+        def harvest(**kwargs):
+            try:
+                number = next(positions)
+            except StopIteration:
+                logger.warning(
+                    "Page %d (resumption token %s) is not stored in %s, "
+                    "ending the replay." % (
+                        max(start, len(self._index)),
+                        kwargs.get('resumptionToken'), self.path))
+                content = _LAST_PAGE % (sickle.oai_namespace[1:-1], verb)
+                return OAIResponse(StoredPage(content.encode('utf-8')),
+                                   kwargs)
+            return self.response(number, kwargs, sickle)
+
+        replaying.harvest = harvest
+        # The tokens of stored pages are not used for requests and the pages
+        # have to be read in order
+        replaying.token_expiry_margin = None
+        replaying.prefetch = False
+        params = {'verb': verb}
+        if issubclass(sickle.iterator, OAIItemIterator):
+            return sickle.iterator(replaying, params,
+                                   ignore_deleted=ignore_deleted,
+                                   item_filter=item_filter)
+        return sickle.iterator(replaying, params)
+
+    def close(self):
+        self._segment.close()
+        self._index_file.close()
+        self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Pages are still referenced; the map is closed when they
+                # are released
+                pass
+            self._map = None
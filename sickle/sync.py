@@ -0,0 +1,235 @@
+# coding: utf-8
+"""
+    sickle.sync
+    ~~~~~~~~~~~
+
+    Synchronization of a local copy by comparing identifier lists.
+
+    Instead of harvesting all records again, the headers returned by
+    ListIdentifiers are compared against a local index. Only records that
+    are new or have changed since the last run are downloaded afterwards.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import sqlite3
+
+from sickle import oaiexceptions
+from sickle.utils import repository_granularity, truncate_datestamp
+
+#: Record appeared since the last snapshot.
+NEW = 'new'
+#: Record has a different datestamp than in the last snapshot.
+CHANGED = 'changed'
+#: Record has been flagged as deleted since the last snapshot.
+DELETED = 'deleted'
+#: Record is not listed by the repository anymore.
+REMOVED = 'removed'
+
+
+class IndexDiff(object):
+    """The differences between the listed headers and the last snapshot.
+
+    Each attribute is a list of identifiers.
+    """
+
+    def __init__(self, new, changed, deleted, removed):
+        self.new = new
+        self.changed = changed
+        self.deleted = deleted
+        self.removed = removed
+
+    def __repr__(self):
+        return '<IndexDiff new=%d changed=%d deleted=%d removed=%d>' % (
+            len(self.new), len(self.changed), len(self.deleted),
+            len(self.removed))
+
+
+class IdentifierIndex(object):
+    """A compact on-disk index mapping OAI identifiers to their datestamp and
+    deletion status, backed by SQLite.
+
+    Headers are first staged with :meth:`stage`, compared to the current
+    snapshot with :meth:`diff` and finally made the current snapshot with
+    :meth:`commit`.
+
+    :param path: The path of the database file.
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        for table in ('headers', 'staged'):
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS %s ('
+                'identifier TEXT PRIMARY KEY, datestamp TEXT, '
+                'deleted INTEGER NOT NULL) WITHOUT ROWID' % table)
+        self.connection.execute('DELETE FROM staged')
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM headers').fetchone()[0]
+
+    def get(self, identifier):
+        """Return ``(datestamp, deleted)`` for `identifier` from the current
+        snapshot or :obj:`None`."""
+        row = self.connection.execute(
+            'SELECT datestamp, deleted FROM headers WHERE identifier = ?',
+            (identifier,)).fetchone()
+        if row is None:
+            return None
+        return row[0], bool(row[1])
+
+    def stage(self, headers, batch_size=1000):
+        """Write headers to the staging area.
+
+        :param headers: An iterable of :class:`sickle.models.Header` objects.
+        :param batch_size: The number of rows written per statement.
+        :type batch_size: int
+        """
+        batch = []
+        for header in headers:
+            batch.append((header.identifier, header.datestamp,
+                          int(header.deleted)))
+            if len(batch) >= batch_size:
+                self._insert('staged', batch)
+                batch = []
+        if batch:
+            self._insert('staged', batch)
+        self.connection.commit()
+
+    def _insert(self, table, rows):
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO %s VALUES (?, ?, ?)' % table, rows)
+
+    def _identifiers(self, query):
+        return [row[0] for row in self.connection.execute(query)]
+
+    def diff(self, complete=True):
+        """Compare the staged headers with the current snapshot.
+
+        :param complete: Flag for whether the staged headers represent the
+                         complete list of the repository. Only then records
+                         missing from the list are reported as removed.
+        :type complete: bool
+        :rtype: :class:`IndexDiff`
+        """
+        new = self._identifiers(
+            'SELECT s.identifier FROM staged s '
+            'LEFT JOIN headers h ON s.identifier = h.identifier '
+            'WHERE h.identifier IS NULL AND s.deleted = 0')
+        changed = self._identifiers(
+            'SELECT s.identifier FROM staged s '
+            'JOIN headers h ON s.identifier = h.identifier '
+            'WHERE s.deleted = 0 '
+            'AND (h.deleted = 1 OR h.datestamp IS NOT s.datestamp)')
+        deleted = self._identifiers(
+            'SELECT s.identifier FROM staged s '
+            'JOIN headers h ON s.identifier = h.identifier '
+            'WHERE s.deleted = 1 AND h.deleted = 0')
+        removed = []
+        if complete:
+            removed = self._identifiers(
+                'SELECT h.identifier FROM headers h '
+                'LEFT JOIN staged s ON s.identifier = h.identifier '
+                'WHERE s.identifier IS NULL AND h.deleted = 0')
+        return IndexDiff(new, changed, deleted, removed)
+
+    def commit(self, complete=True):
+        """Make the staged headers the current snapshot.
+
+        :param complete: If :obj:`False`, the staged headers are merged into
+                         the current snapshot instead of replacing it.
+        :type complete: bool
+        """
+        if complete:
+            self.connection.execute('DELETE FROM headers')
+        self.connection.execute(
+            'INSERT OR REPLACE INTO headers SELECT * FROM staged')
+        self.connection.execute('DELETE FROM staged')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def sync(sickle, index, max_workers=4, list_records_threshold=None,
+         **kwargs):
+    """Synchronize with a repository by comparing its identifier list
+    against `index`.
+
+    Yields ``(status, identifier, record)`` tuples where `status` is one of
+    :data:`NEW`, :data:`CHANGED`, :data:`DELETED` or :data:`REMOVED`. Records
+    are only fetched for new and changed identifiers (via
+    :meth:`sickle.app.Sickle.GetRecords`); `record` is :obj:`None` for
+    the other states. The index is updated after all results have been
+    consumed::
+
+        >>> index = IdentifierIndex('oai_index.db')
+        >>> for status, identifier, record in sync(
+        ...         sickle, index, metadataPrefix='oai_dc'):
+        ...     pass
+
+    If the arguments contain `from`, `until` or `set`, the identifier list
+    is considered partial: no records are reported as removed and the
+    listed headers are merged into the index. The identifiers are listed
+    with :meth:`sickle.app.Sickle.ListIdentifiers`, so the iterator must
+    yield headers.
+
+    :param sickle: The Sickle object used for harvesting.
+    :type sickle: :class:`sickle.app.Sickle`
+    :param index: The local index.
+    :type index: :class:`IdentifierIndex`
+    :param max_workers: The maximum number of concurrent GetRecord requests.
+    :type max_workers: int
+    :param list_records_threshold: Number of records to fetch from which a
+                                   ListRecords request starting at the
+                                   earliest changed datestamp is used
+                                   instead of GetRecord requests.
+    :type list_records_threshold: int
+    :param kwargs: OAI arguments (e.g. `metadataPrefix` or `set`).
+    """
+    complete = not any(name in kwargs for name in ('from', 'until', 'set'))
+    try:
+        index.stage(sickle.ListIdentifiers(**kwargs))
+    except oaiexceptions.NoRecordsMatch:
+        pass
+    diff = index.diff(complete=complete)
+
+    for identifier in diff.deleted:
+        yield DELETED, identifier, None
+    for identifier in diff.removed:
+        yield REMOVED, identifier, None
+
+    status = dict((identifier, NEW) for identifier in diff.new)
+    status.update((identifier, CHANGED) for identifier in diff.changed)
+    if status:
+        if list_records_threshold is not None \
+                and len(status) >= list_records_threshold:
+            fetch_args = dict(kwargs)
+            earliest = _earliest_datestamp(index, status)
+            if earliest is not None:
+                fetch_args['from'] = truncate_datestamp(
+                    earliest, repository_granularity(sickle))
+        else:
+            # GetRecord only allows identifier and metadataPrefix
+            fetch_args = dict((name, value) for name, value in kwargs.items()
+                              if name == 'metadataPrefix')
+        for identifier, record in sickle.GetRecords(
+                list(status), max_workers=max_workers,
+                list_records_threshold=list_records_threshold,
+                **fetch_args):
+            yield status[identifier], identifier, record
+    index.commit(complete=complete)
+
+
+def _earliest_datestamp(index, identifiers):
+    earliest = None
+    for identifier in identifiers:
+        datestamp = index.connection.execute(
+            'SELECT datestamp FROM staged WHERE identifier = ?',
+            (identifier,)).fetchone()[0]
+        if datestamp and (earliest is None or datestamp < earliest):
+            earliest = datestamp
+    return earliest
@@ -0,0 +1,97 @@
+# coding: utf-8
+"""
+    sickle.tests.test_cli
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from sickle.cli import main, endpoint_directory
+from sickle.tests.test_harvesting import mock_harvest
+
+
+class TestCLI(unittest.TestCase):
+
+    def setUp(self):
+        self.patch = mock.patch('sickle.app.Sickle.harvest', mock_harvest)
+        self.patch.start()
+        self.directory = tempfile.mkdtemp()
+        self.endpoint_dir = os.path.join(self.directory, 'localhost_oai')
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.directory)
+
+    def state(self):
+        with open(os.path.join(self.endpoint_dir, 'state.json')) as fp:
+            return json.load(fp)
+
+    def test_endpoint_directory(self):
+        self.assertEqual(endpoint_directory('http://localhost/oai'),
+                         'localhost_oai')
+
+    def test_harvest(self):
+        self.assertEqual(
+            main(['http://localhost/oai', '-o', self.directory, '-q']), 0)
+        state = self.state()
+        run = state['run']
+        self.assertTrue(run['complete'])
+        self.assertEqual(state['last_complete'], run['started'])
+        partition = run['partitions'][0]
+        self.assertEqual(partition['pages'], 4)
+        path = os.path.join(self.endpoint_dir, run['id'], 'all',
+                            '00001.xml.gz')
+        with gzip.open(path, 'rb') as fp:
+            self.assertIn(b'<ListRecords>', fp.read())
+
+    def test_partition_by_month(self):
+        main(['http://localhost/oai', '-o', self.directory, '-q',
+              '-p', 'month', '-f', '2020-01-15', '-u', '2020-03-01'])
+        partitions = self.state()['run']['partitions']
+        self.assertEqual([p['name'] for p in partitions], [
+            '2020-01-15_2020-01-31', '2020-02-01_2020-02-29',
+            '2020-03-01_2020-03-01'])
+        self.assertEqual(partitions[1]['params']['from'], '2020-02-01')
+
+    def test_partition_by_set(self):
+        main(['http://localhost/oai', '-o', self.directory, '-q',
+              '-p', 'set', '--verb', 'ListIdentifiers'])
+        self.assertEqual(len(self.state()['run']['partitions']), 131)
+
+    def test_incremental(self):
+        main(['http://localhost/oai', '-o', self.directory, '-q'])
+        last_complete = self.state()['last_complete']
+        main(['http://localhost/oai', '-o', self.directory, '-q', '-i'])
+        params = self.state()['run']['partitions'][0]['params']
+        self.assertEqual(params['from'], last_complete)
+
+    def test_resume(self):
+        main(['http://localhost/oai', '-o', self.directory, '-q'])
+        with open(os.path.join(self.endpoint_dir, 'state.json')) as fp:
+            state = json.load(fp)
+        state['run']['complete'] = False
+        partition = state['run']['partitions'][0]
+        partition.update(complete=False, pages=2, token='ListRecords3.xml')
+        with open(os.path.join(self.endpoint_dir, 'state.json'), 'w') as fp:
+            json.dump(state, fp)
+        main(['http://localhost/oai', '-o', self.directory, '-q', '-r'])
+        run = self.state()['run']
+        self.assertEqual(run['id'], state['run']['id'])
+        self.assertTrue(run['complete'])
+        self.assertEqual(run['partitions'][0]['pages'], 4)
+
+    def test_prefetch_not_with_resume(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit) as context:
+                main(['http://localhost/oai', '-o', self.directory, '-q',
+                      '-r', '--prefetch'])
+        self.assertEqual(context.exception.code, 2)
+        self.assertFalse(os.path.exists(self.endpoint_dir))
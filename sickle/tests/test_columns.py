@@ -0,0 +1,54 @@
+# coding: utf-8
+"""
+    sickle.tests.test_columns
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+from unittest import TestCase
+
+from lxml import etree
+
+from sickle.columns import header_columns
+from sickle.models import Header
+
+this_dir, this_filename = os.path.split(__file__)
+
+NS = '{http://www.openarchives.org/OAI/2.0/}'
+
+
+def parse(filename):
+    return etree.parse(os.path.join(this_dir, 'sample_data', filename)).getroot()
+
+
+class TestColumns(TestCase):
+
+    def assert_matches_headers(self, tree):
+        headers = [Header(e) for e in tree.iterfind('.//' + NS + 'header')]
+        columns = header_columns(tree)
+        self.assertEqual(columns['identifier'],
+                         [h.identifier for h in headers])
+        self.assertEqual(columns['datestamp'], [h.datestamp for h in headers])
+        self.assertEqual(columns['deleted'], [h.deleted for h in headers])
+        self.assertEqual(columns['setSpecs'], [h.setSpecs for h in headers])
+
+    def test_ListIdentifiers(self):
+        tree = parse('ListIdentifiers.xml')
+        self.assert_matches_headers(tree)
+        self.assertEqual(header_columns(tree)['deleted'], [False, True])
+
+    def test_ListRecords(self):
+        self.assert_matches_headers(parse('ListRecords.xml'))
+
+    def test_missing_fields(self):
+        tree = etree.XML(
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            '<ListIdentifiers>'
+            '<header><identifier>a</identifier><setSpec>s</setSpec></header>'
+            '<header><identifier>b</identifier>'
+            '<datestamp>2020-01-01</datestamp></header>'
+            '</ListIdentifiers></OAI-PMH>')
+        self.assert_matches_headers(tree)
+        self.assertEqual(header_columns(tree)['datestamp'],
+                         [None, '2020-01-01'])
@@ -0,0 +1,88 @@
+# coding: utf-8
+"""
+    sickle.tests.test_dedup
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import shutil
+import tempfile
+import unittest
+
+import mock
+from lxml import etree
+
+from sickle import Sickle
+from sickle.dedup import HashIndex, Deduplicator, content_hash
+from sickle.tests.test_harvesting import mock_harvest
+
+RECORD = """\
+<record xmlns="http://www.openarchives.org/OAI/2.0/">
+    <header>
+        <identifier>oai:example.org:1</identifier>
+        <datestamp>%s</datestamp>
+    </header>
+    <metadata><dc xmlns="http://purl.org/dc/elements/1.1/">%s</dc></metadata>
+</record>"""
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.patch = mock.patch('sickle.app.Sickle.harvest', mock_harvest)
+        self.patch.start()
+        self.sickle = Sickle('http://localhost')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.directory)
+
+    def test_content_hash(self):
+        first = etree.XML(RECORD % ('2020-01-01', '<title>A</title>'))
+        touched = etree.XML(RECORD % ('2020-02-01', '<title>A</title>'))
+        changed = etree.XML(RECORD % ('2020-01-01', '<title>B</title>'))
+        self.assertEqual(content_hash(first), content_hash(touched))
+        self.assertNotEqual(content_hash(first), content_hash(changed))
+
+    def test_deduplicate_between_harvests(self):
+        index = HashIndex.for_endpoint(self.directory, self.sickle.endpoint)
+        deduplicator = Deduplicator(index)
+        first = [r for r in self.sickle.ListRecords(
+            metadataPrefix='oai_dc', item_filter=deduplicator)]
+        self.assertTrue(any(not r.deleted for r in first))
+        deduplicator.commit()
+        index.close()
+
+        index = HashIndex.for_endpoint(self.directory, self.sickle.endpoint)
+        self.assertEqual(len(index), 1)
+        deduplicator = Deduplicator(index)
+        second = [r for r in self.sickle.ListRecords(
+            metadataPrefix='oai_dc', item_filter=deduplicator)]
+        index.close()
+        self.assertTrue(all(r.deleted for r in second))
+        self.assertEqual(deduplicator.skipped, 4)
+
+    def test_hashes_stored_on_acknowledgement(self):
+        index = HashIndex(':memory:', commit_interval=1)
+
+        def harvest():
+            deduplicator = Deduplicator(index)
+            records = [r for r in self.sickle.ListRecords(
+                metadataPrefix='oai_dc', item_filter=deduplicator)]
+            return deduplicator, [r.header.identifier for r in records
+                                  if not r.deleted]
+
+        # The consumer fails before acknowledging the records
+        deduplicator, identifiers = harvest()
+        self.assertEqual(identifiers, ['oai:test.example.com:1585322'])
+        self.assertEqual(len(deduplicator), 2)
+        self.assertEqual(len(index), 0)
+        # The records are delivered again
+        deduplicator, identifiers = harvest()
+        self.assertEqual(identifiers, ['oai:test.example.com:1585322'])
+        deduplicator.ack(identifiers[0])
+        self.assertEqual(len(index), 1)
+        self.assertEqual(len(deduplicator), 1)
+        deduplicator, identifiers = harvest()
+        self.assertEqual(identifiers, [])
@@ -0,0 +1,179 @@
+# coding: utf-8
+"""
+    sickle.tests.test_estimate
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import unittest
+
+import mock
+
+from sickle import Sickle
+from sickle.estimate import SizeEstimator, probe_size
+from sickle.response import OAIResponse
+from sickle.tests.test_harvesting import MockResponse
+
+OAI = ('<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+       '<%(verb)s>%(body)s</%(verb)s></OAI-PMH>')
+NO_RECORDS = ('<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+              '<error code="noRecordsMatch"/></OAI-PMH>')
+
+
+class FakeRepository(object):
+    """Serves the first pages of list requests over a fixed set of records
+    with day granularity."""
+
+    page_size = 10
+
+    def __init__(self, records, complete_list_size=True):
+        #: ``(identifier, datestamp, setSpec)`` tuples
+        self.records = records
+        self.complete_list_size = complete_list_size
+        self.requests = []
+
+    def harvest(self, **kwargs):
+        self.requests.append(kwargs)
+        verb = kwargs['verb']
+        if verb == 'Identify':
+            body = '<earliestDatestamp>2020-01-01</earliestDatestamp>'
+        elif verb == 'ListSets':
+            body = ''.join('<set><setSpec>%s</setSpec><setName>%s</setName>'
+                           '</set>' % (s, s) for s in ('a', 'b', 'c'))
+        else:
+            body = self.page(verb, kwargs)
+            if body is None:
+                return OAIResponse(MockResponse(NO_RECORDS), kwargs)
+        return OAIResponse(MockResponse(OAI % {'verb': verb, 'body': body}),
+                           kwargs)
+
+    def page(self, verb, kwargs):
+        selected = [r for r in self.records
+                    if kwargs.get('from', '0000') <= r[1] <=
+                    kwargs.get('until', '9999') and
+                    kwargs.get('set', r[2]) == r[2]]
+        if not selected:
+            return None
+        items = []
+        for identifier, datestamp, set_spec in selected[:self.page_size]:
+            header = ('<header><identifier>%s</identifier><datestamp>%s'
+                      '</datestamp><setSpec>%s</setSpec></header>' % (
+                          identifier, datestamp, set_spec))
+            if verb == 'ListRecords':
+                header = '<record>%s<metadata><dc xmlns="http://purl.org/' \
+                         'dc/elements/1.1/"><title>%s</title></dc>' \
+                         '</metadata></record>' % (header, identifier)
+            items.append(header)
+        if len(selected) > self.page_size:
+            items.append('<resumptionToken%s>token</resumptionToken>' % (
+                ' completeListSize="%d"' % len(selected)
+                if self.complete_list_size else ''))
+        return ''.join(items)
+
+
+def records(*days):
+    """Create records for the given days of January 2020, the number of
+    records per day given as `(day, count)` tuples."""
+    result = []
+    for day, count in days:
+        for n in range(count):
+            result.append(('oai:%d-%d' % (day, n), '2020-01-%02d' % day,
+                           'abc'[n % 3]))
+    return result
+
+
+class TestEstimate(unittest.TestCase):
+
+    def estimator(self, repository, **kwargs):
+        self.patch = mock.patch('sickle.app.Sickle.harvest',
+                                side_effect=repository.harvest)
+        self.patch.start()
+        self.addCleanup(self.patch.stop)
+        return SizeEstimator(Sickle('http://localhost'), **kwargs)
+
+    def test_probe_size(self):
+        repository = FakeRepository(records((1, 25)))
+        sickle = Sickle('http://localhost')
+        with mock.patch('sickle.app.Sickle.harvest',
+                        side_effect=repository.harvest):
+            self.assertEqual(probe_size(sickle, {'metadataPrefix': 'x'}),
+                             (25, True))
+            self.assertEqual(probe_size(sickle, {'set': 'a'}), (9, True))
+            self.assertEqual(probe_size(sickle, {'from': '2020-02-01'}),
+                             (0, True))
+            repository.complete_list_size = False
+            self.assertEqual(probe_size(sickle, {}), (10, False))
+            self.assertEqual(probe_size(sickle, {'set': 'b'}), (8, True))
+
+    def test_probes_do_not_prefetch(self):
+        repository = FakeRepository(records((1, 25)))
+        sickle = Sickle('http://localhost', prefetch=True)
+        with mock.patch('sickle.app.Sickle.harvest',
+                        side_effect=repository.harvest):
+            self.assertEqual(probe_size(sickle, {}), (25, True))
+            sample = list(SizeEstimator(sickle).sample(
+                5, **{'from': '2020-01-01', 'until': '2020-01-01'}))
+        self.assertEqual(len(sample), 5)
+        # probe_size, total and window of the estimate, first ListRecords
+        # page; no page has been requested with the resumption token
+        self.assertEqual([r.get('resumptionToken')
+                          for r in repository.requests], [None] * 4)
+        self.assertTrue(sickle.prefetch)
+
+    def test_estimate(self):
+        repository = FakeRepository(records((1, 30), (3, 5), (4, 12)))
+        estimator = self.estimator(repository, windows=2)
+        estimate = estimator.estimate(metadataPrefix='oai_dc',
+                                      until='2020-01-04')
+        self.assertEqual(estimate.total, 47)
+        self.assertTrue(estimate.complete)
+        self.assertEqual(estimate.windows, [
+            ('2020-01-01', '2020-01-02', 30), ('2020-01-03', '2020-01-04', 17)])
+        self.assertEqual(estimate.sets, {'a': 16, 'b': 16, 'c': 15})
+        # total, Identify, 2 windows, ListSets, 3 sets
+        self.assertEqual(estimate.requests, 8)
+        self.assertEqual(len(repository.requests), 8)
+
+    def test_quick(self):
+        repository = FakeRepository(records((1, 30), (3, 5), (4, 12)))
+        estimator = self.estimator(repository, windows=2)
+        estimate = estimator.estimate(sets=False, quick=True,
+                                      until='2020-01-04')
+        self.assertEqual((estimate.total, estimate.complete), (47, True))
+        self.assertEqual(estimate.windows, [])
+        self.assertEqual(len(repository.requests), 1)
+        # Windows are still probed if the size is unknown
+        repository.complete_list_size = False
+        estimate = estimator.estimate(sets=False, quick=True,
+                                      until='2020-01-04')
+        self.assertEqual(len(estimate.windows), 2)
+
+    def test_budget(self):
+        repository = FakeRepository(records((1, 30), (3, 5), (4, 12)))
+        estimator = self.estimator(repository, windows=4, max_requests=7)
+        estimate = estimator.estimate(**{'from': '2020-01-01',
+                                         'until': '2020-01-04'})
+        self.assertEqual(len(estimate.windows), 4)
+        self.assertEqual(estimate.sets, {'a': 16, 'b': None, 'c': None})
+        self.assertFalse(estimate.complete)
+        self.assertEqual(len(repository.requests), 7)
+
+    def test_lower_bounds(self):
+        repository = FakeRepository(records((1, 30), (3, 5), (4, 12)),
+                                    complete_list_size=False)
+        estimator = self.estimator(repository, windows=4)
+        estimate = estimator.estimate(sets=False, until='2020-01-04')
+        self.assertFalse(estimate.complete)
+        self.assertEqual([w[2] for w in estimate.windows], [10, 0, 5, 10])
+        self.assertEqual(estimate.total, 25)
+
+    def test_sample(self):
+        repository = FakeRepository(records((1, 30), (3, 5), (4, 15)))
+        estimator = self.estimator(repository, windows=2)
+        sample = list(estimator.sample(10, metadataPrefix='oai_dc',
+                                       until='2020-01-04'))
+        self.assertEqual([r.header.datestamp for r in sample],
+                         ['2020-01-01'] * 6 + ['2020-01-03'] * 4)
+        self.assertEqual(list(estimator.sample(
+            5, metadataPrefix='oai_dc', **{'from': '2020-02-01',
+                                           'until': '2020-02-03'})), [])
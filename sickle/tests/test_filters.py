@@ -0,0 +1,62 @@
+# coding: utf-8
+"""
+    sickle.tests.test_filters
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+from unittest import TestCase
+
+from lxml import etree
+
+from sickle.filters import HeaderFilter, all_of, get_identifier, is_deleted
+
+RECORD = """\
+<record xmlns="http://www.openarchives.org/OAI/2.0/">
+    <header %s>
+        <identifier>oai:example.org:1</identifier>
+        <datestamp>2015-06-01T12:00:00Z</datestamp>
+        <setSpec>physics</setSpec>
+        <setSpec>math</setSpec>
+    </header>
+</record>"""
+
+
+class TestFilters(TestCase):
+
+    def setUp(self):
+        self.record = etree.XML(RECORD % '')
+        self.deleted = etree.XML(RECORD % 'status="deleted"')
+
+    def test_helpers(self):
+        self.assertFalse(is_deleted(self.record))
+        self.assertTrue(is_deleted(self.deleted))
+        self.assertTrue(is_deleted(self.deleted[0]))
+        self.assertEqual(get_identifier(self.record), 'oai:example.org:1')
+
+    def test_deleted(self):
+        self.assertTrue(HeaderFilter(deleted=False)(self.record))
+        self.assertFalse(HeaderFilter(deleted=False)(self.deleted))
+        self.assertTrue(HeaderFilter(deleted=True)(self.deleted))
+
+    def test_sets(self):
+        self.assertTrue(HeaderFilter(sets=['math', 'cs'])(self.record))
+        self.assertFalse(HeaderFilter(sets=['cs'])(self.record))
+
+    def test_datestamps(self):
+        self.assertTrue(HeaderFilter(from_datestamp='2015-06-01',
+                                     until_datestamp='2015-06-01')(self.record))
+        self.assertFalse(HeaderFilter(from_datestamp='2015-06-02')(self.record))
+        self.assertFalse(HeaderFilter(until_datestamp='2015-05')(self.record))
+
+    def test_identifier_prefix(self):
+        self.assertTrue(
+            HeaderFilter(identifier_prefix='oai:example.org:')(self.record))
+        self.assertFalse(
+            HeaderFilter(identifier_prefix='oai:other.org:')(self.record))
+
+    def test_all_of(self):
+        combined = all_of(HeaderFilter(sets=['math']),
+                          HeaderFilter(deleted=True))
+        self.assertFalse(combined(self.record))
+        self.assertTrue(combined(self.deleted))
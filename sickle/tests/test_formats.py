@@ -0,0 +1,133 @@
+# coding: utf-8
+"""
+    sickle.tests.test_formats
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+from unittest import TestCase
+
+from lxml import etree
+
+from sickle.formats import DublinCoreRecord, MARCXMLRecord, DataCiteRecord, \
+    class_mapping_for
+from sickle.models import Record, Header
+
+this_dir, this_filename = os.path.split(__file__)
+
+NS = '{http://www.openarchives.org/OAI/2.0/}'
+
+RECORD = """\
+<record xmlns="http://www.openarchives.org/OAI/2.0/">
+    <header>
+        <identifier>oai:example.org:1</identifier>
+        <datestamp>2015-06-01T12:00:00Z</datestamp>
+    </header>
+    <metadata>%s</metadata>
+</record>"""
+
+MARC = """\
+<marc:record xmlns:marc="http://www.loc.gov/MARC21/slim">
+    <marc:leader>00000nam a2200000 a 4500</marc:leader>
+    <marc:controlfield tag="001">12345</marc:controlfield>
+    <marc:datafield tag="245" ind1="1" ind2="0">
+        <marc:subfield code="a">Title</marc:subfield>
+        <marc:subfield code="b">Subtitle</marc:subfield>
+    </marc:datafield>
+    <marc:datafield tag="650" ind1=" " ind2="0">
+        <marc:subfield code="a">Physics</marc:subfield>
+        <marc:subfield code="x">History</marc:subfield>
+        <marc:subfield code="x">Sources</marc:subfield>
+    </marc:datafield>
+    <marc:datafield tag="650" ind1=" " ind2="0">
+        <marc:subfield code="a">Mathematics</marc:subfield>
+    </marc:datafield>
+</marc:record>"""
+
+DATACITE = """\
+<oai_datacite xmlns="http://schema.datacite.org/oai/oai-1.1/">
+  <payload>
+    <resource xmlns="http://datacite.org/schema/kernel-4">
+      <identifier identifierType="DOI">10.1234/5678</identifier>
+      <creators>
+        <creator>
+          <creatorName>Doe, Jane</creatorName>
+          <nameIdentifier nameIdentifierScheme="ORCID">0000-0001</nameIdentifier>
+        </creator>
+      </creators>
+      <titles>
+        <title xml:lang="en">A title</title>
+        <title titleType="Subtitle">A subtitle</title>
+      </titles>
+      <publisher>Example</publisher>
+      <publicationYear>2019</publicationYear>
+    </resource>
+  </payload>
+</oai_datacite>"""
+
+
+class TestFormats(TestCase):
+
+    def test_DublinCoreRecord(self):
+        tree = etree.parse(os.path.join(this_dir, 'sample_data',
+                                        'ListRecords.xml'))
+        for element in tree.iterfind('.//' + NS + 'record'):
+            record = Record(element)
+            fast_record = DublinCoreRecord(element)
+            self.assertEqual(record.deleted, fast_record.deleted)
+            if not record.deleted:
+                self.assertEqual(record.metadata, fast_record.metadata)
+
+    def test_MARCXMLRecord(self):
+        record = MARCXMLRecord(etree.XML(RECORD % MARC))
+        self.assertIsInstance(record.header, Header)
+        self.assertEqual(record.metadata['leader'], '00000nam a2200000 a 4500')
+        self.assertEqual(record.metadata['controlfields'], {'001': '12345'})
+        self.assertEqual(record.metadata['datafields']['245'], [
+            {'ind1': '1', 'ind2': '0',
+             'subfields': {'a': ['Title'], 'b': ['Subtitle']}}])
+        subjects = record.metadata['datafields']['650']
+        self.assertEqual(len(subjects), 2)
+        self.assertEqual(subjects[0]['subfields']['x'],
+                         ['History', 'Sources'])
+
+    def test_DataCiteRecord(self):
+        metadata = DataCiteRecord(etree.XML(RECORD % DATACITE)).metadata
+        self.assertEqual(metadata['identifier'],
+                         [{'identifierType': 'DOI', 'value': '10.1234/5678'}])
+        self.assertEqual(metadata['creators'], [{
+            'creatorName': ['Doe, Jane'],
+            'nameIdentifier': [{'nameIdentifierScheme': 'ORCID',
+                                'value': '0000-0001'}]}])
+        self.assertEqual(metadata['titles'], [
+            {'lang': 'en', 'value': 'A title'},
+            {'titleType': 'Subtitle', 'value': 'A subtitle'}])
+        self.assertEqual(metadata['publicationYear'], ['2019'])
+
+    def test_comments_and_processing_instructions(self):
+        dc = ('<!-- harvested --><?pi data?>'
+              '<oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/'
+              'oai_dc/" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+              '<!-- title --><dc:title>A title</dc:title></oai_dc:dc>')
+        self.assertEqual(DublinCoreRecord(etree.XML(RECORD % dc)).metadata,
+                         {'title': ['A title']})
+        marc = MARC.replace('<marc:subfield code="b">',
+                            '<!-- b --><?pi data?><marc:subfield code="b">')
+        record = MARCXMLRecord(etree.XML(RECORD % ('<!-- MARC -->' + marc)))
+        self.assertEqual(record.metadata['datafields']['245'][0]['subfields'],
+                         {'a': ['Title'], 'b': ['Subtitle']})
+        datacite = DATACITE.replace('<creators>', '<creators><!-- c -->')
+        metadata = DataCiteRecord(etree.XML(RECORD % datacite)).metadata
+        self.assertEqual(len(metadata['creators']), 1)
+
+    def test_missing_metadata(self):
+        record = MARCXMLRecord(etree.XML(RECORD % ''))
+        self.assertEqual(record.metadata, {})
+
+    def test_class_mapping_for(self):
+        mapping = class_mapping_for('marc21')
+        self.assertIs(mapping['ListRecords'], MARCXMLRecord)
+        self.assertIs(mapping['GetRecord'], MARCXMLRecord)
+        self.assertIs(mapping['ListIdentifiers'], Header)
+        self.assertIs(class_mapping_for('unknown')['ListRecords'], Record)
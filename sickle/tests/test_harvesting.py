@@ -5,7 +5,9 @@
 
     :copyright: Copyright 2015 Mathias Loesch
 """
+import datetime
 import os
+import threading
 import unittest
 
 from lxml import etree
@@ -13,9 +15,13 @@ from nose.tools import raises
 import mock
 
 from sickle import Sickle
+from sickle.filters import HeaderFilter
+from sickle.models import Record, ResumptionToken
 from sickle._compat import binary_type, string_types, text_type, to_unicode
-from sickle.response import OAIResponse
-from sickle.iterator import OAIResponseIterator
+from sickle.response import OAIResponse, get_parser, scan_response, \
+    FAST, STRICT
+from sickle.iterator import OAIResponseIterator, OAIBatchIterator, \
+    OAIItemIterator
 from sickle.oaiexceptions import BadArgument, CannotDisseminateFormat, \
     IdDoesNotExist, NoSetHierarchy, BadResumptionToken, NoRecordsMatch, \
     OAIError
@@ -98,6 +104,30 @@ class TestCase(unittest.TestCase):
         self.assertEqual(response.xml, None)
         self.assertIsInstance(response.raw, string_types)
 
+    def test_broken_XML_parser_modes(self):
+        response = self.sickle.harvest(
+            verb='ListRecords', resumptionToken='ListRecordsBroken.xml')
+        response.parser_mode = FAST
+        self.assertEqual(response.xml, None)
+        response = self.sickle.harvest(
+            verb='ListRecords', resumptionToken='ListRecordsBroken.xml')
+        response.parser_mode = STRICT
+        self.assertRaises(etree.XMLSyntaxError, lambda: response.xml)
+
+    def test_OAIResponse_parsed_once(self):
+        response = self.sickle.harvest(verb='ListRecords',
+                                       metadataPrefix='oai_dc')
+        self.assertIs(response.xml, response.xml)
+
+    def test_parser_per_thread(self):
+        parsers = []
+        thread = threading.Thread(target=lambda: parsers.append(get_parser()))
+        thread.start()
+        thread.join()
+        self.assertIs(get_parser(), get_parser())
+        self.assertIsNot(get_parser(), parsers[0])
+        self.assertIsNot(get_parser(), get_parser(huge_tree=True))
+
     def test_ListRecords(self):
         records = self.sickle.ListRecords(metadataPrefix='oai_dc')
         assert len([r for r in records]) == 8
@@ -108,6 +138,33 @@ class TestCase(unittest.TestCase):
         num_records = len([r for r in records])
         assert num_records == 4
 
+    def test_ListRecords_ignore_deleted_skips_mapping(self):
+        mapper = mock.Mock(side_effect=Record)
+        self.sickle.class_mapping = {'ListRecords': mapper}
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc',
+                                          ignore_deleted=True)
+        self.assertEqual(len([r for r in records]), 4)
+        self.assertEqual(mapper.call_count, 4)
+
+    def test_ListRecords_item_filter(self):
+        records = self.sickle.ListRecords(
+            metadataPrefix='oai_dc',
+            item_filter=HeaderFilter(deleted=True))
+        records = [r for r in records]
+        self.assertEqual(len(records), 4)
+        self.assertTrue(all(r.deleted for r in records))
+
+    def test_iterator_without_item_filter(self):
+        class LegacyIterator(OAIItemIterator):
+            def __init__(self, sickle, params, ignore_deleted=False):
+                super(LegacyIterator, self).__init__(sickle, params,
+                                                     ignore_deleted)
+
+        self.sickle.iterator = LegacyIterator
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc',
+                                          ignore_deleted=True)
+        self.assertEqual(len(list(records)), 4)
+
     def test_ListSets(self):
         set_iterator = self.sickle.ListSets()
         sets = [s for s in set_iterator]
@@ -156,6 +213,16 @@ class TestCase(unittest.TestCase):
         dict(record.header)
         self.assertEqual(dict(record), record.metadata)
 
+    def test_str_of_subclass(self):
+        class ShortRecord(Record):
+            def __unicode__(self):
+                return u'<short>'
+
+        record = ShortRecord(next(self.sickle.ListRecords(
+            metadataPrefix='oai_dc', ignore_deleted=True)).xml)
+        self.assertEqual(str(record), '<short>')
+        self.assertEqual(binary_type(record), b'<short>')
+
     # Test OAI-specific exceptions
 
     @raises(BadArgument)
@@ -193,11 +260,198 @@ class TestCase(unittest.TestCase):
         self.sickle.ListRecords(
             metadataPrefix='oai_dc', error='undefinedError')
 
+    def test_recover_expired_token(self):
+        requests = []
+
+        def expire_once(*args, **kwargs):
+            requests.append(kwargs)
+            if kwargs.get('resumptionToken') == 'ListRecords2.xml' and \
+                    len(requests) == 2:
+                kwargs = dict(kwargs, resumptionToken=None,
+                              error='badResumptionToken')
+            return mock_harvest(*args, **kwargs)
+
+        sickle = Sickle('http://localhost', recover_expired_tokens=True)
+        with mock.patch('sickle.app.Sickle.harvest', expire_once):
+            records = list(sickle.ListRecords(metadataPrefix='oai_dc'))
+        # The query is restarted and already delivered records are skipped
+        self.assertEqual(requests[2], {'verb': 'ListRecords',
+                                       'metadataPrefix': 'oai_dc'})
+        self.assertEqual([r.header.identifier for r in records],
+                         ['oai:test.example.com:1585310',
+                          'oai:test.example.com:1585322', None])
+
+    def test_recover_expired_token_from_datestamp(self):
+        page = ('<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+                '<ListIdentifiers>%s<resumptionToken>%s</resumptionToken>'
+                '</ListIdentifiers></OAI-PMH>')
+        record = ('<header><identifier>%s</identifier>'
+                  '<datestamp>%s</datestamp></header>')
+        first = page % (record % ('a', '2020-01-01T10:00:00Z') +
+                        record % ('b', '2020-01-02T10:00:00Z'), 'next')
+        restarted = page % (record % ('b', '2020-01-02T10:00:00Z') +
+                            record % ('c', '2020-01-02T11:00:00Z'), '')
+        requests = []
+        seen = []
+
+        def harvest(**kwargs):
+            requests.append(kwargs)
+            if kwargs['verb'] == 'Identify':
+                return mock_harvest(**kwargs)
+            if kwargs.get('resumptionToken') == 'next':
+                return mock_harvest(verb='ListIdentifiers',
+                                    error='badResumptionToken')
+            content = restarted if 'from' in kwargs else first
+            return OAIResponse(MockResponse(content), kwargs)
+
+        def item_filter(element):
+            seen.append(element)
+            return True
+
+        sickle = Sickle('http://localhost', recover_expired_tokens=True)
+        with mock.patch('sickle.app.Sickle.harvest', side_effect=harvest):
+            headers = list(sickle.ListIdentifiers(metadataPrefix='oai_dc',
+                                                  item_filter=item_filter))
+        # The day granularity of the repository is respected
+        self.assertEqual(requests[-1], {'verb': 'ListIdentifiers',
+                                        'metadataPrefix': 'oai_dc',
+                                        'from': '2020-01-02'})
+        self.assertEqual([h.identifier for h in headers],
+                         ['a', 'b', 'c'])
+        # Records sent again do not reach the filter
+        self.assertEqual(len(seen), 3)
+
+    @raises(BadResumptionToken)
+    def test_expired_token_not_recovered(self):
+        def expire(*args, **kwargs):
+            if kwargs.get('resumptionToken') == 'ListRecords2.xml':
+                kwargs = dict(kwargs, resumptionToken=None,
+                              error='badResumptionToken')
+            return mock_harvest(*args, **kwargs)
+
+        with mock.patch('sickle.app.Sickle.harvest', expire):
+            list(self.sickle.ListRecords(metadataPrefix='oai_dc'))
+
+    def test_token_expiration(self):
+        token = ResumptionToken(expiration_date='2015-02-01T10:20:30Z')
+        self.assertEqual(token.expiration,
+                         datetime.datetime(2015, 2, 1, 10, 20, 30))
+        self.assertEqual(ResumptionToken().expiration, None)
+
+    def test_prefetch_before_token_expires(self):
+        expiration = datetime.datetime.utcnow() + \
+            datetime.timedelta(seconds=10)
+        harvest = mock.Mock(side_effect=mock_harvest)
+        with mock.patch('sickle.app.Sickle.harvest', harvest), \
+                mock.patch.object(ResumptionToken, 'expiration',
+                                  new_callable=mock.PropertyMock,
+                                  return_value=expiration):
+            records = self.sickle.ListRecords(metadataPrefix='oai_dc')
+            self.assertEqual(harvest.call_count, 1)
+            next(records)
+            # The next page is requested while the first one is not consumed
+            self.assertEqual(harvest.call_count, 2)
+            # The token of the new page expires soon as well, but the page
+            # is only fetched early once
+            next(records)
+            self.assertEqual(harvest.call_count, 2)
+            self.assertEqual(len(list(records)), 6)
+            self.assertEqual(harvest.call_count, 4)
+
+    def test_scan_response(self):
+        def scan(filename):
+            with open(os.path.join(this_dir, 'sample_data', filename),
+                      'rb') as fp:
+                return scan_response(fp.read())
+
+        self.assertEqual(scan('ListRecords.xml'), ('ListRecords2.xml', None))
+        self.assertEqual(scan('ListRecords4.xml'), (None, None))
+        self.assertEqual(scan('badResumptionToken.xml'),
+                         (None, 'badResumptionToken'))
+        self.assertEqual(scan_response(
+            b'<OAI-PMH><resumptionToken cursor="10">a&amp;b'
+            b'</resumptionToken></OAI-PMH>'), ('a&b', None))
+        self.assertEqual(scan_response(
+            b'<OAI-PMH><resumptionToken completeListSize="10"/></OAI-PMH>'),
+            ('', None))
+
+    def test_prefetch(self):
+        harvest = mock.Mock(side_effect=mock_harvest)
+        sickle = Sickle('http://localhost', prefetch=True)
+        with mock.patch('sickle.app.Sickle.harvest', harvest):
+            records = sickle.ListRecords(metadataPrefix='oai_dc')
+            records._prefetched.result()
+            # The second page is requested before the first one is consumed
+            self.assertEqual(harvest.call_count, 2)
+            self.assertEqual(harvest.call_args[1],
+                             {'verb': 'ListRecords',
+                              'resumptionToken': 'ListRecords2.xml'})
+            self.assertEqual(len(list(records)), 8)
+            self.assertEqual(harvest.call_count, 4)
+
+    def test_prefetch_wrong_token(self):
+        harvest = mock.Mock(side_effect=mock_harvest)
+        sickle = Sickle('http://localhost', prefetch=True)
+        with mock.patch('sickle.app.Sickle.harvest', harvest), \
+                mock.patch('sickle.iterator.scan_response',
+                           return_value=('ListRecords4.xml', None)):
+            records = list(sickle.ListRecords(metadataPrefix='oai_dc'))
+        # The parsed token wins over the scanned one
+        self.assertEqual(len(records), 8)
+
+    def test_GetRecords(self):
+        identifiers = ['oai:test.example.com:%d' % i for i in range(10)]
+        results = list(self.sickle.GetRecords(identifiers, max_workers=3,
+                                              metadataPrefix='oai_dc'))
+        self.assertEqual(sorted(i for i, _ in results), sorted(identifiers))
+        for _, record in results:
+            self.assertEqual(record.header.identifier,
+                             'oai:test.example.com:1996652')
+
+    def test_GetRecords_idDoesNotExist(self):
+        results = dict(self.sickle.GetRecords(
+            ['a', 'b'], metadataPrefix='oai_dc', error='idDoesNotExist'))
+        self.assertEqual(results, {'a': None, 'b': None})
+
+    def test_GetRecords_from_ListRecords(self):
+        identifiers = ['oai:test.example.com:1585322', 'missing']
+        results = list(self.sickle.GetRecords(
+            identifiers, list_records_threshold=2, metadataPrefix='oai_dc'))
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0][0], 'oai:test.example.com:1585322')
+        self.assertEqual(results[0][1].header.identifier,
+                         'oai:test.example.com:1585322')
+        self.assertEqual(results[1], ('missing', None))
+
     def test_OAIResponseIterator(self):
         sickle = Sickle('fake_url', iterator=OAIResponseIterator)
         records = [r for r in sickle.ListRecords(metadataPrefix='oai_dc')]
         self.assertEqual(len(records), 4)
 
+    def test_OAIBatchIterator(self):
+        sickle = Sickle('fake_url', iterator=OAIBatchIterator)
+        batches = list(sickle.ListRecords(metadataPrefix='oai_dc'))
+        self.assertEqual([len(b.items) for b in batches], [2, 2, 2, 2])
+        self.assertEqual([b.resumption_token.token for b in batches[:3]],
+                         ['ListRecords2.xml', 'ListRecords3.xml',
+                          'ListRecords4.xml'])
+        self.assertEqual(batches[3].resumption_token, None)
+        self.assertTrue(all(isinstance(r, Record)
+                            for b in batches for r in b.items))
+        self.assertEqual(batches[1].oai_response.params['resumptionToken'],
+                         'ListRecords2.xml')
+        items = [r.raw for r in self.sickle.ListRecords(
+            metadataPrefix='oai_dc')]
+        self.assertEqual([r.raw for b in batches for r in b.items], items)
+
+    def test_OAIBatchIterator_ignore_deleted(self):
+        sickle = Sickle('fake_url', iterator=OAIBatchIterator)
+        batches = list(sickle.ListIdentifiers(metadataPrefix='oai_dc',
+                                              ignore_deleted=True))
+        self.assertEqual(len(batches), 2)
+        self.assertTrue(all(not h.deleted
+                            for b in batches for h in b.items))
+
 
 def mock_get(*args, **kwargs):
     class MockResponseWrongEncoding(object):
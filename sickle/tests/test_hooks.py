@@ -0,0 +1,129 @@
+# coding: utf-8
+"""
+    sickle.tests.test_hooks
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import patch, Mock
+from requests import HTTPError
+
+from sickle import Sickle
+from sickle.hooks import SpanExporter, merge_hooks, EVENTS, REQUEST_START, \
+    RESPONSE_RECEIVED, PARSED, RETRIED, FAILED
+
+XML = b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><ListSets/></OAI-PMH>'
+
+
+def make_response(status_code=200):
+    response = Mock(status_code=status_code, content=XML,
+                    text=XML.decode('utf-8'),
+                    elapsed=datetime.timedelta(milliseconds=5),
+                    headers={})
+    if status_code >= 400:
+        response.raise_for_status = Mock(side_effect=HTTPError)
+    return response
+
+
+class TestHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.hooks = dict((name, [self.events.append]) for name in EVENTS)
+
+    def test_events(self):
+        mock_get = Mock(return_value=make_response())
+        with patch('sickle.app.requests.get', mock_get):
+            sickle = Sickle('url', event_hooks=self.hooks)
+            list(sickle.ListSets())
+        self.assertEqual([e['event'] for e in self.events],
+                         [REQUEST_START, RESPONSE_RECEIVED, PARSED])
+        received = self.events[1]
+        self.assertEqual(received['verb'], 'ListSets')
+        self.assertEqual(received['bytes'], len(XML))
+        self.assertEqual(received['ttfb'], 0.005)
+        self.assertGreaterEqual(received['duration'], 0)
+        self.assertGreaterEqual(self.events[2]['duration'], 0)
+
+    def test_retry_and_failure_events(self):
+        mock_get = Mock(return_value=make_response(503))
+        with patch('sickle.app.requests.get', mock_get), \
+                patch('time.sleep', Mock()):
+            sickle = Sickle('url', max_retries=1, default_retry_after=0,
+                            event_hooks=self.hooks)
+            self.assertRaises(HTTPError, sickle.ListSets)
+        self.assertEqual([(e['event'], e['attempt']) for e in self.events], [
+            (REQUEST_START, 0), (RESPONSE_RECEIVED, 0), (RETRIED, 0),
+            (REQUEST_START, 1), (RESPONSE_RECEIVED, 1), (FAILED, 1)])
+
+    def test_merge_hooks(self):
+        first, second = Mock(), Mock()
+        merged = merge_hooks({PARSED: first}, {PARSED: [second]})
+        self.assertEqual(merged, {PARSED: [first, second]})
+
+    def test_span_exporter(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'spans.jsonl')
+            exporter = SpanExporter(path)
+            mock_get = Mock(return_value=make_response())
+            with patch('sickle.app.requests.get', mock_get):
+                sickle = Sickle('url', event_hooks=exporter.hooks())
+                list(sickle.ListSets())
+            exporter.close()
+            with open(path) as fp:
+                requests = [json.loads(line) for line in fp]
+        finally:
+            shutil.rmtree(directory)
+        # Each line is an OTLP ExportTraceServiceRequest
+        resource_spans = [r['resourceSpans'][0] for r in requests]
+        self.assertEqual(resource_spans[0]['resource']['attributes'], [
+            {'key': 'service.name', 'value': {'stringValue': 'sickle'}}])
+        spans = [r['scopeSpans'][0]['spans'][0] for r in resource_spans]
+        self.assertEqual([s['name'] for s in spans],
+                         ['oai.ListSets', 'oai.ListSets.parse'])
+        self.assertEqual(len(set(s['traceId'] for s in spans)), 1)
+        attributes = dict((a['key'], a['value']) for a in spans[0]['attributes'])
+        self.assertEqual(attributes['http.status_code'], {'intValue': '200'})
+        self.assertLessEqual(int(spans[0]['startTimeUnixNano']),
+                             int(spans[0]['endTimeUnixNano']))
+        self.assertNotIn('service.name', attributes)
+        self.assertNotIn('parentSpanId', spans[0])
+        self.assertEqual(spans[1]['parentSpanId'], spans[0]['spanId'])
+
+    def test_span_exporter_parse_on_other_thread(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'spans.jsonl')
+            exporter = SpanExporter(path)
+            mock_get = Mock(return_value=make_response())
+            with patch('sickle.app.requests.get', mock_get):
+                sickle = Sickle('url', event_hooks=exporter.hooks())
+                first = sickle.harvest(verb='ListSets')
+                second = sickle.harvest(verb='ListSets')
+            # The first response is parsed after the second request, on
+            # another thread
+            thread = threading.Thread(target=lambda: first.xml)
+            thread.start()
+            thread.join()
+            second.xml
+            exporter.close()
+            with open(path) as fp:
+                spans = [json.loads(line)['resourceSpans'][0]['scopeSpans']
+                         [0]['spans'][0] for line in fp]
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([s['name'] for s in spans], [
+            'oai.ListSets', 'oai.ListSets',
+            'oai.ListSets.parse', 'oai.ListSets.parse'])
+        self.assertNotEqual(spans[0]['spanId'], spans[1]['spanId'])
+        self.assertEqual(spans[2]['parentSpanId'], spans[0]['spanId'])
+        self.assertEqual(spans[3]['parentSpanId'], spans[1]['spanId'])
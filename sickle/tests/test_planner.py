@@ -0,0 +1,132 @@
+# coding: utf-8
+"""
+    sickle.tests.test_planner
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from sickle import Sickle
+from sickle.cli import main
+from sickle.hooks import RESPONSE_RECEIVED, PARSED, dispatch_hook
+from sickle.planner import EndpointProfile, HarvestPlanner
+from sickle.tests.test_harvesting import mock_harvest
+
+
+class TestPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.patch = mock.patch('sickle.app.Sickle.harvest', mock_harvest)
+        self.patch.start()
+        self.sickle = Sickle('http://localhost')
+        self.directory = tempfile.mkdtemp()
+        self.profile = EndpointProfile.for_endpoint(self.directory,
+                                                    'http://localhost')
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.directory)
+
+    def observe_page(self, planner, status_code=200, duration=1.0):
+        hooks = planner.hooks()
+        params = {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'}
+        dispatch_hook(hooks, RESPONSE_RECEIVED, {
+            'verb': 'ListRecords', 'status_code': status_code,
+            'duration': duration})
+        if status_code == 200:
+            dispatch_hook(hooks, PARSED, {
+                'verb': 'ListRecords', 'duration': 0.1,
+                'response': mock_harvest(**params)})
+
+    def test_learn_from_run(self):
+        planner = HarvestPlanner(self.profile)
+        self.observe_page(planner, duration=2.0)
+        self.observe_page(planner, duration=4.0)
+        self.assertEqual(planner.items, 4)
+        planner.finish()
+        self.assertEqual(self.profile.page_seconds('ListRecords'), 3.0)
+        self.assertEqual(self.profile.page_items('ListRecords'), 2.0)
+        self.assertEqual(self.profile.concurrency, 3)
+        with open(self.profile.path) as fp:
+            self.assertEqual(json.load(fp)['concurrency'], 3)
+        # A new run continues from the persisted figures
+        profile = EndpointProfile(self.profile.path)
+        self.assertEqual(profile.page_seconds('ListRecords'), 3.0)
+
+    def test_throttling_halves_concurrency(self):
+        self.profile.data['concurrency'] = 6
+        planner = HarvestPlanner(self.profile)
+        self.observe_page(planner)
+        self.observe_page(planner, status_code=503)
+        planner.finish()
+        self.assertEqual(planner.throttled, 1)
+        self.assertEqual(self.profile.concurrency, 3)
+
+    def test_max_concurrency(self):
+        self.profile.data['concurrency'] = 4
+        planner = HarvestPlanner(self.profile, max_concurrency=4)
+        self.observe_page(planner)
+        planner.finish()
+        self.assertEqual(self.profile.concurrency, 4)
+
+    def test_estimate_size(self):
+        planner = HarvestPlanner(self.profile)
+        self.assertEqual(planner.estimate_size(
+            self.sickle, {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'}),
+            4)
+
+        def no_records(*args, **kwargs):
+            return mock_harvest(error='noRecordsMatch', **kwargs)
+
+        with mock.patch('sickle.app.Sickle.harvest', no_records):
+            self.assertEqual(planner.estimate_size(
+                self.sickle, {'verb': 'ListRecords',
+                              'metadataPrefix': 'oai_dc'}), 0)
+
+    def test_window_count(self):
+        planner = HarvestPlanner(self.profile, window_seconds=60)
+        self.profile.observe('ListRecords', page_seconds=3.0, page_items=50)
+        # 200 pages of 3 seconds take 10 minutes
+        self.assertEqual(planner.window_count(10000, 'ListRecords', 365), 10)
+        self.assertEqual(planner.window_count(10000, 'ListRecords', 5), 5)
+        # Small harvests are split for the workers only
+        self.assertEqual(planner.window_count(100, 'ListRecords', 365), 2)
+        self.assertEqual(planner.window_count(10, 'ListRecords', 365), 1)
+
+    def test_plan(self):
+        planner = HarvestPlanner(self.profile, window_seconds=60)
+        params = {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc',
+                  'from': '2020-01-01', 'until': '2020-12-31'}
+        with mock.patch.object(planner, 'estimate_size', return_value=12000):
+            windows, concurrency = planner.plan(self.sickle, params)
+        self.assertEqual(len(windows), 4)
+        self.assertEqual(concurrency, 2)
+        self.assertEqual(windows[0]['from'], '2020-01-01')
+        self.assertEqual(windows[-1]['until'], '2020-12-31')
+        self.assertEqual(self.profile.data['records_per_day'], 12000 / 366.)
+
+    def test_plan_small_harvest(self):
+        planner = HarvestPlanner(self.profile)
+        windows, concurrency = planner.plan(
+            self.sickle, {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'})
+        self.assertEqual(windows, [{'verb': 'ListRecords',
+                                    'metadataPrefix': 'oai_dc'}])
+        self.assertEqual(concurrency, 1)
+
+    def test_cli_auto_partition(self):
+        main(['http://localhost/oai', '-o', self.directory, '-q',
+              '-p', 'auto'])
+        endpoint_dir = os.path.join(self.directory, 'localhost_oai')
+        with open(os.path.join(endpoint_dir, 'state.json')) as fp:
+            run = json.load(fp)['run']
+        self.assertTrue(run['complete'])
+        self.assertEqual([p['name'] for p in run['partitions']], ['all'])
+        self.assertTrue(os.path.exists(
+            os.path.join(endpoint_dir, 'profile.json')))
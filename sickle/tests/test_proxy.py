@@ -0,0 +1,242 @@
+# coding: utf-8
+"""
+    sickle.tests.test_proxy
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from io import BytesIO
+
+import mock
+from lxml import etree
+
+from sickle import Sickle
+from sickle.proxy import OAIProxy, encode_token
+from sickle.response import OAIResponse
+from sickle.tests.test_harvesting import MockResponse, mock_harvest
+
+NS = '{http://www.openarchives.org/OAI/2.0/}'
+
+PAGE = ('<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><ListRecords>'
+        '%s</ListRecords></OAI-PMH>')
+RECORD = ('<record><header%s><identifier>%s</identifier>'
+          '<datestamp>%s</datestamp>%s</header>%s</record>')
+METADATA = ('<metadata><oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/'
+            'OAI/2.0/oai_dc/" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            '<dc:title>%s</dc:title></oai_dc:dc></metadata>')
+
+# identifier, datestamp, sets, deleted
+UPSTREAM = [
+    ('r1', '2020-01-01', ['a'], False),
+    ('r2', '2020-02-01', ['a:b'], False),
+    ('r3', '2020-03-01', ['ab', 'c'], False),
+    ('r4', '2020-04-01', ['c'], True),
+    ('r5', '2020-05-01', [], False),
+]
+
+
+def list_records(records):
+    return PAGE % ''.join(RECORD % (
+        ' status="deleted"' if deleted else '', identifier, datestamp,
+        ''.join('<setSpec>%s</setSpec>' % s for s in sets),
+        '' if deleted else METADATA % identifier)
+        for identifier, datestamp, sets, deleted in records)
+
+
+class TestProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.upstream = list(UPSTREAM)
+        self.requests = []
+        self.patch = mock.patch('sickle.app.Sickle.harvest',
+                                side_effect=self.harvest)
+        self.patch.start()
+        self.proxy = OAIProxy(Sickle('http://localhost'),
+                              os.path.join(self.directory, 'proxy.db'),
+                              page_size=2, base_url='http://proxy/oai')
+
+    def tearDown(self):
+        self.patch.stop()
+        self.proxy.close()
+        shutil.rmtree(self.directory)
+
+    def harvest(self, **kwargs):
+        self.requests.append(kwargs)
+        if kwargs['verb'] != 'ListRecords':
+            return mock_harvest(**kwargs)
+        records = [r for r in self.upstream
+                   if r[1] >= kwargs.get('from', '')]
+        return OAIResponse(MockResponse(list_records(records)), kwargs)
+
+    def get(self, **arguments):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'QUERY_STRING': '&'.join('%s=%s' % item
+                                     for item in sorted(arguments.items())),
+        }
+        status = []
+        body = b''.join(self.proxy(
+            environ, lambda s, headers: status.append(s)))
+        self.assertEqual(status, ['200 OK'])
+        return etree.XML(body)
+
+    def error(self, **arguments):
+        return self.get(**arguments).find(NS + 'error').get('code')
+
+    def identifiers(self, path='//oai:header/oai:identifier/text()',
+                    **arguments):
+        identifiers = []
+        verb = arguments['verb']
+        while True:
+            root = self.get(**arguments)
+            identifiers.extend(root.xpath(
+                path, namespaces={'oai': NS[1:-1]}))
+            token = root.find('%s%s/%sresumptionToken' % (NS, verb, NS))
+            if token is None or not token.text:
+                return identifiers
+            arguments = {'verb': verb, 'resumptionToken': token.text}
+
+    def test_unavailable_before_refresh(self):
+        status = []
+        self.proxy({'REQUEST_METHOD': 'GET', 'QUERY_STRING': 'verb=Identify'},
+                   lambda s, headers: status.append(s))
+        self.assertEqual(status, ['503 Service Unavailable'])
+
+    def test_list_records(self):
+        stats = self.proxy.refresh()
+        self.assertEqual(stats['oai_dc'].rows, 5)
+        root = self.get(verb='ListRecords', metadataPrefix='oai_dc')
+        records = root.findall('%sListRecords/%srecord' % (NS, NS))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0].findtext('.//{http://purl.org/dc/'
+                                             'elements/1.1/}title'), 'r1')
+        token = root.find('%sListRecords/%sresumptionToken' % (NS, NS))
+        self.assertEqual((token.get('completeListSize'), token.get('cursor')),
+                         ('5', '0'))
+        self.assertEqual(self.identifiers(verb='ListRecords',
+                                          metadataPrefix='oai_dc'),
+                         ['r1', 'r2', 'r3', 'r4', 'r5'])
+        # Deleted records are served as headers
+        root = self.get(verb='GetRecord', identifier='r4',
+                        metadataPrefix='oai_dc')
+        header = root.find('%sGetRecord/%srecord/%sheader' % (NS, NS, NS))
+        self.assertEqual(header.get('status'), 'deleted')
+        self.assertIsNone(root.find('.//%smetadata' % NS))
+
+    def test_queries(self):
+        self.proxy.refresh()
+        self.assertEqual(self.identifiers(
+            verb='ListIdentifiers', metadataPrefix='oai_dc',
+            **{'from': '2020-02-01', 'until': '2020-04-01'}),
+            ['r2', 'r3', 'r4'])
+        self.assertEqual(self.identifiers(
+            verb='ListIdentifiers', metadataPrefix='oai_dc', set='a'),
+            ['r1', 'r2'])
+        self.assertEqual(self.identifiers(
+            verb='ListIdentifiers', metadataPrefix='oai_dc', set='c'),
+            ['r3', 'r4'])
+        self.assertEqual(self.error(verb='ListIdentifiers',
+                                    metadataPrefix='oai_dc', set='x'),
+                         'noRecordsMatch')
+
+    def test_incremental_refresh(self):
+        self.proxy.refresh()
+        self.upstream[1] = ('r2', '2020-06-01', ['a:b'], True)
+        self.upstream.append(('r6', '2020-06-01', [], False))
+        token = self.get(verb='ListIdentifiers', metadataPrefix='oai_dc').find(
+            '%sListIdentifiers/%sresumptionToken' % (NS, NS)).text
+        stats = self.proxy.refresh()
+        self.assertEqual(self.requests[-1]['from'], '2020-05-01')
+        self.assertEqual((stats['oai_dc'].rows, stats['oai_dc'].deleted),
+                         (3, 1))
+        root = self.get(verb='ListIdentifiers', resumptionToken=token)
+        self.assertEqual(root.xpath('//oai:header/oai:identifier/text()',
+                                    namespaces={'oai': NS[1:-1]}),
+                         ['r3', 'r4'])
+        header = self.get(verb='GetRecord', identifier='r2',
+                          metadataPrefix='oai_dc').find('.//%sheader' % NS)
+        self.assertEqual(header.get('status'), 'deleted')
+
+    def test_identify_and_formats(self):
+        self.proxy.refresh()
+        identify = self.get(verb='Identify').find(NS + 'Identify')
+        self.assertEqual(identify.findtext(NS + 'baseURL'),
+                         'http://proxy/oai')
+        self.assertEqual(identify.findtext(NS + 'repositoryName'),
+                         'A Test Repository')
+        formats = self.get(verb='ListMetadataFormats').findall(
+            './/%smetadataPrefix' % NS)
+        self.assertEqual([f.text for f in formats], ['oai_dc'])
+        self.assertEqual(self.error(verb='ListMetadataFormats',
+                                    identifier='x'), 'idDoesNotExist')
+        self.assertEqual(len(self.get(verb='ListSets').findall(
+            './/%ssetSpec' % NS)), 2)
+        sets = self.identifiers('//oai:setSpec/text()', verb='ListSets')
+        self.assertEqual(len(sets), 131)
+        self.assertEqual(sets, sorted(sets))
+
+    def test_errors(self):
+        self.proxy.refresh()
+        self.assertEqual(self.error(verb='Foo'), 'badVerb')
+        self.assertEqual(self.error(verb='ListRecords'), 'badArgument')
+        self.assertEqual(self.error(verb='ListRecords', metadataPrefix='x'),
+                         'cannotDisseminateFormat')
+        self.assertEqual(self.error(verb='ListRecords', metadataPrefix='x',
+                                    resumptionToken='abc'), 'badArgument')
+        self.assertEqual(self.error(verb='ListRecords',
+                                    metadataPrefix='oai_dc',
+                                    **{'from': '2020-01'}), 'badArgument')
+        self.assertEqual(self.error(verb='ListRecords',
+                                    resumptionToken='abc'),
+                         'badResumptionToken')
+        token = encode_token('ListIdentifiers', {'metadataPrefix': 'oai_dc'},
+                             'r1', 1, 5)
+        self.assertEqual(self.error(verb='ListRecords',
+                                    resumptionToken=token),
+                         'badResumptionToken')
+        self.assertEqual(self.error(verb='GetRecord', identifier='x',
+                                    metadataPrefix='oai_dc'),
+                         'idDoesNotExist')
+
+    def test_crafted_tokens(self):
+        self.proxy.refresh()
+        for query, last, cursor in (
+                ({'metadataPrefix': ['oai_dc']}, 'r1', 1),
+                ({'metadataPrefix': 'oai_dc', 'from': 5}, 'r1', 1),
+                ({'metadataPrefix': 'oai_dc', 'from': '2020'}, 'r1', 1),
+                ({'metadataPrefix': 'oai_dc', 'foo': 'bar'}, 'r1', 1),
+                ({'from': '2020-01-01'}, 'r1', 1),
+                ({'metadataPrefix': 'oai_dc'}, 1, 1),
+                ({'metadataPrefix': 'oai_dc'}, 'r1', -1)):
+            token = encode_token('ListRecords', query, last, cursor, 5)
+            self.assertEqual(self.error(verb='ListRecords',
+                                        resumptionToken=token),
+                             'badResumptionToken')
+
+    def test_post(self):
+        self.proxy.refresh()
+        body = b'verb=GetRecord&identifier=r1&metadataPrefix=oai_dc'
+        environ = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': len(body),
+                   'wsgi.input': BytesIO(body)}
+        root = etree.XML(b''.join(self.proxy(environ, lambda s, h: None)))
+        self.assertEqual(root.findtext('.//%sidentifier' % NS), 'r1')
+
+    def test_threads(self):
+        self.proxy.refresh()
+        results = []
+
+        def run():
+            results.append(self.identifiers(verb='ListIdentifiers',
+                                            metadataPrefix='oai_dc'))
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [['r1', 'r2', 'r3', 'r4', 'r5']] * 4)
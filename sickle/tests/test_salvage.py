@@ -0,0 +1,174 @@
+# coding: utf-8
+"""
+    sickle.tests.test_salvage
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from sickle import Sickle
+from sickle.response import OAIResponse
+from sickle.salvage import PageSalvager, PageInfo, Quarantine
+from sickle.tests.test_harvesting import MockResponse, mock_harvest
+
+this_dir, this_filename = os.path.split(__file__)
+
+
+def read_sample(filename):
+    with open(os.path.join(this_dir, 'sample_data', filename), 'rb') as fp:
+        return fp.read().decode('utf-8')
+
+
+def damaged_harvest(damaged, times=None):
+    """Return a harvest function that serves the page `damaged` instead of
+    ``ListRecords2.xml`` for the first `times` requests (always if
+    :obj:`None`)."""
+    requests = []
+
+    def harvest(*args, **kwargs):
+        if kwargs.get('resumptionToken') == 'ListRecords2.xml':
+            requests.append(kwargs)
+            if times is None or len(requests) <= times:
+                return OAIResponse(MockResponse(damaged), kwargs)
+        return mock_harvest(*args, **kwargs)
+
+    harvest.requests = requests
+    return harvest
+
+
+class TestSalvage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.quarantine = Quarantine(os.path.join(self.directory, 'q.jsonl'))
+        self.sickle = Sickle('http://localhost', salvager=PageSalvager(
+            max_retries=2, quarantine=self.quarantine))
+
+    def tearDown(self):
+        self.quarantine.close()
+        shutil.rmtree(self.directory)
+
+    def entries(self):
+        with open(self.quarantine.path) as fp:
+            return [json.loads(line) for line in fp]
+
+    def harvest(self, harvest):
+        with mock.patch('sickle.app.Sickle.harvest', harvest):
+            return list(self.sickle.ListRecords(metadataPrefix='oai_dc'))
+
+    def test_intact_pages(self):
+        self.assertEqual(len(self.harvest(mock_harvest)), 8)
+        self.assertEqual(self.quarantine.count, 0)
+
+    def test_refetch_damaged_page(self):
+        harvest = damaged_harvest('broken xml', times=1)
+        self.assertEqual(len(self.harvest(harvest)), 8)
+        self.assertEqual(len(harvest.requests), 2)
+        self.assertEqual(self.quarantine.count, 0)
+
+    def test_salvage_records(self):
+        damaged = read_sample('ListRecords2.xml').replace(
+            '</dc:title>', '</dc:titl')
+        harvest = damaged_harvest(damaged)
+        records = self.harvest(harvest)
+        # The page is requested three times, the malformed record is lost
+        # but the resumption chain is kept
+        self.assertEqual(len(harvest.requests), 3)
+        self.assertEqual(len(records), 7)
+        entries = self.entries()
+        self.assertEqual([e['identifier'] for e in entries],
+                         [None, 'oai:test.example.com:1585322'])
+        self.assertEqual(entries[0]['reason'], 'not well-formed')
+        self.assertEqual(entries[1]['params']['resumptionToken'],
+                         'ListRecords2.xml')
+
+    def test_salvage_namespaces_of_container(self):
+        declarations = (
+            ' xmlns:dc="http://purl.org/dc/elements/1.1/"'
+            ' xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/"')
+        # Declare the namespaces of the metadata on the ListRecords element
+        page = re.sub(r'\s+xmlns:(dc|oai_dc)="[^"]*"', '',
+                      read_sample('ListRecords2.xml'))
+        damaged = page.replace(
+            '<ListRecords>', '<ListRecords%s>' % declarations).replace(
+            '16:31:00Z</datestamp>', '16:31:00Z</datestam')
+        records = self.harvest(damaged_harvest(damaged))
+        self.assertEqual(len(records), 7)
+        self.assertEqual([e['identifier'] for e in self.entries()],
+                         [None, 'oai:test.example.com:1585310'])
+        # The prefixed metadata of the salvaged record is intact
+        salvaged = records[2]
+        self.assertEqual(salvaged.header.identifier,
+                         'oai:test.example.com:1585322')
+        self.assertEqual(salvaged.metadata['title'], ['Sample Title'])
+
+    def test_salvage_default_namespace_marc(self):
+        record = ('<record><header><identifier>%s</identifier>'
+                  '<datestamp>2020-01-01</datestamp></header><metadata>'
+                  '<record xmlns="http://www.loc.gov/MARC21/slim">'
+                  '<leader>00000nam a2200000 a 4500</leader>'
+                  '<datafield tag="245" ind1="0" ind2="0">'
+                  '<subfield code="a">%s</subfield></datafield>'
+                  '</record></metadata></record>')
+        page = ('<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+                '<ListRecords>%s%s%s<resumptionToken>ListRecords3.xml'
+                '</resumptionToken></ListRecords></OAI-PMH>') % (
+            record % ('a', 'A'),
+            (record % ('b', 'B')).replace('</subfield>', '</subfiel'),
+            record % ('c', 'C'))
+        salvaged = PageSalvager(quarantine=self.quarantine).salvage(
+            self.sickle, {'verb': 'ListRecords'},
+            OAIResponse(MockResponse(page), {'verb': 'ListRecords'}))
+        records = salvaged.xml.findall(
+            '{http://www.openarchives.org/OAI/2.0/}ListRecords/'
+            '{http://www.openarchives.org/OAI/2.0/}record')
+        self.assertEqual([r.findtext('.//{http://www.loc.gov/MARC21/slim}'
+                                     'subfield') for r in records],
+                         ['A', 'C'])
+        self.assertEqual([e['identifier'] for e in self.entries()], ['b'])
+
+    def test_unsalvageable_page(self):
+        harvest = damaged_harvest('broken xml')
+        records = self.harvest(harvest)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(self.quarantine.count, 1)
+
+    def test_missing_token(self):
+        salvager = PageSalvager()
+        page = read_sample('ListRecords2.xml')
+        without_token = page.replace(
+            '<resumptionToken completeListSize="8" cursor="0">'
+            'ListRecords3.xml</resumptionToken>', '')
+        response = OAIResponse(MockResponse(without_token), {})
+        damage, info = salvager.inspect(self.sickle, 'ListRecords', response,
+                                        PageInfo(0, 2, 8, True))
+        self.assertEqual(damage, 'missing resumption token')
+        self.assertEqual(info, PageInfo(None, 2, None, False))
+        # The last page of the list
+        damage, _ = salvager.inspect(self.sickle, 'ListRecords', response,
+                                     PageInfo(4, 2, 8, True))
+        self.assertEqual(damage, None)
+        # Servers that do not maintain the cursor
+        damage, _ = salvager.inspect(self.sickle, 'ListRecords', response,
+                                     PageInfo(0, 2, 8, False))
+        self.assertEqual(damage, None)
+
+    def test_count_on_last_page(self):
+        salvager = PageSalvager()
+        page = read_sample('ListRecords2.xml').replace(
+            '<resumptionToken completeListSize="8" cursor="0">'
+            'ListRecords3.xml</resumptionToken>',
+            '<resumptionToken completeListSize="8" cursor="5"/>')
+        response = OAIResponse(MockResponse(page), {})
+        damage, info = salvager.inspect(self.sickle, 'ListRecords', response,
+                                        PageInfo(2, 3, 8, True))
+        self.assertEqual(damage, '2 items on the last page, expected 3')
+        self.assertEqual(info, PageInfo(5, 2, 8, True))
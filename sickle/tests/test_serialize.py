@@ -0,0 +1,103 @@
+# coding: utf-8
+"""
+    sickle.tests.test_serialize
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import unittest
+
+import mock
+from nose.tools import raises
+
+from sickle import Sickle
+from sickle import serialize
+from sickle.models import Header, Record, Set, MetadataFormat
+from sickle.serialize import encode, decode, _pack, _unpack
+from sickle.tests.test_harvesting import mock_harvest
+
+
+class TestSerialize(unittest.TestCase):
+
+    def setUp(self):
+        self.patch = mock.patch('sickle.app.Sickle.harvest', mock_harvest)
+        self.patch.start()
+        self.sickle = Sickle('http://localhost')
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_record(self):
+        record = self.sickle.GetRecord(
+            identifier='oai:test.example.com:1996652', metadataPrefix='oai_dc')
+        decoded = decode(encode(record))
+        self.assertIsInstance(decoded, Record)
+        self.assertEqual(decoded.metadata, record.metadata)
+        self.assertEqual(dict(decoded.header), dict(record.header))
+        self.assertFalse(decoded.deleted)
+        self.assertIsNone(decoded.xml)
+        self.assertIsNone(decoded.raw)
+        self.assertEqual(str(decoded),
+                         '<Record oai:test.example.com:1996652>')
+        self.assertEqual(decoded._oai_namespace, record._oai_namespace)
+        self.assertEqual(decoded._strip_ns, record._strip_ns)
+
+        decoded = decode(encode(record, raw=True))
+        self.assertEqual(decoded.raw, record.raw)
+        self.assertEqual(decoded.xml.tag, record.xml.tag)
+        self.assertEqual(str(decoded), str(record))
+        self.assertEqual(decoded.get_metadata(), record.metadata)
+        # Decoded items can be encoded again
+        self.assertEqual(decode(encode(decoded, raw=True)).raw, record.raw)
+
+    def test_deleted_record_and_header(self):
+        record = next(iter(self.sickle.ListRecords(metadataPrefix='oai_dc')))
+        decoded = decode(encode(record))
+        self.assertTrue(decoded.deleted)
+        self.assertFalse(hasattr(decoded, 'metadata'))
+        header = next(iter(self.sickle.ListIdentifiers(
+            metadataPrefix='oai_dc')))
+        decoded = decode(encode(header))
+        self.assertIsInstance(decoded, Header)
+        self.assertEqual(dict(decoded), dict(header))
+        self.assertEqual(decoded.deleted, header.deleted)
+
+    def test_set_and_metadata_format(self):
+        oai_set = next(iter(self.sickle.ListSets()))
+        decoded = decode(encode(oai_set))
+        self.assertIsInstance(decoded, Set)
+        self.assertEqual(decoded.setName, oai_set.setName)
+        self.assertEqual(dict(decoded), dict(oai_set))
+        mdf = next(iter(self.sickle.ListMetadataFormats()))
+        decoded = decode(encode(mdf))
+        self.assertIsInstance(decoded, MetadataFormat)
+        self.assertEqual(decoded.metadataPrefix, mdf.metadataPrefix)
+
+    def test_msgpack_subset(self):
+        values = [None, True, False, 0, 127, 128, 65536, 2 ** 40, -1, -33,
+                  -2 ** 40, 1.5, u'', u'ä' * 40, u'x' * 70000, b'\x00' * 300,
+                  list(range(20)), dict((str(i), i) for i in range(20))]
+        parts = []
+        _pack(values, parts)
+        data = b''.join(parts)
+        self.assertEqual(_unpack(data, 0), (values, len(data)))
+        # Known encodings from the MessagePack specification
+        parts = []
+        _pack({u'a': [1, None, u'b']}, parts)
+        self.assertEqual(b''.join(parts), b'\x81\xa1a\x93\x01\xc0\xa1b')
+
+    def test_fallback_matches(self):
+        header = next(iter(self.sickle.ListIdentifiers(
+            metadataPrefix='oai_dc')))
+        with mock.patch.object(serialize, 'msgpack', None):
+            data = encode(header, raw=True)
+            self.assertEqual(decode(data).raw, decode(encode(header, True)).raw)
+
+    @raises(ValueError)
+    def test_unknown_version(self):
+        data = encode(next(iter(self.sickle.ListSets())))
+        decode(data[:3] + b'\x09' + data[4:])
+
+    @raises(ValueError)
+    def test_not_encoded(self):
+        decode(b'<record/>')
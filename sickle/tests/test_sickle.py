@@ -6,6 +6,10 @@
     :copyright: Copyright 2015 Mathias Loesch
 """
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 
 from mock import patch, Mock
@@ -13,6 +17,7 @@ from nose.tools import raises
 from requests import HTTPError
 
 from sickle import Sickle
+from sickle.cache import ValidatorStore, FileValidatorStore
 
 this_dir, this_filename = os.path.split(__file__)
 
@@ -26,6 +31,21 @@ class TestCase(unittest.TestCase):
     def test_wrong_protocol_version(self):
         Sickle("http://localhost", protocol_version="3.0")
 
+    def test_lazy_import(self):
+        if sys.version_info < (3, 7):
+            return
+        script = ("import sys, sickle; "
+                  "assert 'requests' not in sys.modules; "
+                  "assert 'sickle.app' not in sys.modules; "
+                  "sickle.Sickle('url'); "
+                  "assert 'requests' not in sys.modules")
+        subprocess.check_call([sys.executable, '-c', script],
+                              cwd=os.path.dirname(os.path.dirname(this_dir)))
+
+    @raises(ValueError)
+    def test_invalid_parser_mode(self):
+        Sickle("http://localhost", parser_mode="lenient")
+
     @raises(TypeError)
     def test_invalid_iterator(self):
         Sickle("http://localhost", iterator=None)
@@ -83,6 +103,36 @@ class TestCase(unittest.TestCase):
                 self.assertEqual(3, sleep_mock.call_count)
                 sleep_mock.assert_called_with(10)
 
+    def test_retry_after_applies_to_new_requests(self):
+        mock_response = Mock(status_code=503,
+                             headers={'retry-after': '10'},
+                             raise_for_status=Mock(side_effect=HTTPError))
+        sleep_mock = Mock()
+        with patch('time.sleep', sleep_mock):
+            with patch('sickle.app.requests.get',
+                       Mock(return_value=mock_response)):
+                sickle = Sickle('url', max_retries=1)
+                try:
+                    sickle.ListRecords()
+                except HTTPError:
+                    pass
+                sleep_mock.reset_mock()
+                # Another thread starting a request waits as well
+                try:
+                    sickle.ListSets()
+                except HTTPError:
+                    pass
+                delay = sleep_mock.call_args_list[0][0][0]
+                self.assertTrue(9 < delay <= 10)
+
+    def test_pooled_session(self):
+        with patch('sickle.app.requests.Session') as session_class:
+            sickle = Sickle('url', pool_maxsize=4)
+            self.assertIs(sickle._requester(), sickle._requester())
+            self.assertEqual(session_class.call_count, 1)
+            sickle.close()
+            session_class.return_value.close.assert_called_once_with()
+
     def test_retry_on_custom_code(self):
         mock_response = Mock(status_code=500,
                              raise_for_status=Mock(side_effect=HTTPError))
@@ -96,3 +146,84 @@ class TestCase(unittest.TestCase):
             mock_get.assert_called_with('url',
                                         params={'verb': 'ListRecords'})
             self.assertEqual(4, mock_get.call_count)
+
+    def test_conditional_request(self):
+        full_response = Mock(status_code=200, content=b'<xml/>',
+                             text=u'<xml/>', encoding='utf-8',
+                             headers={'ETag': '"abc"'})
+        not_modified = Mock(status_code=304, content=b'', text=u'',
+                            encoding=None, headers={})
+        mock_get = Mock(side_effect=[full_response, not_modified])
+        with patch('sickle.app.requests.get', mock_get):
+            sickle = Sickle('url', validator_store=ValidatorStore())
+            sickle.harvest(verb='ListSets')
+            mock_get.assert_called_with('url', params={'verb': 'ListSets'})
+            response = sickle.harvest(verb='ListSets')
+            mock_get.assert_called_with(
+                'url', params={'verb': 'ListSets'},
+                headers={'If-None-Match': '"abc"'})
+            self.assertEqual(response.raw, u'<xml/>')
+
+    def test_not_modified_without_cached_response(self):
+        store = ValidatorStore()
+        store.set(store.make_key('url', {'verb': 'ListSets'}),
+                  {'etag': '"abc"', 'content': b'<xml/>', 'encoding': None})
+        not_modified = Mock(status_code=304, content=b'', text=u'',
+                            encoding=None, headers={})
+        full_response = Mock(status_code=200, content=b'<new/>',
+                             text=u'<new/>', encoding='utf-8',
+                             headers={'ETag': '"def"'})
+        mock_get = Mock(side_effect=[not_modified, full_response])
+        with patch('sickle.app.requests.get', mock_get), \
+                patch.object(store, 'cached_response', return_value=None):
+            sickle = Sickle('url', validator_store=store)
+            response = sickle.harvest(verb='ListSets')
+        # The request is sent again without conditional headers
+        mock_get.assert_called_with('url', params={'verb': 'ListSets'})
+        self.assertEqual(response.raw, u'<new/>')
+        self.assertEqual(store.get(store.make_key(
+            'url', {'verb': 'ListSets'}))['etag'], '"def"')
+
+    def test_conditional_request_only_for_stable_verbs(self):
+        store = ValidatorStore()
+        store.set(store.make_key('url', {'verb': 'ListRecords'}),
+                  {'etag': '"abc"', 'content': b'<xml/>', 'encoding': None})
+        mock_response = Mock(text=u'<xml/>', content=b'<xml/>',
+                             status_code=200)
+        mock_get = Mock(return_value=mock_response)
+        with patch('sickle.app.requests.get', mock_get):
+            sickle = Sickle('url', validator_store=store)
+            sickle.harvest(verb='ListRecords')
+            mock_get.assert_called_once_with('url',
+                                             params={'verb': 'ListRecords'})
+
+    def test_file_validator_store(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store = FileValidatorStore(directory)
+            key = store.make_key('url', {'verb': 'Identify'})
+            store.set(key, {'etag': None, 'last_modified': 'yesterday',
+                            'content': b'<xml/>', 'encoding': 'utf-8'})
+            store = FileValidatorStore(directory)
+            self.assertEqual(store.conditional_headers(key),
+                             {'If-Modified-Since': 'yesterday'})
+            self.assertEqual(store.cached_response(key).text, u'<xml/>')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_file_validator_store_single_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store = FileValidatorStore(directory)
+            key = store.make_key('url', {'verb': 'Identify'})
+            store.set(key, {'etag': '"1"', 'last_modified': None,
+                            'content': b'<old/>\n', 'encoding': None})
+            store.set(key, {'etag': '"2"', 'last_modified': None,
+                            'content': b'<new/>\n', 'encoding': None})
+            # Validators and body are replaced together in one file
+            self.assertEqual(len(os.listdir(directory)), 1)
+            entry = store.get(key)
+            self.assertEqual(entry['etag'], '"2"')
+            self.assertEqual(entry['content'], b'<new/>\n')
+        finally:
+            shutil.rmtree(directory)
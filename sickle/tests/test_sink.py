@@ -0,0 +1,175 @@
+# coding: utf-8
+"""
+    sickle.tests.test_sink
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from sickle import Sickle
+from sickle.sink import SQLiteSink
+from sickle.tests.test_harvesting import mock_harvest
+
+
+class FakeHeader(object):
+
+    def __init__(self, identifier, datestamp, deleted=False, setSpecs=()):
+        self.identifier = identifier
+        self.datestamp = datestamp
+        self.deleted = deleted
+        self.setSpecs = list(setSpecs)
+
+
+class FakeRecord(object):
+
+    def __init__(self, header, metadata):
+        self.header = header
+        self.deleted = header.deleted
+        self.metadata = metadata
+        self.raw = u'<record>%s</record>' % header.identifier
+
+
+class TestSQLiteSink(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'records.db')
+        self.sink = SQLiteSink(self.path, fields=['title', 'dc:date'],
+                               batch_size=2)
+
+    def tearDown(self):
+        self.sink.close()
+        shutil.rmtree(self.directory)
+
+    def select(self, query):
+        return self.sink.connection.execute(query).fetchall()
+
+    def test_upserts_and_tombstones(self):
+        stats = self.sink.consume([
+            FakeRecord(FakeHeader('a', '2020-01-01', setSpecs=['x', 'y']),
+                       {'title': [u'A', u'Ä'], 'dc:date': ['2019']}),
+            FakeHeader('b', '2020-01-01'),
+            FakeRecord(FakeHeader('c', '2020-01-01'), {}),
+        ])
+        self.assertEqual((stats.rows, stats.deleted), (3, 0))
+        self.assertEqual(self.select(
+            'SELECT identifier, setSpecs, md_title, md_dc_date, raw IS NULL '
+            'FROM records ORDER BY identifier'), [
+            ('a', 'x y', u'A\nÄ', '2019', 0),
+            ('b', None, None, None, 1),
+            ('c', None, None, None, 0)])
+        self.assertEqual(self.sink.raw('a'), u'<record>a</record>')
+        stats = self.sink.consume([
+            FakeRecord(FakeHeader('a', '2020-02-01'), {'title': [u'B']}),
+            FakeRecord(FakeHeader('c', '2020-02-01', deleted=True), {}),
+            FakeHeader(None, '2020-02-01'),
+        ])
+        self.assertEqual((stats.rows, stats.deleted, stats.skipped),
+                         (2, 1, 1))
+        self.assertEqual(len(self.sink), 3)
+        self.assertEqual(self.sink.get('a'), ('2020-02-01', False))
+        self.assertEqual(self.sink.get('c'), ('2020-02-01', True))
+        self.assertIsNone(self.sink.raw('c'))
+        self.assertEqual(self.select(
+            "SELECT md_title FROM records WHERE identifier = 'a'"), [('B',)])
+        self.assertEqual(self.sink.latest_datestamp(), '2020-02-01')
+
+    def test_remove_deleted(self):
+        sink = SQLiteSink(os.path.join(self.directory, 'other.db'),
+                          keep_tombstones=False)
+        sink.consume([FakeHeader('a', '2020-01-01'),
+                      FakeHeader('a', '2020-02-01', deleted=True),
+                      FakeHeader('b', '2020-01-01', deleted=True),
+                      FakeHeader('b', '2020-02-01')])
+        self.assertNotIn('a', sink)
+        self.assertEqual(sink.get('b'), ('2020-02-01', False))
+        sink.close()
+
+    def test_add_fields(self):
+        self.sink.consume([FakeRecord(FakeHeader('a', '2020-01-01'),
+                                      {'title': [u'A']})])
+        self.sink.close()
+        self.sink = SQLiteSink(self.path, fields=['title', 'creator'])
+        self.sink.consume([FakeRecord(FakeHeader('b', '2020-01-01'),
+                                      {'creator': [u'B']})])
+        self.assertEqual(self.select(
+            'SELECT identifier, md_title, md_creator FROM records '
+            'ORDER BY identifier'), [('a', 'A', None), ('b', None, 'B')])
+
+    def test_partial_updates(self):
+        self.sink.consume([FakeRecord(FakeHeader('a', '2020-01-01'),
+                                      {'title': [u'A'], 'dc:date': ['2019']})])
+        # Headers keep the raw XML and metadata
+        self.sink.consume([FakeHeader('a', '2020-02-01', setSpecs=['x'])])
+        self.assertEqual(self.sink.raw('a'), u'<record>a</record>')
+        self.assertEqual(self.select(
+            'SELECT datestamp, setSpecs, md_title FROM records'),
+            [('2020-02-01', 'x', 'A')])
+        # Columns of other fields are kept
+        self.sink.close()
+        self.sink = SQLiteSink(self.path, fields=['title'])
+        self.sink.consume([FakeRecord(FakeHeader('a', '2020-03-01'),
+                                      {'title': [u'B']})])
+        self.assertEqual(self.select(
+            'SELECT md_title, md_dc_date FROM records'), [('B', '2019')])
+        # Deletions clear all of them
+        self.sink.consume([FakeHeader('a', '2020-04-01', deleted=True)])
+        self.assertEqual(self.select(
+            'SELECT deleted, raw, md_title, md_dc_date FROM records'),
+            [(1, None, None, None)])
+
+    def test_structured_values(self):
+        sink = SQLiteSink(os.path.join(self.directory, 'other.db'),
+                          fields=['leader', 'creators', 'datafields'])
+        sink.consume([FakeRecord(FakeHeader('a', '2020-01-01'), {
+            'leader': '00000nam a2200000 a 4500',
+            'creators': [{'creatorName': ['Doe, Jane']}],
+            'datafields': {'245': [{'subfields': {'a': ['Title']}}]}})])
+        leader, creators, datafields = sink.connection.execute(
+            'SELECT md_leader, md_creators, md_datafields '
+            'FROM records').fetchone()
+        sink.close()
+        self.assertEqual(leader, '00000nam a2200000 a 4500')
+        self.assertEqual(json.loads(creators),
+                         [{'creatorName': ['Doe, Jane']}])
+        self.assertEqual(json.loads(datafields),
+                         {'245': [{'subfields': {'a': ['Title']}}]})
+
+    def test_column_collision(self):
+        self.assertRaises(ValueError, SQLiteSink, self.path,
+                          fields=['dc:date', 'dc_date'])
+
+    def test_consume_list_records(self):
+        with mock.patch('sickle.app.Sickle.harvest', mock_harvest):
+            records = Sickle('http://localhost').ListRecords(
+                metadataPrefix='oai_dc')
+            stats = self.sink.consume(records)
+        self.assertEqual((stats.rows, stats.deleted, stats.skipped),
+                         (7, 3, 1))
+        self.assertEqual(len(self.sink), 2)
+        self.assertGreater(stats.rows_per_second, 0)
+        self.assertTrue(self.sink.get('oai:test.example.com:1585310')[1])
+        self.assertIn('dc:title', self.sink.raw(
+            'oai:test.example.com:1585322'))
+
+    def test_invalid_table(self):
+        self.assertRaises(ValueError, SQLiteSink, self.path,
+                          table='records; DROP TABLE x')
+
+
+class TestSQLiteSinkWithoutUpserts(TestSQLiteSink):
+    """Runs the tests with the fallback for SQLite versions before 3.24."""
+
+    def setUp(self):
+        patch = mock.patch('sickle.sink._NATIVE_UPSERT', False)
+        patch.start()
+        self.addCleanup(patch.stop)
+        super(TestSQLiteSinkWithoutUpserts, self).setUp()
+        self.assertIsInstance(self.sink._upsert, tuple)
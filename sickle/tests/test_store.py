@@ -0,0 +1,98 @@
+# coding: utf-8
+"""
+    sickle.tests.test_store
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from sickle import Sickle
+from sickle.iterator import OAIResponseIterator
+from sickle.store import PageStore, _INDEX_ENTRY
+from sickle.tests.test_harvesting import mock_harvest
+
+
+class TestPageStore(unittest.TestCase):
+
+    def setUp(self):
+        self.patch = mock.patch('sickle.app.Sickle.harvest', mock_harvest)
+        self.patch.start()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'pages')
+        self.store = PageStore(self.path)
+        self.sickle = Sickle('http://localhost')
+        responses = Sickle('http://localhost', iterator=OAIResponseIterator)
+        for response in responses.ListRecords(metadataPrefix='oai_dc'):
+            self.store.add(response)
+
+    def tearDown(self):
+        self.store.close()
+        self.patch.stop()
+        shutil.rmtree(self.directory)
+
+    def test_pages(self):
+        self.assertEqual(len(self.store), 4)
+        page = self.store.page(1)
+        self.assertIsInstance(page, memoryview)
+        with open(os.path.join(os.path.dirname(__file__), 'sample_data',
+                               'ListRecords2.xml'), 'rb') as fp:
+            self.assertEqual(page.tobytes(), fp.read())
+        self.assertEqual(len(list(self.store.pages(start=2))), 2)
+
+    def test_replay(self):
+        live = list(self.sickle.ListRecords(metadataPrefix='oai_dc'))
+        for _ in range(2):
+            replayed = list(self.store.replay(self.sickle, 'ListRecords'))
+            self.assertEqual([r.raw for r in replayed], [r.raw for r in live])
+            self.assertEqual([type(r) for r in replayed],
+                             [type(r) for r in live])
+
+    def test_replay_ignore_deleted(self):
+        records = list(self.store.replay(self.sickle, 'ListRecords',
+                                         ignore_deleted=True))
+        self.assertEqual(len(records), 4)
+
+    def test_replay_interrupted_harvest(self):
+        self.store.close()
+        # Keep the index entries of the first two pages
+        with open(self.path + '.idx', 'r+b') as fp:
+            fp.truncate(2 * _INDEX_ENTRY.size)
+        self.store = PageStore(self.path)
+        with mock.patch('sickle.store.logger') as logger:
+            records = list(self.store.replay(self.sickle, 'ListRecords'))
+        self.assertEqual(len(records), 4)
+        self.assertIn('Page 2 (resumption token ListRecords3.xml)',
+                      logger.warning.call_args[0][0])
+        self.assertEqual(list(self.store.replay(self.sickle, start=2)), [])
+
+    def test_reopen(self):
+        self.store.close()
+        self.store = PageStore(self.path)
+        self.assertEqual(len(self.store), 4)
+        self.store.append(b'<extra/>')
+        self.assertEqual(self.store.page(4).tobytes(), b'<extra/>')
+        self.assertIn(b'ListRecords', self.store.page(3).tobytes())
+
+    def test_incomplete_write_is_discarded(self):
+        self.store.close()
+        with open(self.path, 'ab') as fp:
+            fp.write(b'<incomplete')
+        with open(self.path + '.idx', 'ab') as fp:
+            fp.write(b'\x00\x01')
+        self.store = PageStore(self.path)
+        self.assertEqual(len(self.store), 4)
+        self.store.append(b'<next/>')
+        self.store.close()
+        self.store = PageStore(self.path)
+        self.assertEqual(self.store.page(4).tobytes(), b'<next/>')
+
+    def test_response_text(self):
+        response = self.store.response(0)
+        self.assertIn(u'<ListRecords>', response.raw)
+        self.assertEqual(len(response.xml), 3)
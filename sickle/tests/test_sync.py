@@ -0,0 +1,122 @@
+# coding: utf-8
+"""
+    sickle.tests.test_sync
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from sickle import Sickle
+from sickle.sync import IdentifierIndex, sync, NEW, CHANGED, DELETED, \
+    REMOVED
+from sickle.tests.test_harvesting import mock_harvest
+
+
+class FakeHeader(object):
+
+    def __init__(self, identifier, datestamp, deleted=False):
+        self.identifier = identifier
+        self.datestamp = datestamp
+        self.deleted = deleted
+
+
+class TestSync(unittest.TestCase):
+
+    def setUp(self):
+        self.patch = mock.patch('sickle.app.Sickle.harvest', mock_harvest)
+        self.patch.start()
+        self.sickle = Sickle('http://localhost')
+        self.directory = tempfile.mkdtemp()
+        self.index = IdentifierIndex(os.path.join(self.directory, 'index.db'))
+
+    def tearDown(self):
+        self.patch.stop()
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def test_diff(self):
+        self.index.stage([FakeHeader('a', '2020-01-01'),
+                          FakeHeader('b', '2020-01-01'),
+                          FakeHeader('c', '2020-01-01')])
+        self.index.commit()
+        self.index.stage([FakeHeader('a', '2020-01-01'),
+                          FakeHeader('b', '2020-02-01'),
+                          FakeHeader('d', '2020-02-01'),
+                          FakeHeader('e', '2020-02-01', deleted=True)])
+        diff = self.index.diff()
+        self.assertEqual(diff.new, ['d'])
+        self.assertEqual(diff.changed, ['b'])
+        self.assertEqual(diff.deleted, [])
+        self.assertEqual(diff.removed, ['c'])
+        self.assertEqual(self.index.diff(complete=False).removed, [])
+        self.index.commit()
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.get('e'), ('2020-02-01', True))
+
+    def test_sync(self):
+        self.index.stage([
+            FakeHeader('oai:test.example.com::1585310', '2010-01-01'),
+            FakeHeader('oai:test.example.com::1585576', '2011-08-10T16:22:00Z'),
+            FakeHeader('gone', '2010-01-01')])
+        self.index.commit()
+        results = list(sync(self.sickle, self.index, metadataPrefix='oai_dc'))
+        statuses = [(status, identifier) for status, identifier, _ in results]
+        self.assertEqual(statuses, [
+            (DELETED, 'oai:test.example.com::1585576'),
+            (REMOVED, 'gone'),
+            (CHANGED, 'oai:test.example.com::1585310')])
+        self.assertIsNotNone(results[-1][2])
+        self.assertEqual(self.index.get('oai:test.example.com::1585310'),
+                         ('2011-07-18T16:31:00Z', False))
+        self.assertIsNone(self.index.get('gone'))
+
+    def test_sync_new_index(self):
+        results = list(sync(self.sickle, self.index, metadataPrefix='oai_dc'))
+        self.assertEqual([(s, i) for s, i, _ in results],
+                         [(NEW, 'oai:test.example.com::1585310')])
+        self.assertEqual(list(sync(self.sickle, self.index,
+                                   metadataPrefix='oai_dc')), [])
+
+    def test_get_record_arguments(self):
+        harvest = mock.Mock(side_effect=mock_harvest)
+        with mock.patch('sickle.app.Sickle.harvest', harvest):
+            list(sync(self.sickle, self.index, metadataPrefix='oai_dc',
+                      set='a', **{'from': '2010-01-01'}))
+        self.assertEqual(harvest.call_args_list[-1][1], {
+            'verb': 'GetRecord', 'metadataPrefix': 'oai_dc',
+            'identifier': 'oai:test.example.com::1585310'})
+
+    def test_list_records_from_granularity(self):
+        harvest = mock.Mock(side_effect=mock_harvest)
+        with mock.patch('sickle.app.Sickle.harvest', harvest):
+            results = list(sync(self.sickle, self.index,
+                                list_records_threshold=1,
+                                metadataPrefix='oai_dc'))
+        self.assertEqual(len(results), 1)
+        # The repository has day granularity
+        list_records = [c[1] for c in harvest.call_args_list
+                        if c[1]['verb'] == 'ListRecords']
+        self.assertEqual(list_records[0]['from'], '2011-07-18')
+
+    def test_set_is_partial(self):
+        self.index.stage([FakeHeader('other', '2010-01-01')])
+        self.index.commit()
+        results = list(sync(self.sickle, self.index, metadataPrefix='oai_dc',
+                            set='a'))
+        self.assertEqual([(s, i) for s, i, _ in results],
+                         [(NEW, 'oai:test.example.com::1585310')])
+        # Identifiers outside the set are kept
+        self.assertEqual(self.index.get('other'), ('2010-01-01', False))
+
+    def test_client_iterator(self):
+        list_identifiers = mock.Mock(wraps=self.sickle.ListIdentifiers)
+        with mock.patch.object(self.sickle, 'ListIdentifiers',
+                               list_identifiers):
+            list(sync(self.sickle, self.index, metadataPrefix='oai_dc'))
+        list_identifiers.assert_called_once_with(metadataPrefix='oai_dc')
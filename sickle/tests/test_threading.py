@@ -0,0 +1,161 @@
+# coding: utf-8
+"""
+    sickle.tests.test_threading
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Stress tests for sharing one :class:`sickle.app.Sickle` between threads,
+    run against a local HTTP server.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import copy
+import os
+import pickle
+import threading
+import time
+import unittest
+
+try:  # pragma: no cover
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+from sickle import Sickle
+
+this_dir, this_filename = os.path.split(__file__)
+
+# Simulated server latency per page in seconds
+LATENCY = 0.05
+
+
+class OAIRequestHandler(BaseHTTPRequestHandler):
+    """Serves the sample ListRecords pages; the resumption tokens are the
+    file names of the next pages.
+
+    The handler counts the requests in progress and records the largest
+    number of overlapping requests in `peak`."""
+
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        filename = params.get('resumptionToken', ['ListRecords.xml'])[0]
+        with open(os.path.join(this_dir, 'sample_data', filename),
+                  'rb') as fp:
+            content = fp.read()
+        cls = OAIRequestHandler
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        try:
+            time.sleep(LATENCY)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+
+class TestSharedSickle(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingServer(('127.0.0.1', 0), OAIRequestHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever)
+        cls.server_thread.daemon = True
+        cls.server_thread.start()
+        cls.endpoint = 'http://127.0.0.1:%d/oai' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def harvest_in_threads(self, sickle, threads):
+        """Run one ListRecords iterator per thread and return the
+        identifiers harvested by each thread and the largest number of
+        requests the server has handled at the same time."""
+        results = [None] * threads
+        errors = []
+
+        def harvest(number):
+            try:
+                results[number] = [
+                    record.header.identifier for record in
+                    sickle.ListRecords(metadataPrefix='oai_dc')]
+            except Exception as error:
+                errors.append(error)
+
+        workers = [threading.Thread(target=harvest, args=(number,))
+                   for number in range(threads)]
+        with OAIRequestHandler.lock:
+            OAIRequestHandler.peak = 0
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        return results, OAIRequestHandler.peak
+
+    def test_shared_client(self):
+        sickle = Sickle(self.endpoint, pool_maxsize=8)
+        try:
+            expected, _ = self.harvest_in_threads(sickle, 1)
+            self.assertEqual(len(expected[0]), 8)
+            results, _ = self.harvest_in_threads(sickle, 8)
+            self.assertEqual(results, expected * 8)
+        finally:
+            sickle.close()
+
+    def test_scaling(self):
+        sickle = Sickle(self.endpoint, pool_maxsize=16)
+        try:
+            _, single = self.harvest_in_threads(sickle, 1)
+            peaks = {}
+            for threads in (2, 4, 8, 16):
+                _, peaks[threads] = self.harvest_in_threads(sickle, threads)
+        finally:
+            sickle.close()
+        self.assertEqual(single, 1)
+        # The requests of the threads are not serialized by the shared
+        # client. Each request takes LATENCY seconds on the server, so the
+        # threads overlap unless they wait for each other.
+        for threads, peak in sorted(peaks.items()):
+            self.assertGreaterEqual(peak, max(2, threads // 2),
+                                    '%d threads, at most %d concurrent '
+                                    'requests' % (threads, peak))
+
+    def test_copy_and_pickle(self):
+        sickle = Sickle(self.endpoint, pool_maxsize=4)
+        try:
+            self.harvest_in_threads(sickle, 1)
+            clone = copy.copy(sickle)
+            self.assertIs(clone._lock, sickle._lock)
+            self.assertIs(clone._requester(), sickle._requester())
+            restored = pickle.loads(pickle.dumps(sickle))
+        finally:
+            sickle.close()
+        try:
+            self.assertEqual(restored.endpoint, sickle.endpoint)
+            self.assertEqual(restored.pool_maxsize, 4)
+            results, _ = self.harvest_in_threads(restored, 2)
+            self.assertEqual([len(r) for r in results], [8, 8])
+        finally:
+            restored.close()
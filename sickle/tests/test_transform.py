@@ -0,0 +1,120 @@
+# coding: utf-8
+"""
+    sickle.tests.test_transform
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+from lxml import etree
+
+from sickle import Sickle
+from sickle.iterator import OAIResponseIterator, OAIBatchIterator
+from sickle.transform import XSLTStage, get_transform
+from sickle.tests.test_harvesting import mock_harvest
+
+STYLESHEET = b'''<xsl:stylesheet version="1.0"
+    xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
+    xmlns:oai="http://www.openarchives.org/OAI/2.0/"
+    xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <xsl:param name="source" select="'unknown'"/>
+  <xsl:template match="/">
+    <items source="{$source}">
+      <xsl:for-each select="//oai:record[oai:metadata]">
+        <item id="{oai:header/oai:identifier}">
+          <xsl:value-of select="count(.//dc:title)"/>
+        </item>
+      </xsl:for-each>
+    </items>
+  </xsl:template>
+</xsl:stylesheet>'''
+
+IDS = ['oai:test.example.com:1585322'] * 4
+
+
+class TestXSLTStage(unittest.TestCase):
+
+    def setUp(self):
+        self.patch = mock.patch('sickle.app.Sickle.harvest', mock_harvest)
+        self.patch.start()
+        self.sickle = Sickle('http://localhost')
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def records(self):
+        return self.sickle.ListRecords(metadataPrefix='oai_dc',
+                                       ignore_deleted=True)
+
+    def ids(self, results):
+        return [item.get('id') for result in results
+                for item in result.getroot()]
+
+    def test_records(self):
+        stage = XSLTStage(STYLESHEET, source='test')
+        results = list(stage(self.records()))
+        self.assertEqual(self.ids(results), IDS)
+        self.assertEqual(results[0].getroot().get('source'), 'test')
+        self.assertEqual(results[0].getroot()[0].text, '1')
+
+    def test_pages(self):
+        stage = XSLTStage(STYLESHEET, serialize=True)
+        responses = OAIResponseIterator(self.sickle, {
+            'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'})
+        results = list(stage(responses))
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(isinstance(r, bytes) for r in results))
+        self.assertEqual(self.ids(etree.ElementTree(etree.XML(r))
+                                  for r in results), IDS)
+        batches = OAIBatchIterator(self.sickle, {
+            'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'})
+        self.assertEqual(list(stage(batches)), results)
+
+    def test_threads(self):
+        stage = XSLTStage(STYLESHEET, workers=3)
+        records = list(self.records())
+        self.assertEqual(self.ids(stage(records)), IDS)
+        # The records are untouched
+        self.assertEqual(len(records[0].xml.getparent()), 3)
+
+    def test_executor_created_lazily(self):
+        stage = XSLTStage(STYLESHEET, workers=2)
+        with mock.patch('concurrent.futures.ThreadPoolExecutor') as executor:
+            results = stage(self.records())
+            self.assertFalse(executor.called)
+            del results
+
+    def test_processes(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'stylesheet.xsl')
+            with open(path, 'wb') as fp:
+                fp.write(STYLESHEET)
+            stage = XSLTStage(path, workers=2, processes=True, source='p')
+            results = list(stage(self.records()))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(self.ids(results), IDS)
+        self.assertEqual(results[0].getroot().get('source'), 'p')
+
+    def test_compiled_once_per_thread(self):
+        transform = get_transform(STYLESHEET)
+        self.assertIs(get_transform(STYLESHEET), transform)
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(get_transform(STYLESHEET)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], transform)
+
+    def test_invalid_stylesheet(self):
+        self.assertRaises(etree.XSLTParseError, XSLTStage,
+                          b'<xsl:stylesheet version="1.0" xmlns:xsl='
+                          b'"http://www.w3.org/1999/XSL/Transform">'
+                          b'<xsl:foo/></xsl:stylesheet>')
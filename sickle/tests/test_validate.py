@@ -0,0 +1,151 @@
+# coding: utf-8
+"""
+    sickle.tests.test_validate
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from sickle import Sickle
+from sickle.response import OAIResponse
+from sickle.tests.test_harvesting import MockResponse
+from sickle.validate import SchemaCache, MetadataValidator, ValidationStats
+
+# A reduced OAI-PMH schema for ListRecords responses
+OAI_XSD = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    targetNamespace="http://www.openarchives.org/OAI/2.0/"
+    elementFormDefault="qualified">
+  <xs:element name="OAI-PMH"><xs:complexType><xs:sequence>
+    <xs:element name="ListRecords"><xs:complexType><xs:sequence>
+      <xs:any namespace="##targetNamespace" processContents="lax"
+              maxOccurs="unbounded"/>
+    </xs:sequence></xs:complexType></xs:element>
+  </xs:sequence></xs:complexType></xs:element>
+  <xs:element name="record"><xs:complexType><xs:sequence>
+    <xs:element name="header"><xs:complexType><xs:sequence>
+      <xs:any processContents="skip" maxOccurs="unbounded"/>
+    </xs:sequence></xs:complexType></xs:element>
+    <xs:element name="metadata" minOccurs="0"><xs:complexType><xs:sequence>
+      <xs:any namespace="##other" processContents="strict"/>
+    </xs:sequence></xs:complexType></xs:element>
+  </xs:sequence></xs:complexType></xs:element>
+</xs:schema>'''
+
+ITEM_XSD = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    targetNamespace="urn:item" elementFormDefault="qualified">
+  <xs:element name="item"><xs:complexType><xs:sequence>
+    <xs:element name="year" type="xs:integer"/>
+  </xs:sequence></xs:complexType></xs:element>
+</xs:schema>'''
+
+PAGE = ('<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><ListRecords>'
+        '%s</ListRecords></OAI-PMH>')
+RECORD = ('<record><header><identifier>%s</identifier></header><metadata>'
+          '<item xmlns="%s"><year>%s</year></item></metadata></record>')
+DELETED = ('<record><header status="deleted"><identifier>d</identifier>'
+           '</header></record>')
+
+
+def page(*records):
+    return PAGE % ''.join(RECORD % r for r in records)
+
+
+class TestValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.oai_xsd = self.write('OAI-PMH.xsd', OAI_XSD)
+        self.item_xsd = self.write('item.xsd', ITEM_XSD)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return path
+
+    def harvest(self, validator, *pages):
+        responses = iter(pages)
+
+        def harvest(**kwargs):
+            return OAIResponse(MockResponse(next(responses)), kwargs)
+
+        with mock.patch('sickle.app.Sickle.harvest', side_effect=harvest):
+            sickle = Sickle('http://localhost', token_expiry_margin=None)
+            return [r.header.identifier for r in sickle.ListRecords(
+                metadataPrefix='x', item_filter=validator)]
+
+    def test_records(self):
+        schemas = SchemaCache({'urn:item': self.item_xsd})
+        validator = MetadataValidator(schemas, endpoint='e',
+                                      drop_invalid=True)
+        identifiers = self.harvest(validator, page(
+            ('a', 'urn:item', '2020'), ('b', 'urn:item', 'never'),
+            ('c', 'urn:other', '2020')).replace(
+                '</ListRecords>', DELETED + '</ListRecords>'))
+        self.assertEqual(identifiers, ['a', 'c', 'd'])
+        stats = validator.stats.for_endpoint('e')
+        self.assertEqual((stats.validated, stats.invalid, stats.unknown),
+                         (2, 1, 1))
+        self.assertEqual(len(stats.messages), 1)
+        self.assertIn("'never' is not a valid value",
+                      list(stats.messages)[0])
+
+    def test_schema_compiled_once(self):
+        schemas = SchemaCache({'urn:item': self.item_xsd},
+                              oai_schema=self.oai_xsd)
+        self.assertIs(schemas.get('urn:item'), schemas.get('urn:item'))
+        self.assertIsNone(schemas.get('urn:other'))
+        self.assertIs(schemas.page_schema(['urn:item']),
+                      schemas.page_schema(set(['urn:item'])))
+        self.assertIsNone(schemas.page_schema(['urn:item', 'urn:other']))
+
+    def test_pages(self):
+        schemas = SchemaCache({'urn:item': self.item_xsd},
+                              oai_schema=self.oai_xsd)
+        validator = MetadataValidator(schemas, endpoint='e')
+        with mock.patch.object(schemas, 'get',
+                               wraps=schemas.get) as get:
+            identifiers = self.harvest(validator, page(
+                ('a', 'urn:item', '2020'), ('b', 'urn:item', '2021')))
+            # The page is valid as a whole
+            self.assertEqual(get.call_count, 0)
+        self.assertEqual(identifiers, ['a', 'b'])
+        stats = validator.stats.for_endpoint('e')
+        self.assertEqual((stats.pages, stats.validated, stats.invalid),
+                         (1, 2, 0))
+
+        validator = MetadataValidator(schemas, endpoint='f',
+                                      stats=validator.stats)
+        self.harvest(validator, page(('a', 'urn:item', '2020'),
+                                     ('b', 'urn:item', 'x')))
+        stats = validator.stats.for_endpoint('f')
+        self.assertEqual((stats.pages, stats.invalid_pages, stats.validated,
+                          stats.invalid), (1, 1, 2, 1))
+        self.assertEqual(sorted(validator.stats.as_dict()), ['e', 'f'])
+
+    def test_sampling(self):
+        schemas = SchemaCache({'urn:item': self.item_xsd})
+        validator = MetadataValidator(schemas, sample_rate=0.5, seed=1)
+        records = [('r%d' % n, 'urn:item', 'x') for n in range(100)]
+        self.assertEqual(len(self.harvest(validator, page(*records))), 100)
+        stats = validator.stats.for_endpoint(None)
+        self.assertEqual(stats.validated + stats.skipped, 100)
+        self.assertEqual(stats.invalid, stats.validated)
+        self.assertTrue(30 < stats.validated < 70)
+
+    def test_register_formats(self):
+        class Format(object):
+            metadataNamespace = 'urn:item'
+            schema = self.item_xsd
+        schemas = SchemaCache()
+        schemas.register_formats([Format()])
+        self.assertEqual(schemas.locations, {'urn:item': self.item_xsd})
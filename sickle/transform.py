@@ -0,0 +1,184 @@
+# coding: utf-8
+"""
+    sickle.transform
+    ~~~~~~~~~~~~~~~~
+
+    Transformation of harvested items with XSLT.
+
+    An :class:`XSLTStage` compiles its stylesheet once per thread (or
+    worker process) and applies it to the parsed XML of each record, or of
+    each page, without serializing it first::
+
+        >>> stage = XSLTStage('oai_dc_to_internal.xsl')
+        >>> for result in stage(sickle.ListRecords(metadataPrefix='oai_dc')):
+        ...     store(bytes(result))
+
+    lxml releases the GIL while a stylesheet runs, so CPU-heavy stylesheets
+    scale over worker threads (``workers=4``); the threads transform copies
+    of the record elements. With ``processes=True`` the items are
+    serialized and transformed in worker processes instead.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import collections
+import copy
+import os
+import threading
+
+from lxml import etree
+
+from sickle.response import get_parser
+
+_local = threading.local()
+
+
+def get_transform(stylesheet):
+    """Return the compiled stylesheet for the current thread.
+
+    Stylesheets are compiled once per thread and reused afterwards, as
+    :class:`lxml.etree.XSLT` objects should not be shared between threads.
+
+    :param stylesheet: The path of the stylesheet or its content as bytes.
+    :type stylesheet: str or bytes
+    :rtype: :class:`lxml.etree.XSLT`
+    """
+    transforms = getattr(_local, 'transforms', None)
+    if transforms is None:
+        transforms = _local.transforms = {}
+    transform = transforms.get(stylesheet)
+    if transform is None:
+        if _is_content(stylesheet):
+            document = etree.XML(stylesheet).getroottree()
+        else:
+            document = etree.parse(stylesheet)
+        transform = transforms[stylesheet] = etree.XSLT(document)
+    return transform
+
+
+def _is_content(stylesheet):
+    # Paths are native strings, which are bytes on Python 2
+    return isinstance(stylesheet, bytes) and \
+        stylesheet.lstrip().startswith(b'<')
+
+
+def _quote(params):
+    return dict((name, etree.XSLT.strparam(value))
+                for name, value in params.items())
+
+
+def _transform_serialized(stylesheet, content, params):
+    """Transform serialized XML in a worker process."""
+    tree = etree.XML(content, parser=get_parser(recover=False))
+    return bytes(get_transform(stylesheet)(tree, **_quote(params)))
+
+
+def _detached(element):
+    """Return `element` or, if it is not the root of its document, a copy.
+
+    lxml temporarily detaches an element that is transformed on its own,
+    which must not happen while other threads walk the same document.
+    """
+    if element.getparent() is None:
+        return element
+    return copy.deepcopy(element)
+
+
+class XSLTStage(object):
+    """Applies an XSLT stylesheet to records, headers or pages.
+
+    Calling the stage with an iterable of items returns an iterator over
+    the results in the order of the items. Items are anything with an
+    ``xml`` attribute (e.g. :class:`sickle.models.Record`) or XML
+    elements. Pages are transformed as a whole: items can be
+    :class:`sickle.response.OAIResponse` objects (from
+    :class:`sickle.iterator.OAIResponseIterator`) or batches of
+    :class:`sickle.iterator.OAIBatchIterator`, in which case the
+    stylesheet is applied to the OAI-PMH response of the batch.
+
+    :param stylesheet: The path of the stylesheet or its content as bytes.
+    :type stylesheet: str or bytes
+    :param workers: The number of worker threads or processes. With 0 the
+                    items are transformed in the calling thread.
+    :type workers: int
+    :param processes: Flag for whether to use worker processes instead of
+                      threads.
+    :type processes: bool
+    :param serialize: Flag for whether to return the results as bytes
+                      instead of result trees.
+    :type serialize: bool
+    :param params: String parameters passed to the stylesheet.
+    """
+
+    def __init__(self, stylesheet, workers=0, processes=False,
+                 serialize=False, **params):
+        if not _is_content(stylesheet):
+            stylesheet = os.path.abspath(stylesheet)
+        self.stylesheet = stylesheet
+        self.workers = workers
+        self.processes = processes
+        self.serialize = serialize
+        self.params = params
+        # Fail early if the stylesheet cannot be compiled
+        get_transform(stylesheet)
+
+    @staticmethod
+    def _element(item):
+        item = getattr(item, 'oai_response', item)
+        return getattr(item, 'xml', item)
+
+    def transform(self, item):
+        """Transform a single item in the calling thread."""
+        result = get_transform(self.stylesheet)(
+            self._element(item), **_quote(self.params))
+        return bytes(result) if self.serialize else result
+
+    def _deserialize(self, result):
+        # Results of worker processes arrive serialized
+        if self.serialize:
+            return result
+        return etree.XML(result, parser=get_parser(recover=False)) \
+            .getroottree()
+
+    def __call__(self, items):
+        if not self.workers:
+            return (self.transform(item) for item in items)
+        if self.processes:
+            return self._in_processes(items)
+        return self._in_threads(items)
+
+    def _in_threads(self, items):
+        from concurrent.futures import ThreadPoolExecutor
+        return self._ordered(ThreadPoolExecutor, items,
+                             lambda executor, item: executor.submit(
+                                 self.transform, _detached(
+                                     self._element(item))),
+                             lambda result: result)
+
+    def _in_processes(self, items):
+        from concurrent.futures import ProcessPoolExecutor
+        return self._ordered(
+            ProcessPoolExecutor, items,
+            lambda executor, item: executor.submit(
+                _transform_serialized, self.stylesheet,
+                etree.tostring(self._element(item)), self.params),
+            self._deserialize)
+
+    def _ordered(self, executor_class, items, submit, result):
+        """Yield the results in order while keeping the number of queued
+        items bounded, so that the items are consumed lazily.
+
+        The executor is created on the first iteration, so that no workers
+        are left behind if the generator is never iterated."""
+        executor = executor_class(max_workers=self.workers)
+        pending = collections.deque()
+        try:
+            for item in items:
+                pending.append(submit(executor, item))
+                if len(pending) >= 2 * self.workers:
+                    yield result(pending.popleft().result())
+            while pending:
+                yield result(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
@@ -8,9 +8,37 @@
     :copyright: Copyright 2015 Mathias Loesch
 """
 
+import datetime
+import importlib
+import logging
 import re
 from collections import defaultdict
 
+logger = logging.getLogger(__name__)
+
+#: The granularity of repositories with datestamps in seconds
+SECONDS_GRANULARITY = 'YYYY-MM-DDThh:mm:ssZ'
+
+
+class LazyModule(object):
+    """Stand-in for a module that is imported on first attribute access.
+
+    :param name: The name of the module.
+    :type name: str
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attribute)
+
+    def __repr__(self):
+        return '<LazyModule %s>' % self.__name
+
 
 def get_namespace(element):
     """Return the namespace of an XML element.
@@ -42,3 +70,103 @@ def xml_to_dict(tree, paths=None, nsmap=None, strip_ns=False):
                 r'\{.*\}', '', element.tag) if strip_ns else element.tag
             fields[tag].append(element.text)
     return dict(fields)
+
+
+def parse_datestamp(value):
+    """Parse an OAI datestamp with day or seconds granularity.
+
+    :param value: A datestamp like ``2015-01-31`` or ``2015-01-31T12:00:00Z``.
+    :type value: str
+    :returns: The datestamp as naive UTC datetime or :obj:`None` if it
+              cannot be parsed.
+    :rtype: :class:`datetime.datetime`
+    """
+    if not value:
+        return None
+    value = value.strip()
+    for length, fmt in ((19, '%Y-%m-%dT%H:%M:%S'), (10, '%Y-%m-%d')):
+        try:
+            return datetime.datetime.strptime(value[:length], fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def repository_granularity(sickle):
+    """Return the datestamp granularity announced by the Identify response
+    of a repository. Every repository supports days, which are assumed
+    (:obj:`None`) if Identify fails.
+
+    :param sickle: The client for the repository.
+    :type sickle: :class:`sickle.app.Sickle`
+    """
+    try:
+        return getattr(sickle.Identify(), 'granularity', None)
+    except Exception as error:
+        logger.warning('Identify failed, assuming day granularity: %s'
+                       % error)
+        return None
+
+
+def truncate_datestamp(value, granularity):
+    """Truncate a datestamp to the date unless `granularity` is
+    :data:`SECONDS_GRANULARITY`, so that it can be used as `from` or
+    `until` argument.
+
+    :param value: A datestamp like ``2015-01-31T12:00:00Z``.
+    :type value: str
+    :param granularity: The granularity of the repository.
+    :type granularity: str
+    """
+    if granularity == SECONDS_GRANULARITY:
+        return value
+    return value[:10]
+
+
+def parse_date(value):
+    """Parse the date part of an OAI datestamp.
+
+    :param value: A datestamp like ``2015-01-31`` or ``2015-01-31T12:00:00Z``.
+    :type value: str
+    :rtype: :class:`datetime.date`
+    """
+    return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+def date_windows(start, end, unit='month'):
+    """Split the days from `start` to `end` (inclusive) into windows.
+
+    Returns a list of ``(from, until)`` tuples of dates formatted as
+    ``YYYY-MM-DD`` that can be used as ``from`` and ``until`` arguments::
+
+        >>> date_windows('2015-01-15', '2015-03-01')
+        [('2015-01-15', '2015-01-31'), ('2015-02-01', '2015-02-28'),
+         ('2015-03-01', '2015-03-01')]
+
+    :param start: The first day.
+    :type start: str or :class:`datetime.date`
+    :param end: The last day.
+    :type end: str or :class:`datetime.date`
+    :param unit: ``year``, ``month``, ``day`` or a number of days.
+    :type unit: str or int
+    """
+    if not isinstance(start, datetime.date):
+        start = parse_date(start)
+    if not isinstance(end, datetime.date):
+        end = parse_date(end)
+    windows = []
+    current = start
+    while current <= end:
+        if unit == 'year':
+            next_start = datetime.date(current.year + 1, 1, 1)
+        elif unit == 'month':
+            next_start = datetime.date(
+                current.year + current.month // 12, current.month % 12 + 1, 1)
+        elif unit == 'day':
+            next_start = current + datetime.timedelta(days=1)
+        else:
+            next_start = current + datetime.timedelta(days=int(unit))
+        until = min(next_start - datetime.timedelta(days=1), end)
+        windows.append((current.isoformat(), until.isoformat()))
+        current = next_start
+    return windows
@@ -0,0 +1,311 @@
+# coding: utf-8
+"""
+    sickle.validate
+    ~~~~~~~~~~~~~~~
+
+    Validation of harvested metadata against XML schemas.
+
+    Schemas are registered per metadata namespace, for instance from the
+    ``schema`` of the formats listed by the repository, and compiled once
+    per thread. A :class:`MetadataValidator` is an item filter (see
+    :mod:`sickle.filters`) that validates the metadata of a sample of the
+    records and keeps statistics per endpoint::
+
+        >>> schemas = SchemaCache(oai_schema='schemas/OAI-PMH.xsd')
+        >>> schemas.register_formats(sickle.ListMetadataFormats())
+        >>> validator = MetadataValidator(schemas, endpoint=sickle.endpoint,
+        ...                               sample_rate=0.1)
+        >>> for record in sickle.ListRecords(metadataPrefix='oai_dc',
+        ...                                  item_filter=validator):
+        ...     pass
+        >>> validator.stats.for_endpoint(sickle.endpoint).invalid
+        3
+
+    If the OAI-PMH schema is given, whole pages are validated in one call
+    and only the records of invalid pages are validated one by one.
+
+    Schemas are loaded with lxml, which reads files and ``http`` URLs. Use
+    local copies of schemas that are only available over ``https``.
+
+    :copyright: Copyright 2015 Mathias Loesch
+"""
+import logging
+import random
+import threading
+from collections import Counter
+
+from lxml import etree
+
+from sickle._compat import monotonic
+
+logger = logging.getLogger(__name__)
+
+OAI_NAMESPACE = 'http://www.openarchives.org/OAI/2.0/'
+
+_WRAPPER = ('<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">'
+            '%s</xs:schema>')
+_IMPORT = '<xs:import namespace="%s" schemaLocation="%s"/>'
+
+
+def _quote(value):
+    return value.replace('&', '&amp;').replace('"', '&quot;') \
+        .replace('<', '&lt;')
+
+
+class SchemaCache(object):
+    """Compiled XML schemas by namespace.
+
+    Each schema is compiled once per thread on first use, as
+    :class:`lxml.etree.XMLSchema` objects should not be shared between
+    threads.
+
+    :param locations: A dictionary mapping namespaces to the paths or URLs
+                      of their schemas.
+    :type locations: dict
+    :param oai_schema: The path or URL of the OAI-PMH schema, which enables
+                       the validation of whole pages.
+    :type oai_schema: str
+    """
+
+    def __init__(self, locations=None, oai_schema=None):
+        self.locations = dict(locations or {})
+        self.oai_schema = oai_schema
+        self._local = threading.local()
+
+    def register(self, namespace, location):
+        """Register the schema of a namespace."""
+        self.locations[namespace] = location
+
+    def register_formats(self, formats):
+        """Register the schemas of metadata formats.
+
+        :param formats: An iterable of :class:`sickle.models.MetadataFormat`
+                        objects, e.g. the result of
+                        :meth:`sickle.app.Sickle.ListMetadataFormats`.
+        """
+        for metadata_format in formats:
+            namespace = getattr(metadata_format, 'metadataNamespace', None)
+            schema = getattr(metadata_format, 'schema', None)
+            if namespace and schema:
+                self.register(namespace, schema)
+
+    def _compiled(self):
+        compiled = getattr(self._local, 'compiled', None)
+        if compiled is None:
+            compiled = self._local.compiled = {}
+        return compiled
+
+    def get(self, namespace):
+        """Return the schema of `namespace` or :obj:`None` if no schema is
+        registered.
+
+        :rtype: :class:`lxml.etree.XMLSchema`
+        """
+        location = self.locations.get(namespace)
+        if location is None:
+            return None
+        compiled = self._compiled()
+        schema = compiled.get(location)
+        if schema is None:
+            schema = compiled[location] = etree.XMLSchema(
+                etree.parse(location))
+        return schema
+
+    def page_schema(self, namespaces):
+        """Return a schema for OAI-PMH responses with metadata in the given
+        namespaces or :obj:`None` if a schema is missing.
+
+        :param namespaces: The namespaces of the metadata.
+        :rtype: :class:`lxml.etree.XMLSchema`
+        """
+        if self.oai_schema is None or \
+                any(n not in self.locations for n in namespaces):
+            return None
+        key = (self.oai_schema,) + tuple(sorted(namespaces))
+        compiled = self._compiled()
+        schema = compiled.get(key)
+        if schema is None:
+            imports = [(OAI_NAMESPACE, self.oai_schema)] + [
+                (n, self.locations[n]) for n in sorted(namespaces)]
+            schema = compiled[key] = etree.XMLSchema(etree.XML(
+                _WRAPPER % ''.join(_IMPORT % (_quote(n), _quote(l))
+                                   for n, l in imports)))
+        return schema
+
+
+class EndpointStats(object):
+    """Validation statistics of one endpoint.
+
+    :param max_messages: The number of distinct error messages counted.
+    """
+
+    def __init__(self, max_messages=100):
+        #: Records that were validated
+        self.validated = 0
+        #: Validated records that are invalid
+        self.invalid = 0
+        #: Records that were not sampled
+        self.skipped = 0
+        #: Records with metadata in a namespace without schema
+        self.unknown = 0
+        #: Pages validated in one call, and how many of them were invalid
+        self.pages = 0
+        self.invalid_pages = 0
+        #: Time spent validating in seconds
+        self.seconds = 0.0
+        #: Counts of error messages
+        self.messages = Counter()
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+
+    def add(self, error_log=None, seconds=0.0, **counts):
+        """Add counts, the validation time and the messages of an error
+        log."""
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+            self.seconds += seconds
+            for error in error_log or ():
+                if error.message in self.messages or \
+                        len(self.messages) < self.max_messages:
+                    self.messages[error.message] += 1
+
+    def as_dict(self):
+        return {
+            'validated': self.validated,
+            'invalid': self.invalid,
+            'skipped': self.skipped,
+            'unknown': self.unknown,
+            'pages': self.pages,
+            'invalid_pages': self.invalid_pages,
+            'seconds': self.seconds,
+            'messages': dict(self.messages),
+        }
+
+    def __repr__(self):
+        return '<EndpointStats validated=%d invalid=%d>' % (
+            self.validated, self.invalid)
+
+
+class ValidationStats(object):
+    """Validation statistics by endpoint. Can be shared between validators
+    and threads."""
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def for_endpoint(self, endpoint):
+        """Return the :class:`EndpointStats` of `endpoint`."""
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            return stats
+
+    def as_dict(self):
+        with self._lock:
+            return dict((endpoint, stats.as_dict())
+                        for endpoint, stats in self._endpoints.items())
+
+
+class MetadataValidator(object):
+    """Item filter that validates the metadata of records.
+
+    Records are sampled with probability `sample_rate`; if whole pages are
+    validated, pages are sampled instead. Headers and records without
+    metadata are not validated. A validator is meant for one iterator at a
+    time; use one per thread, they can share a :class:`ValidationStats`.
+
+    :param schemas: The schemas to validate against.
+    :type schemas: :class:`SchemaCache`
+    :param endpoint: The endpoint the statistics are kept for.
+    :type endpoint: str
+    :param sample_rate: The fraction of records or pages to validate.
+    :type sample_rate: float
+    :param drop_invalid: Flag for whether to skip invalid records.
+    :type drop_invalid: bool
+    :param stats: The statistics to update (a new object by default).
+    :type stats: :class:`ValidationStats`
+    :param seed: Seed for the random sampling.
+    """
+
+    def __init__(self, schemas, endpoint=None, sample_rate=1.0,
+                 drop_invalid=False, stats=None, seed=None):
+        self.schemas = schemas
+        self.endpoint = endpoint
+        self.sample_rate = sample_rate
+        self.drop_invalid = drop_invalid
+        self.stats = stats if stats is not None else ValidationStats()
+        self._stats = self.stats.for_endpoint(endpoint)
+        self._random = random.Random(seed)
+        self._page = None
+        # None: the page is not sampled, True: it is valid as a whole,
+        # False: its records are validated one by one
+        self._page_state = None
+
+    def _sampled(self):
+        return self.sample_rate >= 1 or \
+            self._random.random() < self.sample_rate
+
+    def _metadata(self, element):
+        namespace = element.tag.rpartition('}')[0] + '}'
+        metadata = element.find(namespace + 'metadata')
+        if metadata is None or not len(metadata):
+            return None
+        return metadata[0]
+
+    def _start_page(self, root):
+        self._page = root
+        if not self._sampled():
+            self._page_state = None
+            return
+        self._page_state = False
+        namespaces = set()
+        for metadata in root.iterfind(
+                '{%s}ListRecords/{%s}record/{%s}metadata' % (
+                    (OAI_NAMESPACE,) * 3)):
+            if len(metadata):
+                namespaces.add(etree.QName(metadata[0]).namespace)
+        schema = self.schemas.page_schema(namespaces)
+        if schema is None:
+            return
+        start = monotonic()
+        valid = schema.validate(root)
+        self._stats.add(seconds=monotonic() - start, pages=1,
+                        invalid_pages=0 if valid else 1)
+        self._page_state = valid
+
+    def __call__(self, element):
+        metadata = self._metadata(element)
+        if metadata is None:
+            return True
+        if self.schemas.oai_schema is not None:
+            root = element.getroottree().getroot()
+            if root is not self._page:
+                self._start_page(root)
+            if self._page_state is None:
+                self._stats.add(skipped=1)
+                return True
+            if self._page_state:
+                self._stats.add(validated=1)
+                return True
+        elif not self._sampled():
+            self._stats.add(skipped=1)
+            return True
+        schema = self.schemas.get(etree.QName(metadata).namespace)
+        if schema is None:
+            self._stats.add(unknown=1)
+            return True
+        start = monotonic()
+        valid = schema.validate(metadata)
+        seconds = monotonic() - start
+        if valid:
+            self._stats.add(seconds=seconds, validated=1)
+            return True
+        self._stats.add(schema.error_log, seconds=seconds, validated=1,
+                        invalid=1)
+        logger.info('Invalid metadata in %s: %s' % (
+            element.findtext('.//{%s}identifier' % OAI_NAMESPACE),
+            schema.error_log.last_error))
+        return not self.drop_invalid